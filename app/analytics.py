@@ -0,0 +1,45 @@
+"""
+Обслуживание сверток аналитики перемещений (route_transit_buckets, product_transit_buckets).
+
+Свертки пополняются при обработке событий; rebuild пересчитывает их по таблице
+movements — для заполнения после миграции или после сбоя в режиме отложенной записи.
+Перед пересчетом остановите потребители Kafka.
+
+Запуск:
+  python -m app.analytics rebuild
+"""
+import argparse
+import asyncio
+import logging
+
+from app.core.logging_config import configure_logging_from_settings, stop_logging
+
+logger = logging.getLogger(__name__)
+
+
+async def _run(args):
+    from app.models.database import database
+    from app.services.analytics import rebuild_transit_rollups
+
+    await database.connect()
+    try:
+        await rebuild_transit_rollups()
+    finally:
+        await database.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild", help="пересчитать свертки по завершенным перемещениям")
+    args = parser.parse_args()
+
+    configure_logging_from_settings()
+    try:
+        asyncio.run(_run(args))
+    finally:
+        stop_logging()
+
+
+if __name__ == "__main__":
+    main()
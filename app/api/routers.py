@@ -1,25 +1,249 @@
-from fastapi import APIRouter, HTTPException, Depends
-from app.models.schemas import MovementInfo, WarehouseState
-from app.services.warehouse_services import get_movement_info_sync, get_warehouse_state_sync
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
+from app.models.schemas import (
+    MovementInfo,
+    WarehouseState,
+    StockBatchRequest,
+    MovementBatchRequest,
+    WarehouseStockPage,
+    MovementPage,
+    DeadLetterPage,
+    DeadLetterReplayRequest,
+    DeadLetterReplayResult,
+    RouteTransitStats,
+    ProductTransitStats,
+)
+from app.services.warehouse_services import (
+    get_movement_info,
+    get_movement_info_sync,
+    get_warehouse_state,
+    get_warehouse_state_as_of,
+    get_warehouse_state_as_of_sync,
+    get_warehouse_state_sync,
+    iter_movement_rows,
+    iter_movements,
+    iter_stock_rows,
+    iter_warehouse_states,
+    list_product_movements,
+    list_warehouse_stock,
+)
+from app.services.dead_letter import list_dead_letters, replay_dead_letters
+from app.services.analytics import product_stats, route_stats
+from app.services.stock_stream import sse_events, stock_hub
+from app.services.export import MEDIA_TYPES, MOVEMENT_COLUMNS, STOCK_COLUMNS, encode_rows
 from app.models.database import get_db
+from app.core.config import settings
 from sqlalchemy.orm import Session
 import logging
+from datetime import datetime
+from typing import List, Literal, Optional
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-@router.get("/movements/{movement_id}", response_model=MovementInfo)
-def read_movement(movement_id: str, db: Session = Depends(get_db)):
+# as_of сравнивается с временем записи изменения в журнал (recorded_at), а не со временем
+# события из Kafka: остаток после изменения (quantity_after) определен только в порядке обработки
+_AS_OF = Query(
+    None,
+    description="Момент времени обработки (записи изменения в журнал stock_events), а не времени события; "
+                "без часового пояса — UTC",
+)
+
+async def _json_array_response(items) -> StreamingResponse:
+    """
+    Отдает асинхронный поток моделей JSON-массивом по одному элементу. Первый элемент
+    читается до начала ответа, поэтому ошибка первого запроса к БД возвращается как 500.
+    Ошибка после начала ответа логируется и обрывает соединение без закрывающей скобки:
+    клиент получает прерванный ответ, а не усеченный, но корректный массив.
+    """
+    items = items.__aiter__()
+    try:
+        first = [await items.__anext__()]
+    except StopAsyncIteration:
+        first = []
+    except Exception as e:
+        logger.error("Ошибка при чтении данных для ответа: %s", e)
+        raise HTTPException(status_code=500, detail="Ошибка при получении данных")
+
+    async def body():
+        yield "[" + "".join(item.model_dump_json() for item in first)
+        if not first:
+            yield "]"
+            return
+        sent = 1
+        try:
+            async for item in items:
+                yield "," + item.model_dump_json()
+                sent += 1
+        except Exception as e:
+            logger.error("Ответ прерван после %s элементов: %s", sent, e)
+            raise
+        yield "]"
+
+    return StreamingResponse(body(), media_type="application/json")
+
+def _export_response(rows, columns, export_format: str, name: str) -> StreamingResponse:
+    return StreamingResponse(
+        encode_rows(rows, columns, export_format),
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{export_format}"'},
+    )
+
+# Выгрузки объявлены до /movements/{movement_id}, иначе "export" разбирался бы как ID
+@router.get("/movements/export")
+async def export_movements(
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    product_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """
+    Потоковая выгрузка перемещений в NDJSON или CSV. Период [since, until) — по времени отправки
+    """
+    return _export_response(iter_movement_rows(product_id, since, until), MOVEMENT_COLUMNS, export_format, "movements")
+
+@router.get("/warehouses/{warehouse_id}/export")
+async def export_warehouse_stock(
+    warehouse_id: str,
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    product_id: Optional[str] = None,
+):
+    """
+    Потоковая выгрузка остатков склада в NDJSON или CSV
+    """
+    return _export_response(iter_stock_rows(warehouse_id, product_id), STOCK_COLUMNS, export_format, warehouse_id)
+
+if settings.API_SYNC_READS:
+    # Прежний путь через синхронную сессию: каждый запрос занимает поток из пула.
+    # Оставлен для сравнения в нагрузочном тесте (benchmarks/bench_api_load.py)
+    @router.get("/movements/{movement_id}", response_model=MovementInfo)
+    def read_movement(movement_id: str, db: Session = Depends(get_db)):
+        """
+        Получение информации о перемещении товара по ID
+        """
+        movement = get_movement_info_sync(db, movement_id)
+        if movement is None:
+            raise HTTPException(status_code=404, detail="Перемещение не найдено")
+        return movement
+
+    @router.get("/warehouses/{warehouse_id}/products/{product_id}", response_model=WarehouseState)
+    def read_warehouse_state(warehouse_id: str, product_id: str, as_of: Optional[datetime] = _AS_OF,
+                             db: Session = Depends(get_db)):
+        """
+        Получение информации о текущем запасе товара на складе или о запасе на момент
+        обработки as_of
+        """
+        if as_of is not None:
+            return get_warehouse_state_as_of_sync(db, warehouse_id, product_id, as_of)
+        return get_warehouse_state_sync(db, warehouse_id, product_id)
+else:
+    @router.get("/movements/{movement_id}", response_model=MovementInfo)
+    async def read_movement(movement_id: str):
+        """
+        Получение информации о перемещении товара по ID
+        """
+        movement = await get_movement_info(movement_id)
+        if movement is None:
+            raise HTTPException(status_code=404, detail="Перемещение не найдено")
+        return movement
+
+    @router.get("/warehouses/{warehouse_id}/products/{product_id}", response_model=WarehouseState)
+    async def read_warehouse_state(warehouse_id: str, product_id: str, as_of: Optional[datetime] = _AS_OF):
+        """
+        Получение информации о текущем запасе товара на складе или о запасе на момент
+        обработки as_of
+        """
+        if as_of is not None:
+            return await get_warehouse_state_as_of(warehouse_id, product_id, as_of)
+        return await get_warehouse_state(warehouse_id, product_id)
+
+@router.post("/warehouses/stock:batchGet", response_model=List[WarehouseState])
+async def batch_get_warehouse_states(request: StockBatchRequest):
+    """
+    Получение остатков для набора пар склад/товар одним запросом.
+    Пары без записи возвращаются с quantity=0
+    """
+    keys = [(item.warehouse_id, item.product_id) for item in request.items]
+    return await _json_array_response(iter_warehouse_states(keys))
+
+@router.post("/movements:batchGet", response_model=List[MovementInfo])
+async def batch_get_movements(request: MovementBatchRequest):
+    """
+    Получение перемещений по набору ID одним запросом. Ненайденные ID пропускаются
+    """
+    return await _json_array_response(iter_movements(request.movement_ids))
+
+@router.get("/warehouses/{warehouse_id}/products", response_model=WarehouseStockPage)
+async def list_warehouse_products(
+    warehouse_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+):
+    """
+    Постраничный список всех остатков склада. Следующая страница запрашивается с cursor=next_cursor
+    """
+    return await list_warehouse_stock(warehouse_id, limit, cursor)
+
+@router.get("/products/{product_id}/movements", response_model=MovementPage)
+async def list_movements_for_product(
+    product_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+):
+    """
+    Постраничный список перемещений товара по времени отправки. Следующая страница — cursor=next_cursor
+    """
+    return await list_product_movements(product_id, limit, cursor)
+
+@router.get("/dead-letters", response_model=DeadLetterPage)
+async def list_dead_letter_events(
+    status: Optional[str] = None,
+    reason: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    after_id: Optional[int] = None,
+):
+    """
+    Записи Kafka, которые не удалось разобрать или применить. Следующая страница — after_id=next_after_id
+    """
+    return await list_dead_letters(status, reason, limit, after_id)
+
+@router.post("/dead-letters:replay", response_model=DeadLetterReplayResult)
+async def replay_dead_letter_events(request: DeadLetterReplayRequest):
+    """
+    Возвращает отобранные записи (по статусу, ID и причине) в очередь повторной обработки
+    """
+    requeued = await replay_dead_letters(request.status, request.ids, request.reason)
+    return DeadLetterReplayResult(requeued=requeued)
+
+@router.get("/analytics/routes", response_model=List[RouteTransitStats])
+async def get_route_analytics(source: Optional[str] = None, destination: Optional[str] = None):
+    """
+    Время в пути (p50, p95, среднее) и суммарное расхождение количества по маршрутам между складами
+    """
+    return await route_stats(source, destination)
+
+@router.get("/analytics/products", response_model=List[ProductTransitStats])
+async def get_product_analytics(product_id: Optional[str] = None):
     """
-    Получение информации о перемещении товара по ID
+    Время в пути (p50, p95, среднее) и суммарное расхождение количества по товарам
     """
-    movement = get_movement_info_sync(db, movement_id)
-    if movement is None:
-        raise HTTPException(status_code=404, detail="Перемещение не найдено")
-    return movement
+    return await product_stats(product_id)
 
-@router.get("/warehouses/{warehouse_id}/products/{product_id}", response_model=WarehouseState)
-def read_warehouse_state(warehouse_id: str, product_id: str, db: Session = Depends(get_db)):
+@router.get("/stream/stock")
+async def stream_stock_changes(
+    warehouse_id: List[str] = Query([]),
+    product_id: List[str] = Query([]),
+):
     """
-    Получение информации о текущем запасе товара на складе
+    Поток изменений остатков (Server-Sent Events) по складам и/или товарам вместо опроса.
+    Частые изменения одной позиции склеиваются; отставший клиент получает event: dropped
     """
-    return get_warehouse_state_sync(db, warehouse_id, product_id) 
\ No newline at end of file
+    if not warehouse_id and not product_id:
+        raise HTTPException(status_code=400, detail="Укажите warehouse_id или product_id")
+    subscription = stock_hub.subscribe(warehouse_id, product_id)
+    return StreamingResponse(
+        sse_events(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
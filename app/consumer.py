@@ -0,0 +1,147 @@
+"""
+Отдельный процесс потребителя Kafka, независимый от uvicorn.
+
+Запускает N рабочих процессов в одной группе потребителей: брокер распределяет
+между ними партиции темы, и каждая партиция в любой момент читается ровно одним
+воркером. Чтобы все события одного перемещения попадали к одному воркеру и
+применялись по порядку, продюсер должен публиковать их с ключом movement_id
+(стандартный партиционер Kafka направляет одинаковые ключи в одну партицию).
+
+SIGTERM/SIGINT останавливает воркеры через KafkaConsumerService.stop(): каждый
+дорабатывает текущую пачку, фиксирует смещения и покидает группу, а оставшиеся
+получают его партиции при ребалансе. Упавший воркер перезапускается.
+
+При STOCK_WRITE_BEHIND=true писатель остатков должен быть один: запуск с
+--workers больше 1 или с KAFKA_EMBEDDED_CONSUMER=true отклоняется, а воркер,
+не получивший роль писателя (ее держит другой процесс), останавливает запуск.
+
+Запуск: python -m app.consumer --workers 4
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+
+from app.core.config import settings
+from app.core.logging_config import configure_logging_from_settings, stop_logging
+
+logger = logging.getLogger(__name__)
+
+# Код завершения воркера, которому не досталась роль писателя остатков: не перезапускается
+WRITER_CONFLICT_EXIT_CODE = 3
+
+
+def run_worker(worker_id: int):
+    """Тело рабочего процесса: цикл событий для БД в фоновом потоке, poll — в основном"""
+    from app.models.database import database
+    from app.services.change_notifications import change_notifier
+    from app.services.dead_letter import retry_periodically
+    from app.services.kafka_consumer import KafkaConsumerService
+    from app.services.stock_buffer import WriterConflict, stock_buffer
+
+    configure_logging_from_settings()
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(database.connect(), loop).result()
+    # Кэши и поток остатков API живут в другом процессе: изменения доходят до него через NOTIFY
+    change_notifier.enable()
+    retrier = None
+    exit_code = 0
+
+    try:
+        asyncio.run_coroutine_threadsafe(stock_buffer.claim_writer(), loop).result()
+        # Повторы событий из dead letter; воркеры забирают записи атомарно и не пересекаются
+        retrier = asyncio.run_coroutine_threadsafe(retry_periodically(
+            settings.DEAD_LETTER_RETRY_INTERVAL_MS / 1000, settings.DEAD_LETTER_RETRY_BATCH_SIZE
+        ), loop)
+
+        service = KafkaConsumerService(
+            bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+            topic=settings.KAFKA_TOPIC,
+            loop=loop
+        )
+        signal.signal(signal.SIGTERM, lambda *_: service.stop())
+        signal.signal(signal.SIGINT, lambda *_: service.stop())
+        logger.info(f"Воркер потребителя {worker_id} запущен")
+        service.run()
+        if service.failed:
+            # Смещения не зафиксированы: события получит перезапущенный воркер
+            exit_code = 1
+    except WriterConflict as e:
+        logger.error(f"Воркер потребителя {worker_id} не запущен: {e}")
+        exit_code = WRITER_CONFLICT_EXIT_CODE
+    finally:
+        if retrier is not None:
+            retrier.cancel()
+        asyncio.run_coroutine_threadsafe(stock_buffer.release_writer(), loop).result()
+        asyncio.run_coroutine_threadsafe(database.disconnect(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+        logger.info(f"Воркер потребителя {worker_id} остановлен")
+        stop_logging()
+    sys.exit(exit_code)
+
+
+def supervise(workers: int, restart_delay: float = 1.0):
+    """Запускает воркеры и перезапускает упавшие, пока не получен сигнал остановки"""
+    context = multiprocessing.get_context("spawn")
+    stopping = threading.Event()
+    processes = {}
+
+    def start(worker_id):
+        process = context.Process(target=run_worker, args=(worker_id,), name=f"consumer-{worker_id}")
+        process.start()
+        processes[worker_id] = process
+
+    def shutdown(*_):
+        stopping.set()
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for worker_id in range(workers):
+        start(worker_id)
+
+    while not stopping.is_set():
+        for worker_id, process in list(processes.items()):
+            if not process.is_alive() and process.exitcode == WRITER_CONFLICT_EXIT_CODE:
+                logger.error("Роль писателя остатков занята другим процессом, потребитель остановлен")
+                shutdown()
+                break
+            if not process.is_alive() and not stopping.is_set():
+                logger.warning(f"Воркер {worker_id} завершился с кодом {process.exitcode}, перезапуск")
+                time.sleep(restart_delay)
+                start(worker_id)
+        stopping.wait(1.0)
+
+    for process in processes.values():
+        process.join()
+    logger.info("Все воркеры потребителя остановлены")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=settings.KAFKA_CONSUMER_WORKERS)
+    args = parser.parse_args()
+    if settings.STOCK_WRITE_BEHIND and (args.workers > 1 or settings.KAFKA_EMBEDDED_CONSUMER):
+        parser.error(
+            "STOCK_WRITE_BEHIND=true требует одного писателя остатков: "
+            "--workers 1 и KAFKA_EMBEDDED_CONSUMER=false для API"
+        )
+
+    configure_logging_from_settings()
+    supervise(args.workers)
+    stop_logging()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Настройка логирования сервиса.
+
+На горячем пути сообщения пишутся в ленивом виде (logger.info("... %s", value)):
+строка собирается, только если запись прошла уровень и фильтры. RateLimitFilter
+ограничивает число записей каждого типа (места вызова) в секунду и может
+сэмплировать записи ниже WARNING. В асинхронном режиме запись уходит в очередь
+как есть, а форматирование и ввод-вывод выполняет отдельный поток QueueListener.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import Counter
+
+log_records_dropped = Counter(
+    "log_records_dropped", "Записи лога, отброшенные ограничителем, сэмплированием или переполнением очереди",
+    ("reason",)
+)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Пропускает не более rate_limit записей с одного места вызова в секунду (0 — без ограничения)
+    и долю sample_rate записей ниже WARNING. Ошибки и критические записи не ограничиваются.
+
+    Счетчики без блокировок: под GIL возможен лишь небольшой перебор лимита в гонке.
+    """
+
+    def __init__(self, rate_limit: int = 0, sample_rate: float = 1.0):
+        super().__init__()
+        self.rate_limit = rate_limit
+        self.sample_rate = sample_rate
+        self._windows: Dict[Tuple[str, int], list] = {}
+        self._rate_limited = log_records_dropped.labels("rate_limit")
+        self._sampled = log_records_dropped.labels("sampling")
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+        if self.sample_rate < 1.0 and record.levelno < logging.WARNING and random.random() >= self.sample_rate:
+            self._sampled.inc()
+            return False
+        if self.rate_limit <= 0:
+            return True
+
+        second = int(record.created)
+        # Тип сообщения — место вызова: число ключей ограничено числом вызовов логгера в коде
+        key = (record.name, record.lineno)
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = [second, 0]
+        if window[0] != second:
+            window[0], window[1] = second, 0
+        window[1] += 1
+        if window[1] > self.rate_limit:
+            self._rate_limited.inc()
+            return False
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение, шаблон и аргументы"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.args:
+            entry["template"] = str(record.msg)
+            entry["args"] = [arg if isinstance(arg, (int, float, bool)) or arg is None else str(arg)
+                             for arg in (record.args if isinstance(record.args, tuple) else (record.args,))]
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, который не форматирует запись в вызывающем потоке.
+
+    Стандартный prepare() склеивает сообщение с аргументами до постановки в очередь,
+    то есть на горячем пути. Здесь запись передается как есть: очередь живет внутри
+    процесса, а аргументы логирования — неизменяемые значения и строки БД. При
+    переполнении очереди запись отбрасывается, а не блокирует поток.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.labels("queue_full").inc()
+
+
+def configure_logging(level: str = "INFO", log_format: str = "text", async_mode: bool = True,
+                      rate_limit: int = 0, sample_rate: float = 1.0, queue_size: int = 10000):
+    """Настраивает корневой логгер; повторный вызов заменяет прежнюю конфигурацию"""
+    global _listener
+    stop_logging()
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if log_format == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+    handler: logging.Handler = stream_handler
+    if async_mode:
+        handler = DeferredQueueHandler(queue.Queue(queue_size))
+        _listener = logging.handlers.QueueListener(handler.queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+    handler.addFilter(RateLimitFilter(rate_limit, sample_rate))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+
+def configure_logging_from_settings():
+    configure_logging(
+        level=settings.LOG_LEVEL,
+        log_format=settings.LOG_FORMAT,
+        async_mode=settings.LOG_ASYNC,
+        rate_limit=settings.LOG_RATE_LIMIT,
+        sample_rate=settings.LOG_SAMPLE_RATE,
+        queue_size=settings.LOG_QUEUE_SIZE
+    )
+
+
+def stop_logging():
+    """Останавливает поток записи, дописав накопленные в очереди записи"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
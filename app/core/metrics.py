@@ -0,0 +1,270 @@
+"""
+Метрики в формате Prometheus без внешних зависимостей.
+
+Счетчики не используют блокировок: каждую метрику пишет в основном один поток
+(цикл событий для API и БД, поток потребителя для Kafka), а инкремент элемента
+списка под GIL дешевле любой синхронизации. Дочерние метрики с метками создаются
+один раз и кэшируются, поэтому на горячем пути нет аллокаций, кроме float.
+"""
+import asyncio
+import functools
+import inspect
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+        REGISTRY.register(self)
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """Дочерняя метрика для одного набора значений меток"""
+
+    def _samples(self) -> Iterable[str]:
+        if not self.labelnames:
+            yield from self._child_samples((), self)
+            return
+        for values, child in list(self._children.items()):
+            yield from self._child_samples(values, child)
+
+    @abstractmethod
+    def _child_samples(self, values, child) -> Iterable[str]:
+        """Строки экспозиции для дочерней метрики child с метками values"""
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.type}"
+        yield from self._samples()
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.value = 0.0
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        child = Counter.__new__(Counter)
+        child.value = 0.0
+        return child
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def _child_samples(self, values, child):
+        yield f"{self.name}_total{_format_labels(self.labelnames, values)} {child.value}"
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.value = 0.0
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        child = Gauge.__new__(Gauge)
+        child.value = 0.0
+        return child
+
+    def set(self, value: float):
+        self.value = value
+
+    def _child_samples(self, values, child):
+        yield f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._init_state(self)
+        super().__init__(name, documentation, labelnames)
+
+    def _init_state(self, target):
+        target.buckets = self.buckets
+        # Последний элемент — корзина +Inf
+        target.counts = [0] * (len(self.buckets) + 1)
+        target.sum = 0.0
+
+    def _new_child(self):
+        child = Histogram.__new__(Histogram)
+        self._init_state(child)
+        return child
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def _child_samples(self, values, child):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}"
+        yield f"{self.name}_sum{_format_labels(self.labelnames, values)} {child.sum}"
+        yield f"{self.name}_count{_format_labels(self.labelnames, values)} {cumulative}"
+
+
+class CallbackMetric:
+    """Метрика, значения которой вычисляются при сборе (например, счетчики кэша)"""
+
+    def __init__(self, name: str, documentation: str, type_: str, labelnames: Tuple[str, ...],
+                 callback: Callable[[], Dict[Tuple[str, ...], float]]):
+        self.name = name
+        self.documentation = documentation
+        self.type = type_
+        self.labelnames = labelnames
+        self.callback = callback
+        REGISTRY.register(self)
+
+    def render(self) -> Iterable[str]:
+        suffix = "_total" if self.type == "counter" else ""
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.type}"
+        for values, value in self.callback().items():
+            yield f"{self.name}{suffix}{_format_labels(self.labelnames, values)} {value}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Длительность обработки HTTP-запроса", ("method", "route", "status")
+)
+db_query_duration = Histogram(
+    "db_query_duration_seconds", "Длительность обращений к БД по функциям warehouse_services", ("function",)
+)
+kafka_messages = Counter(
+    "kafka_messages", "Сообщения Kafka по результату обработки", ("result",)
+)
+kafka_batch_size = Histogram(
+    "kafka_batch_size", "Размер пачки сообщений Kafka", buckets=(1, 10, 50, 100, 250, 500, 1000, 5000)
+)
+kafka_consumer_lag = Gauge(
+    "kafka_consumer_lag", "Максимальное отставание потребителя по партициям, сообщений"
+)
+kafka_assigned_partitions = Gauge(
+    "kafka_assigned_partitions", "Число партиций, назначенных потребителю этого процесса"
+)
+kafka_consumer_restarts = Counter(
+    "kafka_consumer_restarts", "Перезапуски цикла потребителя Kafka после сбоя"
+)
+event_loop_lag = Histogram(
+    "event_loop_lag_seconds", "Задержка пробуждения цикла событий относительно ожидаемой"
+)
+event_loop_blocked = Counter(
+    "event_loop_blocked_seconds", "Суммарное время блокировки цикла событий"
+)
+
+KAFKA_PROCESSED = kafka_messages.labels("processed")
+KAFKA_FAILED = kafka_messages.labels("failed")
+KAFKA_INVALID = kafka_messages.labels("invalid")
+
+
+def timed(function_name: str = None):
+    """Декоратор: время выполнения функции в db_query_duration_seconds{function=...}"""
+    def decorator(func):
+        histogram = db_query_duration.labels(function_name or func.__name__)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+
+    return decorator
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: гистограмма длительности запросов по шаблону маршрута"""
+
+    def __init__(self, app):
+        self.app = app
+        self._children: Dict[Tuple[str, str, int], Histogram] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            # Шаблон пути вместо фактического, чтобы число меток было ограничено
+            key = (scope["method"], route.path if route is not None else "unmatched", status)
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = http_request_duration.labels(*(str(part) for part in key))
+            child.observe(elapsed)
+
+
+async def monitor_event_loop(interval: float = 0.1):
+    """Фоновая задача: измеряет, насколько позже ожидаемого просыпается цикл событий"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        event_loop_lag.observe(lag)
+        event_loop_blocked.inc(lag)
@@ -0,0 +1,63 @@
+"""
+Обслуживание журнала остатков: снимок и восстановление warehouse_states.
+
+Восстановление берет последний снимок и применяет к нему хвост журнала
+stock_events, поэтому не требует полного проигрывания истории. Перед
+восстановлением остановите потребители Kafka: события, применяемые во время
+пересчета, могут быть перезаписаны. Без снимка rebuild завершается с ошибкой:
+сначала выполните snapshot.
+
+Запуск:
+  python -m app.ledger snapshot
+  python -m app.ledger rebuild [--warehouse WAREHOUSE_ID]
+"""
+import argparse
+import asyncio
+import logging
+import sys
+
+from app.core.logging_config import configure_logging_from_settings, stop_logging
+
+logger = logging.getLogger(__name__)
+
+
+async def _run(args):
+    from app.models.database import database
+    from app.services.change_notifications import change_notifier
+    from app.services.ledger import NoSnapshot, rebuild_warehouse_states, take_snapshot
+
+    await database.connect()
+    # Восстановленные остатки должны вытеснить кэш работающего API
+    change_notifier.enable()
+    try:
+        if args.command == "snapshot":
+            snapshot_id = await take_snapshot()
+            logger.info("Снимок %s", snapshot_id if snapshot_id is not None else "не нужен: новых событий нет")
+        else:
+            await rebuild_warehouse_states(args.warehouse)
+    except NoSnapshot as e:
+        logger.error("Восстановление не выполнено: %s", e)
+        return 1
+    finally:
+        await database.disconnect()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("snapshot", help="сохранить снимок остатков на текущую позицию журнала")
+    rebuild = commands.add_parser("rebuild", help="восстановить остатки из снимка и журнала")
+    rebuild.add_argument("--warehouse", help="восстановить только один склад")
+    args = parser.parse_args()
+
+    configure_logging_from_settings()
+    try:
+        exit_code = asyncio.run(_run(args))
+    finally:
+        stop_logging()
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,82 +1,126 @@
 from fastapi import FastAPI, Request, Response
+from fastapi.responses import PlainTextResponse
 from app.api.routers import router
-from app.models.database import database, engine, Base, warehouse_states, movements
+from app.core.metrics import REGISTRY, MetricsMiddleware, monitor_event_loop
+from app.models.database import database, engine, Base
 import logging
 import json
-from datetime import datetime, timedelta
-from app.services.kafka_consumer import KafkaConsumerService
+from app.services.idempotency import prune_periodically
+from app.services.cache import movement_cache, warehouse_state_cache
+from app.services.change_notifications import change_notifier
+from app.services.dead_letter import flush_stock_buffer, retry_periodically
+from app.services.ledger import snapshot_periodically
+from app.services.stock_buffer import stock_buffer
+from app.services.stock_stream import stock_hub
+from app.services.health import health, readiness
+from app.services.replicas import replicas
+from app.models.schemas import HealthStatus, ReadinessStatus
 from app.core.config import settings
+from app.core.logging_config import configure_logging_from_settings, stop_logging
 import asyncio
 
-logging.basicConfig(level=logging.INFO)
+configure_logging_from_settings()
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
 app.include_router(router)
+app.add_middleware(MetricsMiddleware)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Метрики сервиса в текстовом формате Prometheus"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health", response_model=HealthStatus)
+async def health_check():
+    """Процесс жив; заполнение пулов соединений без обращения к БД"""
+    return health()
+
+@app.get("/ready", response_model=ReadinessStatus)
+async def readiness_check(response: Response):
+    """Готовность принимать трафик: SELECT 1 через общий пул с таймаутом; 503, если БД недоступна"""
+    status = await readiness()
+    if not status.ready:
+        response.status_code = 503
+    return status
 
 @app.on_event("startup")
 async def startup():
     await database.connect()
     logger.info("Подключение к базе данных установлено")
+    app.state.event_loop_monitor = asyncio.create_task(monitor_event_loop())
+    app.state.processed_events_pruner = asyncio.create_task(prune_periodically(
+        settings.IDEMPOTENCY_PRUNE_INTERVAL_SECONDS, settings.IDEMPOTENCY_RETENTION_SECONDS
+    ))
+    if settings.STOCK_SNAPSHOT_INTERVAL_SECONDS > 0:
+        app.state.stock_snapshotter = asyncio.create_task(snapshot_periodically(
+            settings.STOCK_SNAPSHOT_INTERVAL_SECONDS, settings.STOCK_SNAPSHOTS_KEEP
+        ))
+    if replicas.enabled:
+        # Пока первая проверка не прошла, чтения идут в основную БД
+        app.state.replica_monitor = asyncio.create_task(replicas.monitor())
 
-    try:
-        query = warehouse_states.select().where(
-            warehouse_states.c.warehouse_id == "c1d70455-7e14-11e9-812a-70106f431230"
-        )
-        warehouse_state = await database.fetch_one(query)
-        
-        if not warehouse_state:
-            """Добавление тестовых данных"""
-            warehouse_id = "c1d70455-7e14-11e9-812a-70106f431230"
-            product_id = "4705204f-498f-4f96-b4ba-df17fb56bf55"
-
-            warehouse_state_id = f"{warehouse_id}:{product_id}"
-            query = warehouse_states.insert().values(
-                id=warehouse_state_id,
-                warehouse_id=warehouse_id,
-                product_id=product_id,
-                quantity=100
-            )
-            await database.execute(query)
-            
-            query = warehouse_states.select().where(warehouse_states.c.id == warehouse_state_id)
-            warehouse_state = await database.fetch_one(query)
-            logger.info(f"Добавлены тестовые данные о состоянии склада: {warehouse_state}")
-            
-            now = datetime.utcnow()
-            movement_id = "c6290746-790e-43fa-8270-014dc90e02e0"
-            query = movements.insert().values(
-                movement_id=movement_id,
-                source_warehouse="WH-3322",
-                destination_warehouse="WH-3423",
-                product_id=product_id,
-                departure_time=now - timedelta(hours=1),
-                arrival_time=now,
-                time_difference_seconds=3600.0,
-                departure_quantity=100,
-                arrival_quantity=100,
-                quantity_difference=0
-            )
-            await database.execute(query)
-            
-            query = movements.select().where(movements.c.movement_id == movement_id)
-            movement = await database.fetch_one(query)
-            logger.info(f"Добавлены тестовые данные о перемещении: {movement}")
+    # Тестовые данные заполняет отдельная команда python -m app.seed. Потребитель работает
+    # фоновой задачей и сам переподключается, поэтому старт не ждет брокер.
+    # При KAFKA_EMBEDDED_CONSUMER=false события читает отдельный процесс python -m app.consumer
+    if settings.KAFKA_EMBEDDED_CONSUMER:
+        # kafka-python импортируется только здесь: без встроенного потребителя он не нужен
+        from app.services.kafka_consumer import KafkaConsumerService
 
+        # При отложенной записи остатков писатель один: если его роль у воркера app.consumer, старт прерывается
+        await stock_buffer.claim_writer()
         app.state.kafka_consumer = KafkaConsumerService(
             bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
             topic=settings.KAFKA_TOPIC,
-            loop=asyncio.get_event_loop()
+            loop=asyncio.get_running_loop()
         )
-        app.state.kafka_consumer.start()
-    except Exception as e:
-        logger.error(f"Ошибка при добавлении тестовых данных: {str(e)}")
+        app.state.kafka_consumer_task = app.state.kafka_consumer.start()
+        app.state.dead_letter_retrier = asyncio.create_task(retry_periodically(
+            settings.DEAD_LETTER_RETRY_INTERVAL_MS / 1000, settings.DEAD_LETTER_RETRY_BATCH_SIZE
+        ))
+    elif change_notifier.supported():
+        # Изменения отдельного потребителя приходят через LISTEN: инвалидация кэша и поток остатков
+        app.state.change_listener = asyncio.create_task(change_notifier.listen())
+    else:
+        # Без LISTEN/NOTIFY (SQLite) API не узнает об изменениях другого процесса: кэш чтения отключается
+        warehouse_state_cache.maxsize = 0
+        movement_cache.maxsize = 0
+        logger.warning("Отдельный потребитель без LISTEN/NOTIFY: кэш чтения отключен, поток остатков пуст")
 
 @app.on_event("shutdown")
 async def shutdown():
+    if hasattr(app.state, 'event_loop_monitor'):
+        app.state.event_loop_monitor.cancel()
+    if hasattr(app.state, 'processed_events_pruner'):
+        app.state.processed_events_pruner.cancel()
+    if hasattr(app.state, 'stock_snapshotter'):
+        app.state.stock_snapshotter.cancel()
+    if hasattr(app.state, 'replica_monitor'):
+        app.state.replica_monitor.cancel()
+    if hasattr(app.state, 'change_listener'):
+        app.state.change_listener.cancel()
+
+    if hasattr(app.state, 'dead_letter_retrier'):
+        app.state.dead_letter_retrier.cancel()
+    if hasattr(app.state, 'kafka_consumer'):
+        app.state.kafka_consumer.stop()
+        # Цикл дорабатывает текущую пачку и фиксирует смещения не позже чем через poll_timeout_ms
+        try:
+            await asyncio.wait_for(app.state.kafka_consumer_task, timeout=settings.KAFKA_SHUTDOWN_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.error(f"Kafka-потребитель не остановился вовремя: {e}")
+    stock_hub.close_all()
+
+    # Остатки из буфера отложенной записи не должны потеряться при остановке
+    try:
+        await flush_stock_buffer()
+    except Exception as e:
+        logger.error(f"Ошибка при записи буфера остатков: {e}")
+    await stock_buffer.release_writer()
+
+    await replicas.disconnect()
     await database.disconnect()
     logger.info("Соединение с базой данных закрыто")
 
-    if hasattr(app.state, 'kafka_consumer'):
-        app.state.kafka_consumer.stop()
\ No newline at end of file
+    stop_logging()
\ No newline at end of file
@@ -1,17 +1,60 @@
-from sqlalchemy import create_engine, MetaData, Table, Column, String, Integer, Float, DateTime, ForeignKey
+from sqlalchemy import create_engine, MetaData, Table, Column, String, Integer, BigInteger, Float, DateTime, Text, LargeBinary, ForeignKey, CheckConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import NullPool
 import databases
 from app.core.config import settings
 
 # SQLAlchemy
 DATABASE_URL = settings.DATABASE_URL
-engine = create_engine(DATABASE_URL)
+
+
+def engine_options(url: str = DATABASE_URL) -> dict:
+    """
+    Параметры синхронного движка. Рабочий пул один — databases, его делят API и
+    потребитель; синхронный пул держит соединения только при API_SYNC_READS, иначе
+    NullPool открывает соединение на время вызова (create_all, утилиты).
+    """
+    if url.startswith("sqlite"):
+        return {}
+    options = {"pool_pre_ping": settings.DB_POOL_PRE_PING}
+    if settings.DB_STATEMENT_TIMEOUT_MS > 0:
+        options["connect_args"] = {"options": f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"}
+    if not settings.API_SYNC_READS:
+        return {**options, "poolclass": NullPool}
+    return {
+        **options,
+        "pool_size": settings.DB_POOL_MAX_SIZE,
+        "max_overflow": settings.DB_POOL_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE_SECONDS,
+    }
+
+
+engine = create_engine(DATABASE_URL, **engine_options())
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
-database = databases.Database(DATABASE_URL)
+def database_options(url: str = DATABASE_URL) -> dict:
+    """Параметры пула databases: asyncpg принимает размеры пула и таймауты, SQLite — только таймаут блокировки"""
+    if url.startswith("sqlite"):
+        return {"timeout": settings.DB_COMMAND_TIMEOUT}
+    options = {
+        "min_size": settings.DB_POOL_MIN_SIZE,
+        "max_size": settings.DB_POOL_MAX_SIZE,
+        "timeout": settings.DB_CONNECT_TIMEOUT,
+        "command_timeout": settings.DB_COMMAND_TIMEOUT,
+        # 0 отключает кэш подготовленных запросов (нужно за pgbouncer в режиме transaction)
+        "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        "max_inactive_connection_lifetime": settings.DB_POOL_RECYCLE_SECONDS,
+    }
+    if settings.DB_STATEMENT_TIMEOUT_MS > 0:
+        options["server_settings"] = {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}
+    return options
+
+
+database = databases.Database(DATABASE_URL, **database_options())
 
 metadata = MetaData()
 
@@ -19,31 +62,144 @@ warehouse_states = Table(
     "warehouse_states",
     metadata,
     Column("id", String, primary_key=True),
-    Column("warehouse_id", String, index=True),
+    Column("warehouse_id", String),
     Column("product_id", String, index=True),
     Column("quantity", Integer),
+    CheckConstraint("quantity >= 0", name="ck_warehouse_states_quantity_non_negative"),
+    # Покрывает выборку по складу и keyset-пагинацию по product_id внутри склада
+    Index("ux_warehouse_states_warehouse_product", "warehouse_id", "product_id", unique=True),
 )
 
+# В PostgreSQL секционирована по месяцам partition_time (см. app.services.movement_partitions).
+# Ключ секции входит в первичный ключ, а уникальность movement_id обеспечивает movement_keys
 movements = Table(
     "movements",
     metadata,
     Column("movement_id", String, primary_key=True),
+    # Время первой записанной половины перемещения; после вставки не меняется
+    Column("partition_time", DateTime, primary_key=True),
     Column("source_warehouse", String, nullable=True),
     Column("destination_warehouse", String, nullable=True),
-    Column("product_id", String, index=True),
+    Column("product_id", String),
     Column("departure_time", DateTime, nullable=True),
     Column("arrival_time", DateTime, nullable=True),
     Column("time_difference_seconds", Float, nullable=True),
     Column("departure_quantity", Integer, nullable=True),
     Column("arrival_quantity", Integer, nullable=True),
     Column("quantity_difference", Integer, nullable=True),
+    # Keyset-пагинация перемещений товара по (departure_time, movement_id)
+    Index("ix_movements_product_departure", "product_id", "departure_time", "movement_id"),
+    # Выгрузка перемещений за период без фильтра по товару
+    Index("ix_movements_departure_time", "departure_time"),
+)
+
+# Компактный индекс перемещений: в какой секции movements лежит перемещение.
+# Поиск по movement_id сначала читает эту узкую таблицу, затем одну секцию
+movement_keys = Table(
+    "movement_keys",
+    metadata,
+    Column("movement_id", String, primary_key=True),
+    Column("partition_time", DateTime, nullable=False),
+)
+
+# ID уже примененных событий Kafka (CloudEvent id) для идемпотентной обработки
+processed_events = Table(
+    "processed_events",
+    metadata,
+    Column("event_id", String, primary_key=True),
+    Column("processed_at", DateTime, nullable=False, index=True),
+)
+
+# Записи Kafka, которые не удалось разобрать или применить, с исходным содержимым
+dead_letter_events = Table(
+    "dead_letter_events",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("event_id", String, nullable=True, index=True),
+    Column("reason", String, nullable=False),
+    Column("error", Text, nullable=True),
+    Column("payload", LargeBinary, nullable=False),
+    Column("kafka_topic", String, nullable=True),
+    Column("kafka_partition", Integer, nullable=True),
+    Column("kafka_offset", BigInteger, nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    # pending — ждет повторной попытки, parked — попытки исчерпаны, replayed — применено повтором
+    Column("status", String, nullable=False, server_default="parked"),
+    Column("attempts", Integer, nullable=False, server_default="1"),
+    Column("next_attempt_at", DateTime, nullable=True),
+    # Планировщик повторов выбирает созревшие записи по (status, next_attempt_at)
+    Index("ix_dead_letter_events_status_next_attempt", "status", "next_attempt_at"),
+)
+
+# Журнал изменений остатков (только добавление): из него и снимков восстанавливается warehouse_states
+stock_events = Table(
+    "stock_events",
+    metadata,
+    # Позиция в журнале; в SQLite автоинкремент есть только у INTEGER PRIMARY KEY
+    Column("id", BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True),
+    Column("event_id", String, nullable=False),
+    Column("movement_id", String, nullable=False),
+    Column("warehouse_id", String, nullable=False),
+    Column("product_id", String, nullable=False),
+    Column("delta", Integer, nullable=False),
+    # Остаток после применения события: запрос на момент времени — один поиск по индексу
+    Column("quantity_after", Integer, nullable=True),
+    Column("occurred_at", DateTime, nullable=False),
+    Column("recorded_at", DateTime, nullable=False, index=True),
+    # История остатка по паре склад/товар во времени (запросы as_of)
+    Index("ix_stock_events_key_recorded", "warehouse_id", "product_id", "recorded_at", "id"),
+)
+
+# Снимки остатков: состояние warehouse_states на позицию журнала last_event_id
+stock_snapshots = Table(
+    "stock_snapshots",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("last_event_id", BigInteger, nullable=False),
+    Column("taken_at", DateTime, nullable=False),
+)
+
+stock_snapshot_rows = Table(
+    "stock_snapshot_rows",
+    metadata,
+    Column("snapshot_id", Integer, ForeignKey("stock_snapshots.id", ondelete="CASCADE"), primary_key=True),
+    Column("warehouse_id", String, primary_key=True),
+    Column("product_id", String, primary_key=True),
+    Column("quantity", Integer, nullable=False),
+)
+
+# Агрегаты завершенных перемещений по маршруту и по товару. Строка — корзина скетча
+# времени в пути (app.services.sketch): квантили считаются по корзинам, суммы — по строкам
+route_transit_buckets = Table(
+    "route_transit_buckets",
+    metadata,
+    Column("source_warehouse", String, primary_key=True),
+    Column("destination_warehouse", String, primary_key=True),
+    Column("bucket", Integer, primary_key=True, autoincrement=False),
+    Column("movements", Integer, nullable=False),
+    Column("transit_seconds_sum", Float, nullable=False),
+    Column("quantity_difference_sum", BigInteger, nullable=False),
+)
+
+product_transit_buckets = Table(
+    "product_transit_buckets",
+    metadata,
+    Column("product_id", String, primary_key=True),
+    Column("bucket", Integer, primary_key=True, autoincrement=False),
+    Column("movements", Integer, nullable=False),
+    Column("transit_seconds_sum", Float, nullable=False),
+    Column("quantity_difference_sum", BigInteger, nullable=False),
 )
 
 class WarehouseState(Base):
     __tablename__ = "warehouse_states"
+    __table_args__ = (
+        CheckConstraint("quantity >= 0", name="ck_warehouse_states_quantity_non_negative"),
+        Index("ux_warehouse_states_warehouse_product", "warehouse_id", "product_id", unique=True),
+    )
     
     id = Column(String, primary_key=True)
-    warehouse_id = Column(String, index=True)
+    warehouse_id = Column(String)
     product_id = Column(String, index=True)
     quantity = Column(Integer, default=0)
     
@@ -52,11 +208,16 @@ class WarehouseState(Base):
 
 class Movement(Base):
     __tablename__ = "movements"
+    __table_args__ = (
+        Index("ix_movements_product_departure", "product_id", "departure_time", "movement_id"),
+        Index("ix_movements_departure_time", "departure_time"),
+    )
     
     movement_id = Column(String, primary_key=True)
+    partition_time = Column(DateTime, primary_key=True)
     source_warehouse = Column(String, nullable=True)
     destination_warehouse = Column(String, nullable=True)
-    product_id = Column(String, index=True)
+    product_id = Column(String)
     departure_time = Column(DateTime, nullable=True)
     arrival_time = Column(DateTime, nullable=True)
     time_difference_seconds = Column(Float, nullable=True)
@@ -67,6 +228,84 @@ class Movement(Base):
     def __repr__(self):
         return f"<Movement(movement_id='{self.movement_id}', product_id='{self.product_id}')>"
 
+class MovementKey(Base):
+    __tablename__ = "movement_keys"
+
+    movement_id = Column(String, primary_key=True)
+    partition_time = Column(DateTime, nullable=False)
+
+class ProcessedEvent(Base):
+    __tablename__ = "processed_events"
+
+    event_id = Column(String, primary_key=True)
+    processed_at = Column(DateTime, nullable=False, index=True)
+
+class DeadLetterEvent(Base):
+    __tablename__ = "dead_letter_events"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    event_id = Column(String, nullable=True, index=True)
+    reason = Column(String, nullable=False)
+    error = Column(Text, nullable=True)
+    payload = Column(LargeBinary, nullable=False)
+    kafka_topic = Column(String, nullable=True)
+    kafka_partition = Column(Integer, nullable=True)
+    kafka_offset = Column(BigInteger, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    status = Column(String, nullable=False, server_default="parked")
+    attempts = Column(Integer, nullable=False, server_default="1")
+    next_attempt_at = Column(DateTime, nullable=True)
+
+class StockEvent(Base):
+    __tablename__ = "stock_events"
+    __table_args__ = (
+        Index("ix_stock_events_key_recorded", "warehouse_id", "product_id", "recorded_at", "id"),
+    )
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    event_id = Column(String, nullable=False)
+    movement_id = Column(String, nullable=False)
+    warehouse_id = Column(String, nullable=False)
+    product_id = Column(String, nullable=False)
+    delta = Column(Integer, nullable=False)
+    quantity_after = Column(Integer, nullable=True)
+    occurred_at = Column(DateTime, nullable=False)
+    recorded_at = Column(DateTime, nullable=False, index=True)
+
+class StockSnapshot(Base):
+    __tablename__ = "stock_snapshots"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    last_event_id = Column(BigInteger, nullable=False)
+    taken_at = Column(DateTime, nullable=False)
+
+class StockSnapshotRow(Base):
+    __tablename__ = "stock_snapshot_rows"
+
+    snapshot_id = Column(Integer, ForeignKey("stock_snapshots.id", ondelete="CASCADE"), primary_key=True)
+    warehouse_id = Column(String, primary_key=True)
+    product_id = Column(String, primary_key=True)
+    quantity = Column(Integer, nullable=False)
+
+class RouteTransitBucket(Base):
+    __tablename__ = "route_transit_buckets"
+
+    source_warehouse = Column(String, primary_key=True)
+    destination_warehouse = Column(String, primary_key=True)
+    bucket = Column(Integer, primary_key=True, autoincrement=False)
+    movements = Column(Integer, nullable=False)
+    transit_seconds_sum = Column(Float, nullable=False)
+    quantity_difference_sum = Column(BigInteger, nullable=False)
+
+class ProductTransitBucket(Base):
+    __tablename__ = "product_transit_buckets"
+
+    product_id = Column(String, primary_key=True)
+    bucket = Column(Integer, primary_key=True, autoincrement=False)
+    movements = Column(Integer, nullable=False)
+    transit_seconds_sum = Column(Float, nullable=False)
+    quantity_difference_sum = Column(BigInteger, nullable=False)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, Literal
+from typing import List, Optional, Literal
 from datetime import datetime
 
 class MovementData(BaseModel):
@@ -10,8 +10,12 @@ class MovementData(BaseModel):
     product_id: str
     quantity: int
 
-class KafkaMessage(BaseModel):
+class MovementEvent(BaseModel):
+    """Часть CloudEvent, нужная для обработки: поля конверта не разбираются и не валидируются"""
     id: str
+    data: MovementData
+
+class KafkaMessage(MovementEvent):
     source: str
     specversion: str
     type: str
@@ -20,7 +24,6 @@ class KafkaMessage(BaseModel):
     time: int
     subject: str
     destination: str
-    data: MovementData
 
 class WarehouseState(BaseModel):
     warehouse_id: str
@@ -37,4 +40,78 @@ class MovementInfo(BaseModel):
     time_difference_seconds: Optional[float] = None
     departure_quantity: Optional[int] = None
     arrival_quantity: Optional[int] = None
-    quantity_difference: Optional[int] = None 
\ No newline at end of file
+    quantity_difference: Optional[int] = None
+
+class StockKey(BaseModel):
+    warehouse_id: str
+    product_id: str
+
+class StockBatchRequest(BaseModel):
+    items: List[StockKey] = Field(..., min_length=1, max_length=10000)
+
+class MovementBatchRequest(BaseModel):
+    movement_ids: List[str] = Field(..., min_length=1, max_length=10000)
+
+class WarehouseStockPage(BaseModel):
+    items: List[WarehouseState]
+    next_cursor: Optional[str] = None
+
+class MovementPage(BaseModel):
+    items: List[MovementInfo]
+    next_cursor: Optional[str] = None
+
+class DeadLetterEventInfo(BaseModel):
+    id: int
+    event_id: Optional[str] = None
+    reason: str
+    error: Optional[str] = None
+    status: str
+    attempts: int
+    next_attempt_at: Optional[datetime] = None
+    kafka_topic: Optional[str] = None
+    kafka_partition: Optional[int] = None
+    kafka_offset: Optional[int] = None
+    created_at: datetime
+    payload: str
+
+class DeadLetterPage(BaseModel):
+    items: List[DeadLetterEventInfo]
+    next_after_id: Optional[int] = None
+
+class DeadLetterReplayRequest(BaseModel):
+    status: Literal["parked", "pending"] = "parked"
+    ids: Optional[List[int]] = Field(None, min_length=1, max_length=10000)
+    reason: Optional[str] = None
+
+class DeadLetterReplayResult(BaseModel):
+    requeued: int
+
+class TransitStats(BaseModel):
+    movements: int
+    transit_seconds_p50: Optional[float] = None
+    transit_seconds_p95: Optional[float] = None
+    transit_seconds_mean: Optional[float] = None
+    quantity_difference_sum: int
+
+class RouteTransitStats(TransitStats):
+    source_warehouse: str
+    destination_warehouse: str
+
+class ProductTransitStats(TransitStats):
+    product_id: str
+
+class PoolStats(BaseModel):
+    name: str
+    size: int
+    in_use: int
+    max_size: int
+    saturation: float
+
+class HealthStatus(BaseModel):
+    status: str
+    pools: List[PoolStats]
+
+class ReadinessStatus(HealthStatus):
+    ready: bool
+    db_latency_ms: Optional[float] = None
+    error: Optional[str] = None
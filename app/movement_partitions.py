@@ -0,0 +1,61 @@
+"""
+Обслуживание секций таблицы movements (PostgreSQL) и срока хранения перемещений.
+
+maintain создает секции на MOVEMENTS_PARTITIONS_AHEAD месяцев вперед и
+отсоединяет секции старше MOVEMENTS_RETENTION_MONTHS месяцев (0 — хранить
+все), перенося их в схему MOVEMENTS_ARCHIVE_SCHEMA или, с --drop, удаляя.
+Запускайте после миграций и затем регулярно (например, раз в сутки по cron):
+если секции на будущее не созданы, новые строки копятся в movements_default.
+
+Запуск:
+  python -m app.movement_partitions maintain [--drop]
+  python -m app.movement_partitions list
+"""
+import argparse
+import asyncio
+import logging
+
+from app.core.logging_config import configure_logging_from_settings, stop_logging
+
+logger = logging.getLogger(__name__)
+
+
+async def _run(args):
+    from app.core.config import settings
+    from app.models.database import database
+    from app.services.movement_partitions import create_partitions, expire_partitions, list_partitions, partitioned
+
+    await database.connect()
+    try:
+        if args.command == "list":
+            if not partitioned():
+                logger.info("Таблица movements не секционирована (%s)", database.url.dialect)
+                return
+            for partition in await list_partitions():
+                logger.info("%s: [%s, %s)", partition.name, partition.lower or "MINVALUE", partition.upper)
+        else:
+            await create_partitions(settings.MOVEMENTS_PARTITIONS_AHEAD)
+            await expire_partitions(
+                settings.MOVEMENTS_RETENTION_MONTHS, settings.MOVEMENTS_ARCHIVE_SCHEMA, drop=args.drop
+            )
+    finally:
+        await database.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    maintain = commands.add_parser("maintain", help="создать секции вперед и отсоединить устаревшие")
+    maintain.add_argument("--drop", action="store_true", help="удалять устаревшие секции вместо переноса в архив")
+    commands.add_parser("list", help="показать секции movements и их диапазоны")
+    args = parser.parse_args()
+
+    configure_logging_from_settings()
+    try:
+        asyncio.run(_run(args))
+    finally:
+        stop_logging()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Тестовые данные: остаток одного товара на складе и одно завершенное перемещение.
+
+Раньше записывались при каждом старте приложения; теперь это отдельная команда,
+которую запускают явно (например, SEED_DEMO_DATA=true в start.sh). Повторный
+запуск ничего не меняет.
+
+Запуск:
+  python -m app.seed
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from app.core.logging_config import configure_logging_from_settings, stop_logging
+
+logger = logging.getLogger(__name__)
+
+WAREHOUSE_ID = "c1d70455-7e14-11e9-812a-70106f431230"
+PRODUCT_ID = "4705204f-498f-4f96-b4ba-df17fb56bf55"
+MOVEMENT_ID = "c6290746-790e-43fa-8270-014dc90e02e0"
+
+
+async def seed_demo_data() -> bool:
+    """Добавляет тестовые данные, если их еще нет; возвращает True, если что-то добавлено"""
+    from app.models.database import database, movement_keys, movements, warehouse_states
+
+    query = warehouse_states.select().where(warehouse_states.c.warehouse_id == WAREHOUSE_ID)
+    if await database.fetch_one(query):
+        logger.info("Тестовые данные уже есть")
+        return False
+
+    now = datetime.utcnow()
+    async with database.transaction():
+        await database.execute(warehouse_states.insert().values(
+            id=f"{WAREHOUSE_ID}:{PRODUCT_ID}",
+            warehouse_id=WAREHOUSE_ID,
+            product_id=PRODUCT_ID,
+            quantity=100
+        ))
+        await database.execute(movement_keys.insert().values(movement_id=MOVEMENT_ID, partition_time=now - timedelta(hours=1)))
+        await database.execute(movements.insert().values(
+            movement_id=MOVEMENT_ID,
+            partition_time=now - timedelta(hours=1),
+            source_warehouse="WH-3322",
+            destination_warehouse="WH-3423",
+            product_id=PRODUCT_ID,
+            departure_time=now - timedelta(hours=1),
+            arrival_time=now,
+            time_difference_seconds=3600.0,
+            departure_quantity=100,
+            arrival_quantity=100,
+            quantity_difference=0
+        ))
+    logger.info("Добавлены тестовые данные: склад %s, перемещение %s", WAREHOUSE_ID, MOVEMENT_ID)
+    return True
+
+
+async def _run():
+    from app.models.database import database
+
+    await database.connect()
+    try:
+        await seed_demo_data()
+    finally:
+        await database.disconnect()
+
+
+def main():
+    argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter).parse_args()
+
+    configure_logging_from_settings()
+    try:
+        asyncio.run(_run())
+    finally:
+        stop_logging()
+
+
+if __name__ == "__main__":
+    main()
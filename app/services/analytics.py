@@ -0,0 +1,157 @@
+"""
+Аналитика перемещений: время в пути и расхождение количества по маршрутам и товарам.
+
+Вместо сканирования movements на каждый запрос поддерживаются свертки
+route_transit_buckets и product_transit_buckets: для каждого маршрута (товара)
+хранится скетч времени в пути (app.services.sketch) — счетчики по логарифмическим
+корзинам вместе с суммами времени и расхождения. Перемещение добавляется в свертки
+в той же транзакции, в которой его вторая половина записана в movements, поэтому
+запрос читает только строки корзин: O(маршрутов x корзин), а не O(перемещений).
+
+Перемещение добавляется в свертки только при переходе из незавершенного в
+завершенное, в одной транзакции с upsert его половины. Поэтому оно учитывается один
+раз: при повторе события, при половине с новым id (исправлении) у завершенного
+перемещения и в режиме отложенной записи остатков, где upsert перемещения не входит
+в транзакцию отметки события и после сбоя до flush() выполняется повторно.
+Исправленные значения свертки подхватят при rebuild_transit_rollups, который
+пересчитывает их по movements.
+"""
+import logging
+from itertools import groupby
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from app.core.metrics import timed
+from app.models.database import database, movements, product_transit_buckets, route_transit_buckets
+from app.models.schemas import ProductTransitStats, RouteTransitStats
+from app.services import sketch, upsert
+
+logger = logging.getLogger(__name__)
+
+# Строк корзин в одном многострочном UPSERT при пересчете
+_REBUILD_CHUNK_SIZE = 500
+
+
+def _bucket_row(transit_seconds: float, quantity_difference: int, **key) -> dict:
+    return {
+        **key,
+        "bucket": sketch.bucket_of(transit_seconds),
+        "movements": 1,
+        "transit_seconds_sum": transit_seconds,
+        "quantity_difference_sum": quantity_difference,
+    }
+
+
+async def record_completed_movement(row) -> bool:
+    """
+    Добавляет перемещение в свертки, если RETURNING upsert-а показал, что обе
+    половины записаны (time_difference_seconds не NULL). Вызывается внутри транзакции
+    события и только если до этой записи перемещение не было завершено.
+    """
+    if row is None or row["time_difference_seconds"] is None:
+        return False
+    dialect = database.url.dialect
+    transit, difference = row["time_difference_seconds"], row["quantity_difference"]
+    await database.execute(upsert.transit_buckets_upsert(dialect, route_transit_buckets, [
+        _bucket_row(transit, difference, source_warehouse=row["source_warehouse"],
+                    destination_warehouse=row["destination_warehouse"])
+    ]))
+    await database.execute(upsert.transit_buckets_upsert(dialect, product_transit_buckets, [
+        _bucket_row(transit, difference, product_id=row["product_id"])
+    ]))
+    return True
+
+
+def _summary(rows) -> dict:
+    """Сливает корзины одного ключа в итоговую статистику"""
+    movements_count = sum(row["movements"] for row in rows)
+    histogram = [(row["bucket"], row["movements"]) for row in rows]
+    return {
+        "movements": movements_count,
+        "transit_seconds_p50": sketch.quantile(histogram, 0.5),
+        "transit_seconds_p95": sketch.quantile(histogram, 0.95),
+        "transit_seconds_mean": (
+            sum(row["transit_seconds_sum"] for row in rows) / movements_count if movements_count else None
+        ),
+        "quantity_difference_sum": sum(row["quantity_difference_sum"] for row in rows),
+    }
+
+
+@timed()
+async def route_stats(source_warehouse: Optional[str] = None,
+                      destination_warehouse: Optional[str] = None) -> List[RouteTransitStats]:
+    """Статистика времени в пути по маршрутам (склад отправки -> склад приемки)"""
+    query = select(route_transit_buckets)
+    if source_warehouse:
+        query = query.where(route_transit_buckets.c.source_warehouse == source_warehouse)
+    if destination_warehouse:
+        query = query.where(route_transit_buckets.c.destination_warehouse == destination_warehouse)
+    rows = await database.fetch_all(query.order_by(
+        route_transit_buckets.c.source_warehouse, route_transit_buckets.c.destination_warehouse
+    ))
+    return [
+        RouteTransitStats(source_warehouse=source, destination_warehouse=destination, **_summary(list(group)))
+        for (source, destination), group in groupby(
+            rows, key=lambda row: (row["source_warehouse"], row["destination_warehouse"])
+        )
+    ]
+
+
+@timed()
+async def product_stats(product_id: Optional[str] = None) -> List[ProductTransitStats]:
+    """Статистика времени в пути по товарам"""
+    query = select(product_transit_buckets)
+    if product_id:
+        query = query.where(product_transit_buckets.c.product_id == product_id)
+    rows = await database.fetch_all(query.order_by(product_transit_buckets.c.product_id))
+    return [
+        ProductTransitStats(product_id=product, **_summary(list(group)))
+        for product, group in groupby(rows, key=lambda row: row["product_id"])
+    ]
+
+
+def _merge(rollup: Dict[Tuple, dict], row: dict, key_columns: Tuple[str, ...]):
+    key = tuple(row[column] for column in key_columns) + (row["bucket"],)
+    merged = rollup.get(key)
+    if merged is None:
+        rollup[key] = row
+    else:
+        merged["movements"] += row["movements"]
+        merged["transit_seconds_sum"] += row["transit_seconds_sum"]
+        merged["quantity_difference_sum"] += row["quantity_difference_sum"]
+
+
+@timed()
+async def rebuild_transit_rollups() -> int:
+    """
+    Пересчитывает свертки по завершенным перемещениям (заполнение после миграции или
+    исправление). Потребители на время пересчета должны быть остановлены.
+    Возвращает число учтенных перемещений.
+    """
+    routes: Dict[Tuple, dict] = {}
+    products: Dict[Tuple, dict] = {}
+    counted = 0
+    query = select(
+        movements.c.source_warehouse, movements.c.destination_warehouse, movements.c.product_id,
+        movements.c.time_difference_seconds, movements.c.quantity_difference,
+    ).where(movements.c.time_difference_seconds.isnot(None))
+    async for row in database.iterate(query):
+        transit, difference = row["time_difference_seconds"], row["quantity_difference"]
+        _merge(routes, _bucket_row(transit, difference, source_warehouse=row["source_warehouse"],
+                                   destination_warehouse=row["destination_warehouse"]),
+               ("source_warehouse", "destination_warehouse"))
+        _merge(products, _bucket_row(transit, difference, product_id=row["product_id"]), ("product_id",))
+        counted += 1
+
+    dialect = database.url.dialect
+    async with database.transaction():
+        for table, rollup in ((route_transit_buckets, routes), (product_transit_buckets, products)):
+            await database.execute(table.delete())
+            rows = list(rollup.values())
+            for start in range(0, len(rows), _REBUILD_CHUNK_SIZE):
+                await database.execute(
+                    upsert.transit_buckets_upsert(dialect, table, rows[start:start + _REBUILD_CHUNK_SIZE])
+                )
+    logger.info("Свертки времени в пути пересчитаны: %s перемещений", counted)
+    return counted
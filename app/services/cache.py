@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Tuple
+
+from app.core.config import settings
+from app.core.metrics import CallbackMetric
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Потокобезопасный LRU-кэш с ограничением размера и временем жизни записей.
+
+    Чтобы чтение, начатое до записи в БД, не положило в кэш устаревшее значение,
+    у каждого ключа есть поколение (в одном из stripes счетчиков): invalidate
+    увеличивает его, а set с поколением, взятым до запроса в БД, игнорируется,
+    если ключ успели инвалидировать.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, stripes: int = 1024):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._generations = [0] * stripes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Возвращает (найдено, значение)"""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._data[key]
+            self.misses += 1
+            return False, None
+
+    def generation(self, key: Hashable) -> int:
+        return self._generations[hash(key) % len(self._generations)]
+
+    def set(self, key: Hashable, value: Any, generation: int = None):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation(key):
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._generations[hash(key) % len(self._generations)] += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generations = [generation + 1 for generation in self._generations]
+            self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._data),
+        }
+
+
+warehouse_state_cache = TTLCache(settings.CACHE_MAX_SIZE, settings.CACHE_TTL_SECONDS)
+movement_cache = TTLCache(settings.CACHE_MAX_SIZE, settings.CACHE_TTL_SECONDS)
+
+
+def cache_stats() -> dict:
+    """Счетчики попаданий, промахов и вытеснений по всем кэшам чтения"""
+    return {
+        "warehouse_states": warehouse_state_cache.stats(),
+        "movements": movement_cache.stats(),
+    }
+
+
+def _cache_counters(field: str):
+    return lambda: {(name,): stats[field] for name, stats in cache_stats().items()}
+
+
+CallbackMetric("read_cache_hits", "Попадания в кэш чтения", "counter", ("cache",), _cache_counters("hits"))
+CallbackMetric("read_cache_misses", "Промахи кэша чтения", "counter", ("cache",), _cache_counters("misses"))
+CallbackMetric("read_cache_evictions", "Вытеснения из кэша чтения", "counter", ("cache",), _cache_counters("evictions"))
+CallbackMetric("read_cache_size", "Число записей в кэше чтения", "gauge", ("cache",), _cache_counters("size"))
@@ -0,0 +1,120 @@
+"""
+Уведомления API об изменениях, сделанных другим процессом (PostgreSQL LISTEN/NOTIFY).
+
+Кэши чтения (warehouse_state_cache, movement_cache) и поток остатков stock_hub
+живут в памяти процесса. Когда события применяет отдельный процесс
+python -m app.consumer (KAFKA_EMBEDDED_CONSUMER=false), API без уведомлений
+отдавал бы из кэша устаревшие значения до CACHE_TTL_SECONDS, а подписчики
+потока остатков не получали бы ничего.
+
+Писатель вне процесса API (воркер app.consumer, python -m app.ledger) включает
+отправку через enable() и вызывает stock_changed / movement_changed / reset внутри
+транзакции изменения: pg_notify доставляется слушателям только после коммита и
+пропадает при откате. API держит соединение с LISTEN (listen()) и по уведомлению
+инвалидирует кэш и публикует остаток в stock_hub.
+
+В SQLite уведомлений нет: при отдельном потребителе API отключает кэш чтения, а
+поток остатков работает только со встроенным потребителем.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Iterable, Tuple
+
+from sqlalchemy import text
+
+from app.models.database import database
+from app.services.cache import movement_cache, warehouse_state_cache
+from app.services.stock_stream import stock_hub
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "warehouse_changes"
+
+# Изменений в одном уведомлении: размер payload NOTIFY ограничен 8000 байт
+_CHUNK_SIZE = 50
+
+# (warehouse_id, product_id, новый остаток, время события)
+StockChange = Tuple[str, str, int, datetime]
+
+
+class ChangeNotifier:
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.enabled = False
+
+    def supported(self) -> bool:
+        return database.url.dialect == "postgresql"
+
+    def enable(self):
+        """Включает отправку уведомлений в процессе-писателе вне API (только PostgreSQL)"""
+        self.enabled = self.supported()
+
+    async def stock_changed(self, changes: Iterable[StockChange]):
+        changes = [
+            [warehouse_id, product_id, quantity, updated_at.isoformat()]
+            for warehouse_id, product_id, quantity, updated_at in changes
+        ]
+        for start in range(0, len(changes), _CHUNK_SIZE):
+            await self._notify({"stock": changes[start:start + _CHUNK_SIZE]})
+
+    async def movement_changed(self, movement_id: str):
+        await self._notify({"movements": [movement_id]})
+
+    async def reset(self):
+        """Остатки переписаны целиком (восстановление из журнала): слушатели сбрасывают кэш"""
+        await self._notify({"reset": True})
+
+    async def _notify(self, message: dict):
+        if not self.enabled:
+            return
+        await database.execute(
+            text("SELECT pg_notify(:channel, :payload)").bindparams(channel=self.channel, payload=json.dumps(message))
+        )
+
+    def handle(self, payload: str):
+        """Применяет уведомление к кэшам и потоку остатков этого процесса"""
+        message = json.loads(payload)
+        if message.get("reset"):
+            warehouse_state_cache.clear()
+            movement_cache.clear()
+        for warehouse_id, product_id, quantity, updated_at in message.get("stock", ()):
+            warehouse_state_cache.invalidate((warehouse_id, product_id))
+            stock_hub.publish(warehouse_id, product_id, quantity, datetime.fromisoformat(updated_at))
+        for movement_id in message.get("movements", ()):
+            movement_cache.invalidate(movement_id)
+
+    def _on_notification(self, connection, pid, channel, payload):
+        try:
+            self.handle(payload)
+        except Exception as e:
+            logger.error("Некорректное уведомление %s: %s", channel, e)
+
+    async def listen(self, check_interval: float = 1.0):
+        """
+        Фоновая задача API: держит отдельное соединение с LISTEN и переподключается после
+        разрыва. Уведомления, отправленные без соединения, потеряны, поэтому после каждого
+        подключения кэши сбрасываются.
+        """
+        while True:
+            try:
+                async with database.connection() as connection:
+                    raw = connection.raw_connection
+                    await raw.add_listener(self.channel, self._on_notification)
+                    warehouse_state_cache.clear()
+                    movement_cache.clear()
+                    logger.info("Подписка на уведомления %s", self.channel)
+                    try:
+                        while not raw.is_closed():
+                            await asyncio.sleep(check_interval)
+                    finally:
+                        if not raw.is_closed():
+                            await raw.remove_listener(self.channel, self._on_notification)
+                logger.warning("Соединение с подпиской %s закрыто, переподключение", self.channel)
+            except Exception as e:
+                logger.error("Ошибка подписки на уведомления %s: %s", self.channel, e)
+            await asyncio.sleep(check_interval)
+
+
+change_notifier = ChangeNotifier(CHANNEL)
@@ -0,0 +1,267 @@
+"""
+Хранилище недоставленных событий (dead letter) и повторная обработка.
+
+Запись сохраняется с исходными байтами и координатами в Kafka, поэтому ее можно
+разобрать и переиграть позже; смещение при этом фиксируется, и поток не стоит
+из-за одной испорченной записи или временной ошибки БД.
+
+Событие, которое не удалось применить из-за ошибки БД (reason "error"),
+сохраняется со статусом pending и повторяется фоновой задачей retry_periodically
+с экспоненциальной задержкой. После DEAD_LETTER_MAX_ATTEMPTS попыток оно получает
+статус parked и ждет ручного replay_dead_letters. Повтор не изменит исход для
+неразбираемых записей ("malformed") и отклоненных расходов ("rejected"), поэтому
+они сразу получают статус parked.
+Повтор безопасен: обработка идемпотентна по id события.
+"""
+import asyncio
+import logging
+import random
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from pydantic import ValidationError
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.core.metrics import Counter, timed
+from app.models.database import database, dead_letter_events
+from app.models.schemas import DeadLetterEventInfo, DeadLetterPage
+from app.services.decoding import decode_event
+from app.services.stock_buffer import stock_buffer
+from app.services.warehouse_services import process_message
+
+logger = logging.getLogger(__name__)
+
+dead_letters = Counter("dead_letter_events", "События, отправленные в dead letter, по причине", ("reason",))
+dead_letter_retries = Counter("dead_letter_retries", "Повторные попытки обработки событий по результату", ("result",))
+
+PENDING = "pending"
+PARKED = "parked"
+REPLAYED = "replayed"
+
+# Текст ошибки валидации может быть длинным; для разбора достаточно начала
+_MAX_ERROR_LENGTH = 2000
+
+# Пока запись обрабатывается, другие воркеры не возьмут ее в течение этого времени
+_CLAIM_LEASE_SECONDS = 60
+
+_REJECTED_ON_FLUSH = "Недостаточно товара: расход отклонен при записи буфера остатков"
+
+# Событие из буфера остатков без исходной записи Kafka: координаты в dead letter пустые
+_BufferedRecord = namedtuple("_BufferedRecord", ["value"])
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    Задержка перед следующей попыткой после attempts неудачных: экспоненциальная,
+    не больше DEAD_LETTER_RETRY_MAX_SECONDS, со случайной половиной, чтобы события
+    одной упавшей пачки не повторялись одновременно.
+    """
+    delay = min(settings.DEAD_LETTER_RETRY_MAX_SECONDS,
+                settings.DEAD_LETTER_RETRY_BASE_MS / 1000 * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def stock_rejection(message) -> str:
+    """Причина отклонения расхода для записи в dead letter"""
+    data = message.data
+    return (
+        f"Недостаточно товара на складе: warehouse_id={data.warehouse_id}, "
+        f"product_id={data.product_id}, списание={data.quantity}"
+    )
+
+
+def dead_letter_entry(record, reason: str, error, event_id: Optional[str] = None, retry: bool = False) -> dict:
+    """
+    Строка dead_letter_events для записи Kafka (ConsumerRecord или совместимой).
+    retry=True — первая попытка уже сделана, запись ставится в очередь повторов.
+    """
+    payload = record.value if isinstance(record.value, bytes) else str(record.value).encode()
+    now = datetime.utcnow()
+    return {
+        "event_id": event_id,
+        "reason": reason,
+        "error": str(error)[:_MAX_ERROR_LENGTH],
+        "payload": payload,
+        "kafka_topic": getattr(record, "topic", None),
+        "kafka_partition": getattr(record, "partition", None),
+        "kafka_offset": getattr(record, "offset", None),
+        "created_at": now,
+        "status": PENDING if retry else PARKED,
+        "attempts": 1,
+        "next_attempt_at": now + timedelta(seconds=retry_delay(1)) if retry else None,
+    }
+
+
+@timed()
+async def park(entries: List[dict]):
+    """Сохраняет пачку записей одним INSERT"""
+    if not entries:
+        return
+    await database.execute(dead_letter_events.insert().values(entries))
+    for entry in entries:
+        dead_letters.labels(entry["reason"]).inc()
+    logger.warning("В dead letter отправлено записей: %s", len(entries))
+
+
+async def flush_stock_buffer(retried=frozenset()) -> set:
+    """
+    Сбрасывает буфер отложенной записи остатков и отправляет в dead letter события,
+    чей расход БД отклонила при записи, кроме retried (у них запись в dead letter уже есть).
+    Возвращает id отклоненных событий; ошибка записи или dead letter пробрасывается.
+    """
+    rejected = await stock_buffer.flush()
+    await park([
+        dead_letter_entry(_BufferedRecord(message.model_dump_json().encode()), "rejected", _REJECTED_ON_FLUSH,
+                          event["event_id"])
+        for event, message in rejected if event["event_id"] not in retried
+    ])
+    return {event["event_id"] for event, _ in rejected}
+
+
+async def _claim_due(limit: int) -> list:
+    """
+    Забирает созревшие записи одним UPDATE ... RETURNING, сдвигая next_attempt_at
+    на время аренды: параллельный воркер с тем же запросом их уже не увидит.
+    """
+    now = datetime.utcnow()
+    due = (
+        select(dead_letter_events.c.id)
+        .where(dead_letter_events.c.status == PENDING, dead_letter_events.c.next_attempt_at <= now)
+        .order_by(dead_letter_events.c.next_attempt_at)
+        .limit(limit)
+    )
+    query = (
+        dead_letter_events.update()
+        .where(dead_letter_events.c.id.in_(due), dead_letter_events.c.status == PENDING,
+               dead_letter_events.c.next_attempt_at <= now)
+        .values(next_attempt_at=now + timedelta(seconds=_CLAIM_LEASE_SECONDS))
+        .returning(dead_letter_events.c.id, dead_letter_events.c.event_id, dead_letter_events.c.payload,
+                   dead_letter_events.c.attempts)
+    )
+    rows = await database.fetch_all(query)
+    # Порядок поступления: события одного перемещения повторяются в исходной очередности
+    return sorted(rows, key=lambda row: row["id"])
+
+
+async def _attempt(payload: bytes):
+    """
+    Одна повторная попытка: (результат, ошибка); результат None — повторять бесполезно
+    (запись не разбирается или расход отклонен)
+    """
+    try:
+        event = decode_event(payload)
+    except ValidationError as e:
+        return None, e
+    try:
+        if await process_message(event):
+            return True, None
+        return None, stock_rejection(event)
+    except Exception as e:
+        return False, e
+
+
+@timed()
+async def retry_due(limit: int) -> int:
+    """Повторяет созревшие события; возвращает число взятых в работу записей"""
+    rows = await _claim_due(limit)
+    if not rows:
+        return 0
+
+    outcomes = [(row, *await _attempt(row["payload"])) for row in rows]
+    # При отложенной записи остатков событие применено только после flush()
+    if stock_buffer.enabled:
+        rejected = await flush_stock_buffer({row["event_id"] for row in rows})
+        outcomes = [
+            (row, None, _REJECTED_ON_FLUSH) if result and row["event_id"] in rejected else (row, result, error)
+            for row, result, error in outcomes
+        ]
+
+    replayed = [row["id"] for row, result, _ in outcomes if result]
+    now = datetime.utcnow()
+    async with database.transaction():
+        if replayed:
+            await database.execute(
+                dead_letter_events.update().where(dead_letter_events.c.id.in_(replayed))
+                .values(status=REPLAYED, next_attempt_at=None, error=None)
+            )
+        for row, result, error in outcomes:
+            if result:
+                continue
+            attempts = row["attempts"] + 1
+            if result is None or attempts >= settings.DEAD_LETTER_MAX_ATTEMPTS:
+                values = {"status": PARKED, "next_attempt_at": None}
+            else:
+                values = {"status": PENDING, "next_attempt_at": now + timedelta(seconds=retry_delay(attempts))}
+            await database.execute(
+                dead_letter_events.update().where(dead_letter_events.c.id == row["id"])
+                .values(attempts=attempts, error=str(error)[:_MAX_ERROR_LENGTH], **values)
+            )
+            dead_letter_retries.labels(values["status"]).inc()
+
+    dead_letter_retries.labels(REPLAYED).inc(len(replayed))
+    logger.info("Повторно обработано событий: %s, успешно: %s", len(rows), len(replayed))
+    return len(rows)
+
+
+async def retry_periodically(interval: float, batch_size: int):
+    """Фоновая задача: раз в interval секунд повторяет созревшие события, пока они есть"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            while await retry_due(batch_size) == batch_size:
+                pass
+        except Exception as e:
+            logger.error("Ошибка при повторной обработке событий: %s", e)
+
+
+@timed()
+async def list_dead_letters(status: Optional[str], reason: Optional[str], limit: int,
+                            after_id: Optional[int] = None) -> DeadLetterPage:
+    """Страница записей dead letter по возрастанию id (keyset-пагинация)"""
+    query = select(dead_letter_events)
+    if status:
+        query = query.where(dead_letter_events.c.status == status)
+    if reason:
+        query = query.where(dead_letter_events.c.reason == reason)
+    if after_id is not None:
+        query = query.where(dead_letter_events.c.id > after_id)
+    rows = await database.fetch_all(query.order_by(dead_letter_events.c.id).limit(limit + 1))
+
+    items = [
+        DeadLetterEventInfo(
+            id=row["id"],
+            event_id=row["event_id"],
+            reason=row["reason"],
+            error=row["error"],
+            status=row["status"],
+            attempts=row["attempts"],
+            next_attempt_at=row["next_attempt_at"],
+            kafka_topic=row["kafka_topic"],
+            kafka_partition=row["kafka_partition"],
+            kafka_offset=row["kafka_offset"],
+            created_at=row["created_at"],
+            payload=bytes(row["payload"]).decode("utf-8", errors="replace"),
+        )
+        for row in rows[:limit]
+    ]
+    next_after_id = items[-1].id if len(rows) > limit else None
+    return DeadLetterPage(items=items, next_after_id=next_after_id)
+
+
+@timed()
+async def replay_dead_letters(status: str, ids: Optional[List[int]] = None, reason: Optional[str] = None) -> int:
+    """
+    Возвращает записи в очередь повторов с обнуленным счетчиком попыток; сами
+    события применит ближайший проход retry_periodically. Возвращает их число.
+    """
+    query = dead_letter_events.update().where(dead_letter_events.c.status == status)
+    if ids:
+        query = query.where(dead_letter_events.c.id.in_(ids))
+    if reason:
+        query = query.where(dead_letter_events.c.reason == reason)
+    query = query.values(status=PENDING, attempts=0, next_attempt_at=datetime.utcnow())
+    requeued = len(await database.fetch_all(query.returning(dead_letter_events.c.id)))
+    logger.info("В очередь повторов возвращено записей dead letter: %s", requeued)
+    return requeued
@@ -0,0 +1,26 @@
+"""
+Разбор записей Kafka.
+
+Сырые байты записи валидируются сразу в модель через model_validate_json: JSON
+разбирается парсером pydantic-core без промежуточного dict и повторного обхода
+полей. На горячем пути используется MovementEvent (id и data): остальные поля
+конверта CloudEvent не валидируются, а при необходимости разбираются из тех же
+байтов через decode_envelope(). KAFKA_VALIDATE_ENVELOPE=true возвращает полную
+проверку конверта для каждой записи.
+"""
+from typing import Union
+
+from app.core.config import settings
+from app.models.schemas import KafkaMessage, MovementEvent
+
+_EVENT_MODEL = KafkaMessage if settings.KAFKA_VALIDATE_ENVELOPE else MovementEvent
+
+
+def decode_event(raw: Union[bytes, str]) -> MovementEvent:
+    """Байты записи -> событие; pydantic.ValidationError для некорректной записи"""
+    return _EVENT_MODEL.model_validate_json(raw)
+
+
+def decode_envelope(raw: Union[bytes, str]) -> KafkaMessage:
+    """Полный конверт CloudEvent (по требованию, не на горячем пути)"""
+    return KafkaMessage.model_validate_json(raw)
@@ -0,0 +1,56 @@
+"""
+Потоковая выгрузка строк БД в NDJSON или CSV.
+
+Строки читаются курсором (databases.iterate: на PostgreSQL — серверный курсор),
+набираются в кусок по chunk_rows строк и отдаются по одному куску, поэтому
+память не зависит от объема выгрузки, а цикл событий освобождается между
+порциями курсора.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Sequence
+
+MOVEMENT_COLUMNS = (
+    "movement_id", "source_warehouse", "destination_warehouse", "product_id", "departure_time", "arrival_time",
+    "time_difference_seconds", "departure_quantity", "arrival_quantity", "quantity_difference",
+)
+STOCK_COLUMNS = ("warehouse_id", "product_id", "quantity")
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+async def encode_rows(rows: AsyncIterator, columns: Sequence[str], export_format: str,
+                      chunk_rows: int = 1000) -> AsyncIterator[str]:
+    """Сериализует поток строк (row[column]) в NDJSON или CSV с заголовком, кусками по chunk_rows строк"""
+    buffer = io.StringIO()
+    if export_format == "csv":
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(columns)
+
+        def write(row):
+            writer.writerow([_value(row[column]) for column in columns])
+    else:
+        def write(row):
+            buffer.write(json.dumps({column: _value(row[column]) for column in columns}, ensure_ascii=False))
+            buffer.write("\n")
+
+    pending = 0
+    async for row in rows:
+        write(row)
+        pending += 1
+        if pending == chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,65 @@
+"""
+Состояние пулов соединений и готовность сервиса (эндпоинты /health и /ready).
+
+/health не обращается к БД: отвечает, пока жив процесс, и показывает заполнение
+пулов. /ready выполняет SELECT 1 через общий пул databases с таймаутом: если БД
+недоступна или пул исчерпан так, что соединение не получить за
+DB_READY_TIMEOUT_SECONDS, сервис не готов принимать трафик.
+"""
+import asyncio
+import logging
+import time
+from typing import List
+
+from sqlalchemy.pool import QueuePool
+
+from app.core.config import settings
+from app.core.metrics import CallbackMetric
+from app.models.database import database, engine
+from app.models.schemas import HealthStatus, PoolStats, ReadinessStatus
+
+logger = logging.getLogger(__name__)
+
+
+def pool_stats() -> List[PoolStats]:
+    """Заполнение пула databases (asyncpg; у SQLite пула нет) и синхронного пула, если он держит соединения"""
+    stats = []
+    # databases не отдает пул публично; у PostgresBackend это asyncpg.Pool (None до connect)
+    pool = getattr(database._backend, "_pool", None) if database.url.dialect == "postgresql" else None
+    if pool is not None:
+        size, in_use, max_size = pool.get_size(), pool.get_size() - pool.get_idle_size(), pool.get_max_size()
+        stats.append(PoolStats(name="async", size=size, in_use=in_use, max_size=max_size,
+                               saturation=in_use / max_size))
+    sync_pool = engine.pool
+    if isinstance(sync_pool, QueuePool):
+        max_size = sync_pool.size() + max(settings.DB_POOL_MAX_OVERFLOW, 0)
+        in_use = sync_pool.checkedout()
+        stats.append(PoolStats(name="sync", size=sync_pool.checkedin() + in_use, in_use=in_use,
+                               max_size=max_size, saturation=in_use / max_size))
+    return stats
+
+
+def health() -> HealthStatus:
+    return HealthStatus(status="ok", pools=pool_stats())
+
+
+async def readiness(timeout: float = None) -> ReadinessStatus:
+    timeout = timeout or settings.DB_READY_TIMEOUT_SECONDS
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(database.fetch_val("SELECT 1"), timeout)
+    except Exception as e:
+        error = str(e) or type(e).__name__
+        logger.warning("Проверка готовности: БД недоступна: %s", error)
+        return ReadinessStatus(status="unavailable", ready=False, error=error, pools=pool_stats())
+    latency_ms = (time.perf_counter() - started) * 1000
+    return ReadinessStatus(status="ok", ready=True, db_latency_ms=round(latency_ms, 3), pools=pool_stats())
+
+
+def _pool_gauges(field: str):
+    return lambda: {(stats.name,): getattr(stats, field) for stats in pool_stats()}
+
+
+CallbackMetric("db_pool_size", "Открытые соединения пула", "gauge", ("pool",), _pool_gauges("size"))
+CallbackMetric("db_pool_in_use", "Соединения пула, занятые запросами", "gauge", ("pool",), _pool_gauges("in_use"))
+CallbackMetric("db_pool_max_size", "Максимальный размер пула", "gauge", ("pool",), _pool_gauges("max_size"))
@@ -0,0 +1,85 @@
+"""
+Идемпотентная обработка событий Kafka по CloudEvent id.
+
+Первая линия — ограниченный LRU-набор недавно примененных id в памяти: повторная
+доставка после перезапуска или ребаланса обычно попадает в него и отбрасывается
+без обращения к БД. Источник истины — таблица processed_events: отметка пишется в
+той же транзакции, что и изменения остатков, поэтому событие либо применено и
+отмечено, либо ни то ни другое. Старые отметки удаляются по возрасту.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from app.core.config import settings
+from app.core.metrics import Counter, timed
+from app.models.database import database, processed_events
+from app.services import upsert
+from app.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+events_deduplicated = Counter(
+    "events_deduplicated", "Пропущенные повторные события Kafka по месту обнаружения", ("source",)
+)
+_DEDUP_MEMORY = events_deduplicated.labels("memory")
+_DEDUP_DATABASE = events_deduplicated.labels("database")
+
+# Запись в памяти живет не дольше отметки в БД, чтобы не отбрасывать события, которые БД уже забыла
+processed_event_cache = TTLCache(settings.IDEMPOTENCY_CACHE_SIZE, settings.IDEMPOTENCY_RETENTION_SECONDS)
+
+
+def seen_recently(event_id: str) -> bool:
+    """O(1) проверка по памяти; True — событие уже применено этим процессом"""
+    found, _ = processed_event_cache.get(event_id)
+    if found:
+        _DEDUP_MEMORY.inc()
+    return found
+
+
+def remember(event_id: str):
+    processed_event_cache.set(event_id, True)
+
+
+@timed()
+async def mark_processed(event_id: str) -> bool:
+    """
+    Записывает отметку о событии в текущей транзакции.
+    Возвращает False, если событие уже было отмечено (дубль).
+    """
+    query = upsert.processed_event_insert(database.url.dialect, event_id, datetime.utcnow())
+    if await database.fetch_val(query) is None:
+        _DEDUP_DATABASE.inc()
+        remember(event_id)
+        return False
+    return True
+
+
+@timed()
+async def is_processed(event_id: str) -> bool:
+    """Проверка отметки в БД без записи (для режима отложенной записи остатков)"""
+    query = processed_events.select().with_only_columns(processed_events.c.event_id).where(
+        processed_events.c.event_id == event_id
+    )
+    if await database.fetch_val(query) is None:
+        return False
+    _DEDUP_DATABASE.inc()
+    remember(event_id)
+    return True
+
+
+@timed()
+async def prune_processed_events(retention_seconds: float):
+    """Удаляет отметки старше retention_seconds (по индексу processed_at)"""
+    cutoff = datetime.utcnow() - timedelta(seconds=retention_seconds)
+    await database.execute(processed_events.delete().where(processed_events.c.processed_at < cutoff))
+
+
+async def prune_periodically(interval: float, retention_seconds: float):
+    """Фоновая задача: раз в interval секунд удаляет устаревшие отметки"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await prune_processed_events(retention_seconds)
+        except Exception as e:
+            logger.error("Ошибка при очистке processed_events: %s", e)
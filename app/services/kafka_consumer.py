@@ -1,67 +1,278 @@
-import json
 import threading
-from kafka import KafkaConsumer
-from app.models.schemas import KafkaMessage
-from app.services.warehouse_services import process_message
+import time
+from kafka import ConsumerRebalanceListener, KafkaConsumer
+from pydantic import ValidationError
+from app.services.warehouse_services import process_message, process_batch
+from app.services.stock_buffer import stock_buffer
+from app.services.decoding import decode_event
+from app.services.dead_letter import dead_letter_entry, flush_stock_buffer, park, stock_rejection
 import asyncio
 import logging
 from app.core.config import settings
+from app.core.metrics import (
+    KAFKA_PROCESSED, KAFKA_FAILED, KAFKA_INVALID, kafka_assigned_partitions, kafka_batch_size, kafka_consumer_lag,
+    kafka_consumer_restarts
+)
 from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
 
 class KafkaConsumerService:
-    def __init__(self, bootstrap_servers, topic, loop=None):
+    def __init__(self, bootstrap_servers, topic, loop=None, batch_mode=None, batch_size=None,
+                 poll_timeout_ms=None, batch_concurrency=None):
         self.bootstrap_servers = bootstrap_servers
         self.topic = topic
         self.consumer = None
         self.loop = loop or asyncio.get_event_loop()
         self.should_stop = False
+        # Последний цикл poll завершился сбоем; смещения при этом не фиксируются
+        self.failed = False
+        self.batch_mode = settings.KAFKA_BATCH_MODE if batch_mode is None else batch_mode
+        self.batch_size = batch_size or settings.KAFKA_BATCH_SIZE
+        self.poll_timeout_ms = poll_timeout_ms or settings.KAFKA_POLL_TIMEOUT_MS
+        self.batch_concurrency = batch_concurrency or settings.KAFKA_BATCH_CONCURRENCY
+        self._lag_checked_at = 0.0
 
-    def start(self):
-        with ThreadPoolExecutor() as executor:
-            executor.submit(self._consume)
+    def start(self) -> asyncio.Task:
+        """
+        Запускает потребитель фоновой задачей под надзором (supervise) и сразу возвращает
+        ее: недоступный брокер не задерживает старт приложения. Вызывается из цикла self.loop.
+        """
         logger.info(f"Запущен Kafka-потребитель для темы {self.topic}")
+        return self.loop.create_task(self.supervise())
+
+    async def supervise(self, base_delay: float = None, max_delay: float = None, healthy_after: float = 60.0):
+        """
+        Выполняет блокирующий цикл потребления в отдельном потоке и перезапускает его после
+        сбоя (недоступный брокер, разрыв соединения) с экспоненциальной задержкой. Если цикл
+        проработал дольше healthy_after секунд, задержка сбрасывается. Завершается после stop().
+        """
+        base_delay = base_delay or settings.KAFKA_RECONNECT_BASE_MS / 1000
+        max_delay = max_delay or settings.KAFKA_RECONNECT_MAX_SECONDS
+        delay = base_delay
+        # Свой поток, чтобы poll не занимал пул run_in_executor по умолчанию
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="kafka-consumer") as executor:
+            while not self.should_stop:
+                started = time.monotonic()
+                await self.loop.run_in_executor(executor, self._consume)
+                if self.should_stop:
+                    break
+                if time.monotonic() - started > healthy_after:
+                    delay = base_delay
+                kafka_consumer_restarts.inc()
+                logger.warning("Kafka-потребитель остановился, переподключение через %.1f с", delay)
+                await asyncio.sleep(delay)
+                delay = min(max_delay, delay * 2)
 
     def stop(self):
         self.should_stop = True
         logger.info(f"Остановлен Kafka-потребитель для темы {self.topic}")
 
+    def run(self):
+        """
+        Блокирующий цикл потребления в текущем потоке; завершается после stop() или
+        после сбоя (тогда self.failed, и процесс воркера должен перезапуститься)
+        """
+        logger.info(f"Запущен Kafka-потребитель для темы {self.topic}")
+        self._consume()
+
+    def _create_consumer(self):
+        # В пакетном режиме смещения фиксируются вручную после записи пачки в БД,
+        # при отложенной записи остатков — после сброса буфера
+        consumer = KafkaConsumer(
+            bootstrap_servers=self.bootstrap_servers,
+            auto_offset_reset='earliest',
+            enable_auto_commit=not (self.batch_mode or stock_buffer.enabled),
+            group_id=settings.KAFKA_GROUP_ID,
+            max_poll_records=self.batch_size
+        )
+        consumer.subscribe([self.topic], listener=_RebalanceListener(self))
+        return consumer
+
     def _consume(self):
+        """
+        Цикл poll: stop() срабатывает не позже poll_timeout_ms даже без входящих сообщений.
+        Полученная пачка всегда дорабатывается до конца, чтобы автокоммит при закрытии
+        не зафиксировал смещения необработанных записей. После сбоя (в том числе записи
+        в dead letter) смещения не фиксируются: позиция потребителя может опережать
+        обработанные записи, и supervise продолжит с последнего зафиксированного смещения.
+        """
+        self.failed = False
         try:
-            self.consumer = KafkaConsumer(
-                self.topic,
-                bootstrap_servers=self.bootstrap_servers,
-                auto_offset_reset='earliest',
-                enable_auto_commit=True,
-                group_id='warehouse-service',
-                value_deserializer=lambda x: json.loads(x.decode('utf-8'))
-            )
+            self.consumer = self._create_consumer()
 
-            for message in self.consumer:
-                if self.should_stop:
+            while not self.should_stop:
+                records = self.consumer.poll(timeout_ms=self.poll_timeout_ms, max_records=self.batch_size)
+                if self.failed:
+                    # Буфер остатков не записан при отзыве партиций (_RebalanceListener):
+                    # записи новых партиций не обрабатываются
                     break
+                if not records:
+                    self._flush_stock_buffer()
+                    continue
 
-                try:
-                    kafka_message = KafkaMessage(**message.value)
-                    future = asyncio.run_coroutine_threadsafe(
-                        process_message(kafka_message),
-                        self.loop
-                    )
-                    result = future.result()
-
-                    if result:
-                        logger.info(f"Успешно обработано сообщение: {kafka_message.data.movement_id}")
-                    else:
-                        logger.warning(f"Не удалось обработать сообщение: {kafka_message.data.movement_id}")
-
-                except Exception as e:
-                    logger.error(f"Ошибка при обработке сообщения Kafka: {e}")
+                batch = [record for partition_records in records.values() for record in partition_records]
+                if self.batch_mode:
+                    self._process_batch(batch)
+                else:
+                    for record in batch:
+                        self._process_record(record)
+                self._flush_stock_buffer()
+                self._update_lag()
 
         except Exception as e:
+            self.failed = True
             logger.error(f"Ошибка при подключении к Kafka: {e}")
 
         finally:
             if self.consumer:
-                self.consumer.close()
\ No newline at end of file
+                try:
+                    if not self.failed:
+                        self._flush_stock_buffer(force=True)
+                except Exception:
+                    # Ошибка уже в логе; смещения не зафиксированы, события будут доставлены повторно
+                    self.failed = True
+                self.consumer.close(autocommit=not self.failed)
+                # supervise создаст новый потребитель при перезапуске
+                self.consumer = None
+
+    def _process_record(self, record):
+        try:
+            kafka_message = decode_event(record.value)
+        except ValidationError as e:
+            KAFKA_INVALID.inc()
+            self._park([dead_letter_entry(record, "malformed", e)])
+            return
+
+        try:
+            future = asyncio.run_coroutine_threadsafe(
+                process_message(kafka_message),
+                self.loop
+            )
+            result = future.result()
+        except Exception as e:
+            KAFKA_FAILED.inc()
+            logger.error("Ошибка при обработке сообщения Kafka: %s", e)
+            self._park([dead_letter_entry(record, "error", e, kafka_message.id, retry=True)])
+            return
+
+        if result:
+            KAFKA_PROCESSED.inc()
+            logger.info("Успешно обработано сообщение: %s", kafka_message.data.movement_id)
+        else:
+            KAFKA_FAILED.inc()
+            logger.warning("Расход отклонен: %s", kafka_message.data.movement_id)
+            self._park([dead_letter_entry(record, "rejected", stock_rejection(kafka_message), kafka_message.id)])
+
+    def _process_batch(self, batch):
+        kafka_batch_size.observe(len(batch))
+        decoded, malformed = self._decode_batch(batch)
+        KAFKA_INVALID.inc(len(malformed))
+        self._park(malformed)
+
+        if decoded:
+            messages = [message for _, message in decoded]
+            future = asyncio.run_coroutine_threadsafe(
+                process_batch(messages, self.batch_concurrency),
+                self.loop
+            )
+            results = future.result()
+            failed = [
+                dead_letter_entry(record, "error", result, message.id, retry=True) if isinstance(result, Exception)
+                else dead_letter_entry(record, "rejected", stock_rejection(message), message.id)
+                for (record, message), result in zip(decoded, results) if result is not True
+            ]
+            KAFKA_PROCESSED.inc(len(results) - len(failed))
+            KAFKA_FAILED.inc(len(failed))
+            if failed:
+                logger.warning("Не удалось обработать %s из %s сообщений пачки", len(failed), len(messages))
+                self._park(failed)
+
+        # Фиксируем смещения только после того, как вся пачка записана в БД
+        if not stock_buffer.enabled:
+            self.consumer.commit()
+        logger.info("Обработана пачка из %s сообщений", len(batch))
+
+    def _flush_stock_buffer(self, force: bool = False):
+        """
+        Сбрасывает буфер отложенной записи остатков, если пора (или force), и только
+        после успешной записи фиксирует смещения. Расходы, отклоненные БД, уходят в
+        dead letter и не держат остальные события. Ошибка записи пробрасывается без
+        фиксации смещений: цикл poll останавливается, и supervise перезапускает его с
+        последнего зафиксированного смещения, а события остаются в буфере до следующей попытки.
+        """
+        if not stock_buffer.enabled or not (force or stock_buffer.due()):
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(flush_stock_buffer(), self.loop).result()
+        except Exception as e:
+            logger.error("Ошибка при записи буфера остатков, потребитель остановлен: %s", e)
+            raise
+        self.consumer.commit()
+
+    def _update_lag(self, interval: float = 1.0):
+        """Обновляет метрику отставания не чаще раза в interval секунд (metrics() недешев)"""
+        now = time.monotonic()
+        if now - self._lag_checked_at < interval:
+            return
+        self._lag_checked_at = now
+        try:
+            lag = self.consumer.metrics().get("consumer-fetch-manager-metrics", {}).get("records-lag-max")
+        except Exception:
+            return
+        if lag is not None and lag >= 0:
+            kafka_consumer_lag.set(lag)
+
+    def _decode_batch(self, records):
+        """Разбирает пачку; возвращает пары (запись, событие) и строки dead letter для некорректных записей"""
+        decoded, malformed = [], []
+        for record in records:
+            try:
+                decoded.append((record, decode_event(record.value)))
+            except ValidationError as e:
+                malformed.append(dead_letter_entry(record, "malformed", e))
+        return decoded, malformed
+
+    def _park(self, entries):
+        """
+        Сохраняет записи в dead letter до фиксации смещений; повторы выполняет фоновая
+        задача retry_periodically, не задерживая поток. Ошибка БД пробрасывается: иначе
+        смещения зафиксировались бы, и событие было бы потеряно.
+        """
+        if not entries:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(park(entries), self.loop).result()
+        except Exception as e:
+            logger.error("Не удалось сохранить %s записей в dead letter, смещения не фиксируются: %s", len(entries), e)
+            raise
+
+class _RebalanceListener(ConsumerRebalanceListener):
+    """
+    Колбэки ребаланса вызываются внутри poll(), то есть между пачками: к этому
+    моменту все полученные записи обработаны, а их смещения зафиксированы
+    (после пачки, автокоммитом перед ребалансом или после сброса буфера остатков),
+    поэтому незавершенной работы при отзыве партиций нет. Партиции переходят к
+    другому воркеру группы целиком.
+    """
+
+    def __init__(self, service):
+        self.service = service
+
+    def on_partitions_revoked(self, revoked):
+        # Отложенные остатки записываются до передачи партиций, иначе новый владелец
+        # получил бы события, чьи дельты еще лежат в памяти этого процесса.
+        # kafka-python только логирует исключения колбэков и продолжил бы poll, поэтому
+        # при ошибке цикл poll прерывается явно: потребитель закрывается без фиксации
+        # смещений, воркер app.consumer завершается с ошибкой, встроенный — перезапускается supervise
+        try:
+            self.service._flush_stock_buffer(force=True)
+        except Exception:
+            self.service.failed = True
+            return
+        logger.info(f"Отозваны партиции: {sorted(partition.partition for partition in revoked)}")
+
+    def on_partitions_assigned(self, assigned):
+        kafka_assigned_partitions.set(len(assigned))
+        logger.info(f"Назначены партиции: {sorted(partition.partition for partition in assigned)}")
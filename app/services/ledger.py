@@ -0,0 +1,230 @@
+"""
+Журнал изменений остатков (stock_events) и снимки остатков (stock_snapshots).
+
+Каждое примененное событие добавляет в журнал строку с дельтой и получившимся
+остатком (quantity_after) в той же транзакции, что и изменение warehouse_states
+(при отложенной записи — одним многострочным INSERT на окно буфера, recorded_at
+тогда — время записи окна). Журнал только дополняется.
+
+Снимок хранит остатки на позицию журнала last_event_id и строится одним
+INSERT ... SELECT из предыдущего снимка и событий после него, поэтому не
+читает журнал целиком. Первый снимок копирует warehouse_states: данные,
+внесенные до появления журнала, попадают в историю через него.
+
+Позиция и данные снимка читаются в одной транзакции. В PostgreSQL id событий
+выдает последовательность до фиксации транзакции, поэтому событие с меньшим id
+может стать видимым позже большего и оказалось бы за позицией снимка навсегда.
+Снимок поэтому берет на stock_events блокировку SHARE до первого запроса
+транзакции REPEATABLE READ: она дожидается транзакций, уже вставляющих события,
+и задерживает новые до конца снимка, так что все id до позиции зафиксированы и
+видны снимку транзакции. В SQLite пишущие транзакции и так выполняются по одной.
+
+rebuild_warehouse_states восстанавливает остатки из последнего снимка плюс
+хвост журнала. Без снимка журнал не содержит остатков, внесенных до его
+появления, поэтому восстановление отказывается работать (NoSnapshot). Пока идет
+восстановление, потребитель должен быть остановлен.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, literal, select, text, tuple_, union_all
+
+from app.core.metrics import timed
+from app.models.database import database, stock_events, stock_snapshot_rows, stock_snapshots, warehouse_states
+from app.services import upsert
+from app.services.cache import warehouse_state_cache
+from app.services.change_notifications import change_notifier
+
+logger = logging.getLogger(__name__)
+
+# Строк остатков в одном многострочном UPSERT при восстановлении
+_REBUILD_CHUNK_SIZE = 500
+
+
+class NoSnapshot(RuntimeError):
+    """Снимка остатков еще нет: по одному журналу остатки до его появления не восстановить"""
+
+
+def ledger_row(event_id: str, movement_id: str, warehouse_id: str, product_id: str, delta: int,
+               occurred_at: datetime, quantity_after: Optional[int] = None) -> dict:
+    """Строка stock_events для примененного события; occurred_at — время события в UTC без пояса"""
+    return {
+        "event_id": event_id,
+        "movement_id": movement_id,
+        "warehouse_id": warehouse_id,
+        "product_id": product_id,
+        "delta": delta,
+        "quantity_after": quantity_after,
+        "occurred_at": occurred_at,
+        "recorded_at": datetime.utcnow(),
+    }
+
+
+async def append(rows: List[dict]):
+    """Добавляет строки в журнал одним INSERT; вызывается внутри транзакции изменения остатков"""
+    if rows:
+        await database.execute(stock_events.insert().values(rows))
+
+
+def stock_as_of_queries(warehouse_id: str, product_id: str, as_of: datetime):
+    """
+    Два запроса остатка на момент as_of (время записи в журнал), каждый — один поиск
+    по индексу (warehouse_id, product_id, recorded_at, id): остаток после последнего
+    изменения не позже as_of и остаток до первого изменения после as_of.
+    """
+    key = (
+        stock_events.c.warehouse_id == warehouse_id,
+        stock_events.c.product_id == product_id,
+        stock_events.c.quantity_after.isnot(None),
+    )
+    before = (
+        select(stock_events.c.quantity_after)
+        .where(*key, stock_events.c.recorded_at <= as_of)
+        .order_by(stock_events.c.recorded_at.desc(), stock_events.c.id.desc())
+        .limit(1)
+    )
+    after = (
+        select(stock_events.c.quantity_after - stock_events.c.delta)
+        .where(*key, stock_events.c.recorded_at > as_of)
+        .order_by(stock_events.c.recorded_at, stock_events.c.id)
+        .limit(1)
+    )
+    return before, after
+
+
+async def _latest_snapshot():
+    return await database.fetch_one(select(stock_snapshots).order_by(stock_snapshots.c.id.desc()).limit(1))
+
+
+def _stock_at(snapshot, last_event_id: Optional[int] = None, warehouse_id: Optional[str] = None):
+    """
+    SELECT (warehouse_id, product_id, quantity): строки снимка плюс сумма дельт журнала
+    после него (до last_event_id включительно, если задан)
+    """
+    events = select(stock_events.c.warehouse_id, stock_events.c.product_id, stock_events.c.delta.label("quantity"))
+    parts = []
+    if snapshot is not None:
+        events = events.where(stock_events.c.id > snapshot["last_event_id"])
+        parts.append(
+            select(stock_snapshot_rows.c.warehouse_id, stock_snapshot_rows.c.product_id, stock_snapshot_rows.c.quantity)
+            .where(stock_snapshot_rows.c.snapshot_id == snapshot["id"])
+        )
+    if last_event_id is not None:
+        events = events.where(stock_events.c.id <= last_event_id)
+    parts.append(events)
+    if warehouse_id is not None:
+        parts = [part.where(part.selected_columns.warehouse_id == warehouse_id) for part in parts]
+
+    combined = union_all(*parts).subquery()
+    return (
+        select(combined.c.warehouse_id, combined.c.product_id, func.sum(combined.c.quantity).label("quantity"))
+        .group_by(combined.c.warehouse_id, combined.c.product_id)
+    )
+
+
+@timed()
+async def take_snapshot() -> Optional[int]:
+    """Сохраняет снимок остатков на текущую позицию журнала; None, если новых событий не было"""
+    postgres = database.url.dialect == "postgresql"
+    async with database.transaction(**({"isolation": "repeatable_read"} if postgres else {})):
+        if postgres:
+            # До первого запроса: снимок транзакции берется уже после фиксации всех вставляющих события
+            await database.execute(text("LOCK TABLE stock_events IN SHARE MODE"))
+        previous = await _latest_snapshot()
+        last_event_id = await database.fetch_val(select(func.coalesce(func.max(stock_events.c.id), 0)))
+        if previous is not None and previous["last_event_id"] == last_event_id:
+            return None
+
+        snapshot_id = await database.fetch_val(
+            stock_snapshots.insert().values(last_event_id=last_event_id, taken_at=datetime.utcnow())
+            .returning(stock_snapshots.c.id)
+        )
+        if previous is None:
+            source = select(warehouse_states.c.warehouse_id, warehouse_states.c.product_id, warehouse_states.c.quantity)
+        else:
+            source = _stock_at(previous, last_event_id)
+        source = source.subquery()
+        await database.execute(stock_snapshot_rows.insert().from_select(
+            ["snapshot_id", "warehouse_id", "product_id", "quantity"],
+            select(literal(snapshot_id), source.c.warehouse_id, source.c.product_id, source.c.quantity)
+        ))
+
+    logger.info("Сохранен снимок остатков %s на позицию журнала %s", snapshot_id, last_event_id)
+    return snapshot_id
+
+
+@timed()
+async def prune_snapshots(keep: int):
+    """Удаляет все снимки, кроме keep последних"""
+    kept = select(stock_snapshots.c.id).order_by(stock_snapshots.c.id.desc()).limit(keep).subquery()
+    stale = select(stock_snapshots.c.id).where(stock_snapshots.c.id.not_in(select(kept.c.id)))
+    async with database.transaction():
+        # Строки удаляются явно: в SQLite каскад по внешнему ключу по умолчанию выключен
+        await database.execute(stock_snapshot_rows.delete().where(stock_snapshot_rows.c.snapshot_id.in_(stale)))
+        await database.execute(stock_snapshots.delete().where(stock_snapshots.c.id.in_(stale)))
+
+
+async def snapshot_periodically(interval: float, keep: int):
+    """Фоновая задача: раз в interval секунд снимает остатки и удаляет старые снимки"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await take_snapshot() is not None:
+                await prune_snapshots(keep)
+        except Exception as e:
+            logger.error("Ошибка при сохранении снимка остатков: %s", e)
+
+
+async def _required_snapshot():
+    snapshot = await _latest_snapshot()
+    if snapshot is None:
+        raise NoSnapshot("Нет снимка остатков: сначала выполните python -m app.ledger snapshot")
+    return snapshot
+
+
+async def stock_from_ledger(warehouse_id: Optional[str] = None) -> Dict[Tuple[str, str], int]:
+    """Остатки, вычисленные по последнему снимку и журналу после него; NoSnapshot без снимка"""
+    rows = await database.fetch_all(_stock_at(await _required_snapshot(), warehouse_id=warehouse_id))
+    return {(row["warehouse_id"], row["product_id"]): row["quantity"] for row in rows}
+
+
+@timed()
+async def rebuild_warehouse_states(warehouse_id: Optional[str] = None) -> int:
+    """
+    Перезаписывает остатки (всех складов или одного) значениями из снимка и журнала.
+    Ключи warehouse_states, которых нет ни в снимке, ни в журнале, в той же транзакции
+    обнуляются. Возвращает число записанных строк; NoSnapshot, если снимка нет.
+    """
+    async with database.transaction():
+        snapshot = await _required_snapshot()
+        stock_query = _stock_at(snapshot, warehouse_id=warehouse_id)
+        rows = await database.fetch_all(stock_query)
+        rows = [(row["warehouse_id"], row["product_id"], row["quantity"]) for row in rows]
+        for start in range(0, len(rows), _REBUILD_CHUNK_SIZE):
+            await database.execute(
+                upsert.stock_quantities_upsert(database.url.dialect, rows[start:start + _REBUILD_CHUNK_SIZE])
+            )
+
+        computed = stock_query.subquery()
+        absent = warehouse_states.update().where(
+            warehouse_states.c.quantity != 0,
+            tuple_(warehouse_states.c.warehouse_id, warehouse_states.c.product_id).not_in(
+                select(computed.c.warehouse_id, computed.c.product_id)
+            ),
+        )
+        if warehouse_id is not None:
+            absent = absent.where(warehouse_states.c.warehouse_id == warehouse_id)
+        zeroed = await database.fetch_all(absent.values(quantity=0).returning(
+            warehouse_states.c.warehouse_id, warehouse_states.c.product_id
+        ))
+        await change_notifier.reset()
+    warehouse_state_cache.clear()
+    if zeroed:
+        logger.warning(
+            "Обнулены остатки без истории в снимке и журнале: %s",
+            ", ".join(f"{row['warehouse_id']}:{row['product_id']}" for row in zeroed)
+        )
+    logger.info("Остатки восстановлены из журнала: %s строк", len(rows))
+    return len(rows)
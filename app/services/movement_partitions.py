@@ -0,0 +1,163 @@
+"""
+Секции таблицы movements и срок хранения перемещений.
+
+В PostgreSQL movements секционирована по диапазонам partition_time — времени
+первой записанной половины перемещения: секция movements_ГГГГ_ММ на каждый
+месяц, movements_legacy со всеми строками, записанными до секционирования, и
+movements_default для строк вне созданных диапазонов. Уникальность
+movement_id по всем секциям и быстрый поиск по нему обеспечивает узкая
+таблица movement_keys (movement_id -> partition_time).
+
+create_partitions заранее создает секции на текущий и следующие месяцы, чтобы
+новые строки не попадали в movements_default. expire_partitions отсоединяет
+секции, целиком вышедшие за срок хранения, и переносит их в схему архива (или
+удаляет), затем удаляет их ключи из movement_keys. Отсоединение — короткая
+операция без переписывания данных, в отличие от DELETE по большой таблице.
+Событие, пришедшее по уже отсоединенному перемещению, создаст новую строку
+в movements_default.
+
+В других СУБД (SQLite) секций нет: срок хранения выполняется удалением строк.
+"""
+import logging
+import re
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import text
+
+from app.core.metrics import timed
+from app.models.database import database, movement_keys, movements
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARTITION = "movements_default"
+
+# Граница диапазона в выводе pg_get_expr: FOR VALUES FROM ('...') TO ('...'), нижняя может быть MINVALUE
+_BOUNDS = re.compile(r"FROM \((?:MINVALUE|'([^']+)')\) TO \('([^']+)'\)")
+
+
+class Partition(NamedTuple):
+    name: str
+    # None — нижняя граница MINVALUE (movements_legacy)
+    lower: Optional[datetime]
+    upper: datetime
+
+
+def month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"movements_{month:%Y_%m}"
+
+
+def partitioned() -> bool:
+    return database.url.dialect == "postgresql"
+
+
+async def list_partitions() -> List[Partition]:
+    """Диапазонные секции movements по возрастанию (без movements_default)"""
+    rows = await database.fetch_all(text(
+        "SELECT child.relname AS name, pg_get_expr(child.relpartbound, child.oid) AS bound "
+        "FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = 'movements'::regclass"
+    ))
+    partitions = [parse_partition(row["name"], row["bound"]) for row in rows]
+    return sorted((partition for partition in partitions if partition), key=lambda partition: partition.upper)
+
+
+def parse_partition(name: str, bound: str) -> Optional[Partition]:
+    """Секция по выводу pg_get_expr(relpartbound); None для DEFAULT"""
+    bounds = _BOUNDS.search(bound)
+    if bounds is None:
+        return None
+    lower, upper = bounds.groups()
+    return Partition(name, datetime.fromisoformat(lower) if lower else None, datetime.fromisoformat(upper))
+
+
+@timed()
+async def create_partitions(ahead: int, now: Optional[datetime] = None) -> List[str]:
+    """
+    Создает месячные секции с текущего месяца на ahead месяцев вперед, если их нет.
+    Диапазон, уже покрытый movements_legacy, пропускается. Возвращает имена созданных секций.
+    """
+    if not partitioned():
+        return []
+    current = month_start(now or datetime.utcnow())
+    covered_until = max((partition.upper for partition in await list_partitions()), default=current)
+    created = []
+    for offset in range(ahead + 1):
+        month = add_months(current, offset)
+        if month < covered_until:
+            continue
+        await _create_partition(partition_name(month), month, add_months(month, 1))
+        created.append(partition_name(month))
+    if created:
+        logger.info("Созданы секции movements: %s", ", ".join(created))
+    return created
+
+
+async def _create_partition(name: str, lower: datetime, upper: datetime):
+    bounds = f"FROM ('{lower.isoformat(' ')}') TO ('{upper.isoformat(' ')}')"
+    in_range = f"partition_time >= '{lower.isoformat(' ')}' AND partition_time < '{upper.isoformat(' ')}'"
+    async with database.transaction():
+        stray = await database.fetch_val(text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_range})"))
+        if not stray:
+            await database.execute(text(f"CREATE TABLE {name} PARTITION OF movements FOR VALUES {bounds}"))
+            return
+        # Строки диапазона уже лежат в movements_default: секцию нельзя создать, пока они там
+        logger.warning("Перенос строк из %s в новую секцию %s", DEFAULT_PARTITION, name)
+        await database.execute(text(f"ALTER TABLE movements DETACH PARTITION {DEFAULT_PARTITION}"))
+        await database.execute(text(f"CREATE TABLE {name} PARTITION OF movements FOR VALUES {bounds}"))
+        await database.execute(text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE {in_range} RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ))
+        await database.execute(text(f"ALTER TABLE movements ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+
+
+@timed()
+async def expire_partitions(retention_months: int, archive_schema: str, drop: bool = False,
+                            now: Optional[datetime] = None) -> List[str]:
+    """
+    Отсоединяет секции, верхняя граница которых не позже начала текущего месяца минус
+    retention_months, и переносит их в archive_schema (drop=True — удаляет). Возвращает
+    имена обработанных секций. Без секционирования удаляет строки старше той же границы.
+    """
+    if retention_months <= 0:
+        return []
+    cutoff = add_months(month_start(now or datetime.utcnow()), -retention_months)
+    if not partitioned():
+        await _delete_expired(cutoff)
+        return []
+
+    expired = [partition for partition in await list_partitions() if partition.upper <= cutoff]
+    for partition in expired:
+        async with database.transaction():
+            await database.execute(text(f"ALTER TABLE movements DETACH PARTITION {partition.name}"))
+            if drop:
+                await database.execute(text(f"DROP TABLE {partition.name}"))
+            else:
+                await database.execute(text(f"CREATE SCHEMA IF NOT EXISTS {archive_schema}"))
+                await database.execute(text(f"ALTER TABLE {partition.name} SET SCHEMA {archive_schema}"))
+        # Ключи удаляются после короткой транзакции отсоединения, чтобы не держать блокировку movements
+        condition = movement_keys.c.partition_time < partition.upper
+        if partition.lower is not None:
+            condition &= movement_keys.c.partition_time >= partition.lower
+        await database.execute(movement_keys.delete().where(condition))
+        logger.info(
+            "Секция %s %s", partition.name, "удалена" if drop else f"перенесена в схему {archive_schema}"
+        )
+    return [partition.name for partition in expired]
+
+
+async def _delete_expired(cutoff: datetime):
+    async with database.transaction():
+        await database.execute(movements.delete().where(movements.c.partition_time < cutoff))
+        await database.execute(movement_keys.delete().where(movement_keys.c.partition_time < cutoff))
+    logger.info("Удалены перемещения с partition_time раньше %s", cutoff)
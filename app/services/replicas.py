@@ -0,0 +1,210 @@
+"""
+Чтение запросов API с реплик БД (DATABASE_REPLICA_URLS).
+
+Запросы чтения распределяются по здоровым репликам по кругу. Реплика считается
+здоровой, если последняя проверка (раз в REPLICA_CHECK_INTERVAL_SECONDS) прошла
+и отставание не больше REPLICA_MAX_LAG_SECONDS. Отставание — разница между
+последними recorded_at журнала stock_events на основной БД и на реплике: журнал
+пополняется при каждом изменении остатков, поэтому мера не зависит от механизма
+репликации и работает и на двух файлах SQLite. Если здоровых реплик нет или
+запрос к реплике упал, он выполняется на основной БД, а реплика исключается
+до следующей успешной проверки.
+
+Read-your-writes: ключи (перемещение, остаток), записанные этим процессом за
+последние READ_YOUR_WRITES_SECONDS, читаются с основной БД, иначе только что
+примененное событие могло бы не найтись на реплике (и попасть в кэш чтения).
+Записи отдельного процесса python -m app.consumer здесь не видны — для них
+действует только граница отставания.
+
+Без DATABASE_REPLICA_URLS все чтения идут в основную БД, как раньше.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Hashable, List, Optional
+
+import databases
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core.config import settings
+from app.core.metrics import CallbackMetric, Counter
+from app.models.database import database, database_options, engine_options, stock_events
+from app.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+replica_reads = Counter("replica_reads", "Запросы чтения по месту выполнения", ("target",))
+replica_failovers = Counter("replica_failovers", "Запросы, повторенные на основной БД после ошибки реплики")
+
+# Ключей, записанных за окно read-your-writes, больше не держим (самые старые вытесняются)
+_RECENT_WRITES_SIZE = 100_000
+
+_LAST_RECORDED = select(func.max(stock_events.c.recorded_at))
+
+
+class Replica:
+    def __init__(self, url: str, sync_reads: bool):
+        self.url = url
+        self.database = databases.Database(url, **database_options(url))
+        # Фабрика синхронных сессий нужна только при API_SYNC_READS
+        self.sessions = None
+        if sync_reads:
+            self.sessions = sessionmaker(autocommit=False, autoflush=False,
+                                          bind=create_engine(url, **engine_options(url)))
+        self.healthy = False
+        self.lag_seconds: Optional[float] = None
+        self.checked_at = 0.0
+
+    @property
+    def name(self) -> str:
+        return databases.DatabaseURL(self.url).obscure_password
+
+
+class ReplicaSet:
+    def __init__(self, urls: List[str], max_lag: float, check_interval: float, read_your_writes: float,
+                 sync_reads: bool = False):
+        self.replicas = [Replica(url, sync_reads) for url in urls]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._recent_writes = TTLCache(_RECENT_WRITES_SIZE if read_your_writes > 0 else 0, read_your_writes)
+        self._round_robin = itertools.count()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    async def disconnect(self):
+        for replica in self.replicas:
+            if replica.database.is_connected:
+                await replica.database.disconnect()
+
+    def mark_written(self, key: Hashable):
+        """Ключ только что записан этим процессом: ближайшие чтения — с основной БД"""
+        if self.enabled:
+            self._recent_writes.set(key, True)
+
+    def pick(self, key: Optional[Hashable] = None) -> Optional[Replica]:
+        """Следующая здоровая реплика по кругу или None — читать с основной БД"""
+        if not self.enabled:
+            return None
+        if key is not None and self._recent_writes.get(key)[0]:
+            return None
+        # Результат проверки, которой больше трех интервалов, не доверяем: мониторинг мог остановиться
+        fresh_after = time.monotonic() - 3 * self.check_interval
+        healthy = [replica for replica in self.replicas if replica.healthy and replica.checked_at >= fresh_after]
+        if not healthy:
+            return None
+        return healthy[next(self._round_robin) % len(healthy)]
+
+    def _failed(self, replica: Replica, error: Exception):
+        replica.healthy = False
+        replica_failovers.inc()
+        logger.warning("Реплика %s недоступна, чтение с основной БД: %s", replica.name, error)
+
+    async def _read(self, method: str, query, key: Optional[Hashable]):
+        replica = self.pick(key)
+        if replica is not None:
+            try:
+                result = await getattr(replica.database, method)(query)
+                replica_reads.labels("replica").inc()
+                return result
+            except Exception as e:
+                self._failed(replica, e)
+        replica_reads.labels("primary").inc()
+        return await getattr(database, method)(query)
+
+    async def fetch_one(self, query, key: Optional[Hashable] = None):
+        return await self._read("fetch_one", query, key)
+
+    async def fetch_all(self, query, key: Optional[Hashable] = None):
+        return await self._read("fetch_all", query, key)
+
+    async def fetch_val(self, query, key: Optional[Hashable] = None):
+        return await self._read("fetch_val", query, key)
+
+    async def iterate(self, query, key: Optional[Hashable] = None) -> AsyncIterator:
+        """Потоковое чтение; на основную БД переключается, только если реплика упала до первой строки"""
+        replica = self.pick(key)
+        if replica is not None:
+            started = False
+            try:
+                async for row in replica.database.iterate(query):
+                    started = True
+                    yield row
+                replica_reads.labels("replica").inc()
+                return
+            except Exception as e:
+                if started:
+                    raise
+                self._failed(replica, e)
+        replica_reads.labels("primary").inc()
+        async for row in database.iterate(query):
+            yield row
+
+    def read_sync(self, db: Session, load: Callable[[Session], Any], key: Optional[Hashable] = None):
+        """Синхронное чтение: load(session) на реплике или, при ее ошибке, на сессии основной БД db"""
+        replica = self.pick(key)
+        if replica is not None and replica.sessions is not None:
+            session = replica.sessions()
+            try:
+                result = load(session)
+                replica_reads.labels("replica").inc()
+                return result
+            except Exception as e:
+                self._failed(replica, e)
+            finally:
+                session.close()
+        replica_reads.labels("primary").inc()
+        return load(db)
+
+    async def check(self):
+        """Проверяет доступность и отставание всех реплик"""
+        primary_last: Optional[datetime] = await database.fetch_val(_LAST_RECORDED)
+        for replica in self.replicas:
+            try:
+                # Подключение — здесь же: недоступная при старте реплика подключится при восстановлении
+                if not replica.database.is_connected:
+                    await asyncio.wait_for(replica.database.connect(), self.check_interval)
+                replica_last = await asyncio.wait_for(replica.database.fetch_val(_LAST_RECORDED), self.check_interval)
+            except Exception as e:
+                replica.healthy = False
+                replica.lag_seconds = None
+                logger.warning("Проверка реплики %s не прошла: %s", replica.name, e)
+                continue
+            if primary_last is None or (replica_last is not None and replica_last >= primary_last):
+                lag = 0.0
+            elif replica_last is None:
+                lag = float("inf")
+            else:
+                lag = (primary_last - replica_last).total_seconds()
+            replica.lag_seconds = lag
+            replica.healthy = lag <= self.max_lag
+            replica.checked_at = time.monotonic()
+            if not replica.healthy:
+                logger.warning("Реплика %s отстает на %.1f с, чтение с основной БД", replica.name, lag)
+
+    async def monitor(self):
+        """Фоновая задача: подключение и проверка реплик раз в check_interval секунд"""
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error("Ошибка при проверке реплик: %s", e)
+            await asyncio.sleep(self.check_interval)
+
+
+replicas = ReplicaSet(
+    [url.strip() for url in settings.DATABASE_REPLICA_URLS.split(",") if url.strip()],
+    max_lag=settings.REPLICA_MAX_LAG_SECONDS,
+    check_interval=settings.REPLICA_CHECK_INTERVAL_SECONDS,
+    read_your_writes=settings.READ_YOUR_WRITES_SECONDS,
+    sync_reads=settings.API_SYNC_READS,
+)
+
+CallbackMetric(
+    "replica_lag_seconds", "Отставание реплики по журналу stock_events", "gauge", ("replica",),
+    lambda: {(replica.name,): replica.lag_seconds for replica in replicas.replicas if replica.lag_seconds is not None}
+)
@@ -0,0 +1,51 @@
+"""
+Логарифмические корзины для квантилей (схема DDSketch).
+
+Значение x > 0 попадает в корзину ceil(log_gamma(x / MIN_VALUE)) + 1, где
+gamma = (1 + a) / (1 - a): представитель корзины отличается от любого ее
+значения не более чем на a относительно. Скетч — это счетчики по корзинам,
+поэтому скетчи складываются (сливаются) простым суммированием счетчиков, а
+хранить их можно строками таблицы с UPSERT count = count + 1.
+
+Нулевые, отрицательные и меньшие MIN_VALUE значения попадают в корзину 0.
+"""
+import math
+from typing import Iterable, Optional, Tuple
+
+RELATIVE_ACCURACY = 0.01
+MIN_VALUE = 1e-3
+ZERO_BUCKET = 0
+
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+
+def bucket_of(value: float) -> int:
+    if value < MIN_VALUE:
+        return ZERO_BUCKET
+    return math.ceil(math.log(value / MIN_VALUE) / _LOG_GAMMA) + 1
+
+
+def bucket_value(bucket: int) -> float:
+    """Представитель корзины: середина (gamma^(i-1), gamma^i] в смысле относительной ошибки"""
+    if bucket == ZERO_BUCKET:
+        return 0.0
+    return MIN_VALUE * 2 * _GAMMA ** (bucket - 1) / (_GAMMA + 1)
+
+
+def quantile(buckets: Iterable[Tuple[int, int]], q: float) -> Optional[float]:
+    """
+    Квантиль q по парам (корзина, число значений) по ближайшему рангу ceil(q * n);
+    None для пустого скетча
+    """
+    buckets = sorted(buckets)
+    total = sum(count for _, count in buckets)
+    if not total:
+        return None
+    rank = max(1, math.ceil(q * total))
+    seen = 0
+    for bucket, count in buckets:
+        seen += count
+        if seen >= rank:
+            return bucket_value(bucket)
+    return bucket_value(buckets[-1][0])
@@ -0,0 +1,275 @@
+"""
+Отложенная запись остатков (write-behind).
+
+Дельты событий копятся в памяти по ключу (warehouse_id, product_id) и раз в окно
+или по достижении лимита событий записываются одной транзакцией: многострочный
+UPSERT приходов, один UPDATE расходов, строки журнала stock_events и отметки
+processed_events для всех событий окна. Горячая строка склада обновляется один
+раз за окно, а не на каждое событие.
+
+Проверка расхода идет по остатку из БД на момент первого обращения к ключу в окне
+плюс накопленная дельта, поэтому писатель остатков должен быть один: встроенный
+потребитель или один воркер app.consumer. claim_writer() закрепляет эту роль за
+процессом (в PostgreSQL — advisory-блокировкой), второй писатель не стартует.
+Смещения Kafka фиксируются только после flush(): событие, не дошедшее до БД,
+будет доставлено повторно. Расход, который БД отклоняет при записи окна (остаток
+изменился мимо буфера), не держит весь буфер: окно записывается по одному событию,
+а отклоненные события возвращаются для dead letter (dead_letter.flush_stock_buffer).
+
+Событие попадает в flush() только после confirm(): пока обработчик еще пишет
+перемещение, его дельта не уходит в БД, и revert() при ошибке безопасен, даже если
+в это время буфер сбрасывает повтор из dead letter или остановка приложения.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.metrics import CallbackMetric, timed
+from app.models.database import database, warehouse_states
+from app.services import ledger, upsert
+from app.services.cache import warehouse_state_cache
+from app.services.change_notifications import change_notifier
+
+logger = logging.getLogger(__name__)
+
+StockKey = Tuple[str, str]
+
+# Ключ advisory-блокировки единственного писателя остатков (PostgreSQL)
+_WRITER_LOCK_KEY = 7_301_013
+
+
+class WriterConflict(RuntimeError):
+    """Роль писателя остатков при отложенной записи уже занята другим процессом"""
+
+
+class StockWriteBuffer:
+    def __init__(self, enabled: bool, interval: float, max_events: int):
+        self.enabled = enabled
+        self.interval = interval
+        self.max_events = max_events
+        # ключ -> [остаток в БД на начало окна, накопленная дельта]
+        self._entries: Dict[StockKey, List[int]] = {}
+        # Строки журнала stock_events (ledger.ledger_row) в порядке применения
+        self._events: List[dict] = []
+        self._pending_ids = set()
+        # События, обработка которых еще не завершена (apply() без confirm()/revert())
+        self._unconfirmed = set()
+        # id события -> source из apply(): по нему отклоненное при записи событие уходит в dead letter
+        self._sources: Dict[str, Any] = {}
+        self._window_started = time.monotonic()
+        self._flushing = False
+        self._writer_connection = None
+
+    async def claim_writer(self):
+        """
+        Закрепляет за процессом роль писателя остатков до release_writer(): в PostgreSQL
+        берет сессионную advisory-блокировку на отдельном соединении; WriterConflict,
+        если ее держит другой процесс. Без отложенной записи и в SQLite ничего не делает.
+        """
+        if not self.enabled or database.url.dialect != "postgresql":
+            return
+        connection = database.connection()
+        await connection.__aenter__()
+        claimed = await connection.fetch_val(text("SELECT pg_try_advisory_lock(:key)").bindparams(key=_WRITER_LOCK_KEY))
+        if not claimed:
+            await connection.__aexit__()
+            raise WriterConflict(
+                "STOCK_WRITE_BEHIND=true: остатки уже пишет другой процесс (встроенный потребитель "
+                "или воркер app.consumer), писатель при отложенной записи должен быть один"
+            )
+        self._writer_connection = connection
+
+    async def release_writer(self):
+        if self._writer_connection is None:
+            return
+        connection, self._writer_connection = self._writer_connection, None
+        try:
+            await connection.execute(text("SELECT pg_advisory_unlock(:key)").bindparams(key=_WRITER_LOCK_KEY))
+        finally:
+            await connection.__aexit__()
+
+    def pending_delta(self, warehouse_id: str, product_id: str) -> int:
+        """Еще не записанная в БД часть изменения остатка (для чтения через буфер)"""
+        entry = self._entries.get((warehouse_id, product_id))
+        return entry[1] if entry else 0
+
+    def has_event(self, event_id: str) -> bool:
+        return event_id in self._pending_ids
+
+    def __len__(self):
+        return len(self._events)
+
+    def due(self) -> bool:
+        """Пора ли сбросить буфер: истекло окно или набралось max_events событий"""
+        if not self._events:
+            return False
+        return len(self._events) >= self.max_events or time.monotonic() - self._window_started >= self.interval
+
+    async def apply(self, event: dict, source: Any = None) -> Optional[int]:
+        """
+        Добавляет дельту события (строку журнала ledger.ledger_row) в буфер; source —
+        исходное событие, которое flush() вернет, если БД отклонит расход. Возвращает
+        ожидаемый остаток или None, если расход больше доступного (остаток в БД плюс накопленное).
+        Принятое событие ждет confirm() или revert() и до этого не записывается.
+        """
+        warehouse_id, product_id, delta = event["warehouse_id"], event["product_id"], event["delta"]
+        key = (warehouse_id, product_id)
+        if key not in self._entries:
+            base = await database.fetch_val(
+                warehouse_states.select().with_only_columns(warehouse_states.c.quantity)
+                .where(warehouse_states.c.id == f"{warehouse_id}:{product_id}")
+            )
+            if base is None and delta < 0:
+                return None
+            # Пока ждали БД, ключ мог добавить другой обработчик
+            self._entries.setdefault(key, [base or 0, 0])
+
+        entry = self._entries[key]
+        quantity = entry[0] + entry[1] + delta
+        if quantity < 0:
+            return None
+        if not self._events:
+            self._window_started = time.monotonic()
+        entry[1] += delta
+        event["quantity_after"] = quantity
+        self._events.append(event)
+        self._pending_ids.add(event["event_id"])
+        self._unconfirmed.add(event["event_id"])
+        self._sources[event["event_id"]] = source
+        return quantity
+
+    def confirm(self, event: dict):
+        """Обработка события завершена: его дельта войдет в ближайший flush()"""
+        self._unconfirmed.discard(event["event_id"])
+
+    def revert(self, event: dict):
+        """Отменяет apply(), если остальная часть обработки события не удалась"""
+        self._entries[(event["warehouse_id"], event["product_id"])][1] -= event["delta"]
+        self._events.remove(event)
+        self._pending_ids.discard(event["event_id"])
+        self._unconfirmed.discard(event["event_id"])
+        self._sources.pop(event["event_id"], None)
+
+    @timed("flush_stock_buffer")
+    async def flush(self) -> List[Tuple[dict, Any]]:
+        """
+        Записывает подтвержденные события одной транзакцией. Неподтвержденные и пришедшие
+        во время записи остаются в буфере.
+
+        Если транзакция окна не прошла, события записываются по одному: расход, который
+        БД отклоняет (остаток изменился мимо буфера, и окно нарушило бы CHECK), убирается
+        из буфера, остальные записываются. Возвращает отклоненные события парами
+        (строка журнала, source из apply) для dead letter. Ошибка БД пробрасывается:
+        записанные к этому моменту события из буфера убраны, остальные ждут следующей попытки.
+        """
+        # Параллельный flush (остановка API и поток потребителя) записал бы те же дельты дважды
+        while self._flushing:
+            await asyncio.sleep(0.005)
+        events = [event for event in self._events if event["event_id"] not in self._unconfirmed]
+        if not events:
+            return []
+        self._flushing = True
+        try:
+            # В журнале время записи — момент, когда изменения окна попали в БД
+            recorded_at = datetime.utcnow()
+            for event in events:
+                event["recorded_at"] = recorded_at
+            try:
+                await self._write(events)
+                return []
+            except Exception as e:
+                logger.warning("Окно буфера остатков не записано (%s), запись по одному событию", e)
+                return await self._write_each(events)
+        finally:
+            self._flushing = False
+
+    async def _write(self, events: List[dict]):
+        totals: Dict[StockKey, int] = {}
+        for event in events:
+            key = (event["warehouse_id"], event["product_id"])
+            totals[key] = totals.get(key, 0) + event["delta"]
+        rows = [(warehouse_id, product_id, delta) for (warehouse_id, product_id), delta in totals.items() if delta]
+        increments = [row for row in rows if row[2] > 0]
+        decrements = [row for row in rows if row[2] < 0]
+        event_ids = [event["event_id"] for event in events]
+        dialect = database.url.dialect
+
+        async with database.transaction():
+            if increments:
+                await database.execute(upsert.stock_deltas_upsert(dialect, increments))
+            if decrements:
+                await database.execute(upsert.stock_deltas_update(decrements))
+            await ledger.append(events)
+            await database.execute(upsert.processed_events_insert(dialect, event_ids, events[0]["recorded_at"]))
+            # По ключу — остаток после последнего события окна
+            latest = {(event["warehouse_id"], event["product_id"]): event for event in events}
+            await change_notifier.stock_changed(
+                (*key, event["quantity_after"], event["occurred_at"]) for key, event in latest.items()
+            )
+
+        self._forget(events, written=True)
+        logger.debug("Записан буфер остатков: %s ключей, %s событий", len(rows), len(event_ids))
+
+    async def _write_each(self, events: List[dict]) -> List[Tuple[dict, Any]]:
+        """Запись по одному событию тем же условным оператором, что и без буфера"""
+        dialect = database.url.dialect
+        rejected = []
+        for event in events:
+            key = (event["warehouse_id"], event["product_id"])
+            async with database.transaction():
+                quantity = await database.fetch_val(upsert.stock_delta_statement(dialect, *key, event["delta"]))
+                if quantity is not None:
+                    event["quantity_after"] = quantity
+                    await ledger.append([event])
+                    await database.execute(
+                        upsert.processed_events_insert(dialect, [event["event_id"]], event["recorded_at"])
+                    )
+                    await change_notifier.stock_changed([(*key, quantity, event["occurred_at"])])
+            if quantity is None:
+                logger.warning(
+                    "Расход отклонен при записи буфера: warehouse_id=%s, product_id=%s, списание=%s",
+                    key[0], key[1], -event["delta"]
+                )
+                rejected.append((event, self._sources.get(event["event_id"])))
+                self._forget([event], written=False)
+                continue
+            self._forget([event], written=True)
+            if key in self._entries:
+                self._entries[key][0] = quantity
+        return rejected
+
+    def _forget(self, events: List[dict], written: bool):
+        """
+        Убирает события из буфера. Записанная дельта переходит в базовый остаток;
+        ключи без остатка дельты и без ожидающих событий удаляются, чтобы в следующем
+        окне базовый остаток перечитывался из БД.
+        """
+        for event in events:
+            key = (event["warehouse_id"], event["product_id"])
+            entry = self._entries[key]
+            if written:
+                entry[0] += event["delta"]
+            entry[1] -= event["delta"]
+            warehouse_state_cache.invalidate(key)
+        event_ids = {event["event_id"] for event in events}
+        self._events = [event for event in self._events if event["event_id"] not in event_ids]
+        waiting = {(event["warehouse_id"], event["product_id"]) for event in self._events}
+        self._entries = {key: entry for key, entry in self._entries.items() if entry[1] or key in waiting}
+        self._pending_ids.difference_update(event_ids)
+        for event_id in event_ids:
+            self._sources.pop(event_id, None)
+        self._window_started = time.monotonic()
+
+stock_buffer = StockWriteBuffer(
+    settings.STOCK_WRITE_BEHIND, settings.STOCK_FLUSH_INTERVAL_MS / 1000, settings.STOCK_FLUSH_MAX_EVENTS
+)
+
+CallbackMetric(
+    "stock_buffer_pending_events", "События в буфере отложенной записи остатков", "gauge", (),
+    lambda: {(): len(stock_buffer)}
+)
@@ -0,0 +1,188 @@
+"""
+Поток изменений остатков для подписчиков (Server-Sent Events).
+
+Путь применения событий Kafka публикует новый остаток в stock_hub, а тот
+раздает изменение подписчикам склада или товара в памяти процесса, без
+обращений к БД. Изменения отдельного процесса python -m app.consumer
+приходят в API через PostgreSQL LISTEN/NOTIFY (change_notifications); в SQLite
+поток работает только со встроенным потребителем (KAFKA_EMBEDDED_CONSUMER).
+
+Очередь подписчика — словарь последних значений по паре (склад, товар):
+частые изменения одной позиции склеиваются в одно, и очередь не растет
+от их числа. Если клиент не успевает забирать изменения и различных позиций
+накопилось больше STOCK_STREAM_MAX_PENDING, он отключается (событие dropped)
+и должен переподключиться, перечитав текущие остатки. Неактивный подписчик
+держит только объект со слотами и asyncio.Event; словарь создается при
+первом изменении.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.core.metrics import CallbackMetric, Counter
+
+logger = logging.getLogger(__name__)
+
+stock_stream_dropped = Counter(
+    "stock_stream_dropped_subscribers", "Подписчики потока остатков, отключенные из-за переполнения очереди"
+)
+
+
+class StockSubscription:
+    __slots__ = ("warehouse_ids", "product_ids", "max_pending", "active", "closed", "dropped", "_pending", "_wakeup")
+
+    def __init__(self, warehouse_ids: Iterable[str], product_ids: Iterable[str], max_pending: int):
+        self.warehouse_ids = frozenset(warehouse_ids)
+        self.product_ids = frozenset(product_ids)
+        self.max_pending = max_pending
+        self.active = True
+        self.closed = False
+        self.dropped = False
+        self._pending: Optional[Dict[Tuple[str, str], dict]] = None
+        self._wakeup = asyncio.Event()
+
+    def offer(self, key: Tuple[str, str], change: dict) -> bool:
+        """Кладет изменение, заменяя еще не отданное по той же позиции; False — очередь переполнена"""
+        if self._pending is None:
+            self._pending = {}
+        elif key not in self._pending and len(self._pending) >= self.max_pending:
+            return False
+        self._pending[key] = change
+        self._wakeup.set()
+        return True
+
+    def close(self, dropped: bool = False):
+        self.closed = True
+        self.dropped = dropped
+        self._pending = None
+        self._wakeup.set()
+
+    async def next_changes(self, timeout: float) -> List[dict]:
+        """Накопленные изменения; пустой список — за timeout секунд изменений не было"""
+        if not self._pending and not self.closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self._wakeup.clear()
+        changes = list(self._pending.values()) if self._pending else []
+        self._pending = None
+        return changes
+
+
+class StockHub:
+    """
+    Раздача изменений остатков подписчикам. Все методы вызываются из цикла
+    событий приложения, поэтому блокировки не нужны.
+    """
+
+    def __init__(self, max_subscribers: int, max_pending: int):
+        self.max_subscribers = max_subscribers
+        self.max_pending = max_pending
+        self._by_warehouse: Dict[str, Set[StockSubscription]] = {}
+        self._by_product: Dict[str, Set[StockSubscription]] = {}
+        self._subscribers = 0
+
+    def __len__(self) -> int:
+        return self._subscribers
+
+    def subscribe(self, warehouse_ids: Iterable[str] = (), product_ids: Iterable[str] = ()) -> StockSubscription:
+        if self._subscribers >= self.max_subscribers:
+            raise HTTPException(status_code=503, detail="Превышено число подписчиков потока остатков")
+        subscription = StockSubscription(warehouse_ids, product_ids, self.max_pending)
+        for warehouse_id in subscription.warehouse_ids:
+            self._by_warehouse.setdefault(warehouse_id, set()).add(subscription)
+        for product_id in subscription.product_ids:
+            self._by_product.setdefault(product_id, set()).add(subscription)
+        self._subscribers += 1
+        return subscription
+
+    def unsubscribe(self, subscription: StockSubscription):
+        """Снимает подписку; повторный вызов ничего не делает"""
+        if not subscription.active:
+            return
+        subscription.active = False
+        for index, keys in ((self._by_warehouse, subscription.warehouse_ids),
+                            (self._by_product, subscription.product_ids)):
+            for key in keys:
+                subscribers = index.get(key)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del index[key]
+        self._subscribers -= 1
+        if not subscription.closed:
+            subscription.close()
+
+    def publish(self, warehouse_id: str, product_id: str, quantity: int, updated_at: Optional[datetime] = None):
+        """Отдает новый остаток подписчикам склада и товара; без подписчиков — два поиска в словаре"""
+        by_warehouse = self._by_warehouse.get(warehouse_id)
+        by_product = self._by_product.get(product_id)
+        if not by_warehouse and not by_product:
+            return
+        key = (warehouse_id, product_id)
+        change = {
+            "warehouse_id": warehouse_id,
+            "product_id": product_id,
+            "quantity": quantity,
+            "updated_at": (updated_at or datetime.utcnow()).isoformat(),
+        }
+        # Подписчик и склада, и товара получает изменение дважды, второе просто заменяет первое
+        overflowed = {
+            subscription
+            for subscribers in (by_warehouse, by_product) if subscribers
+            for subscription in subscribers if not subscription.offer(key, change)
+        }
+        for subscription in overflowed:
+            subscription.close(dropped=True)
+            self.unsubscribe(subscription)
+            stock_stream_dropped.inc()
+        if overflowed:
+            logger.warning("Отключено медленных подписчиков потока остатков: %s", len(overflowed))
+
+    def close_all(self):
+        """Завершает все подписки (остановка сервиса)"""
+        subscriptions = {
+            subscription
+            for index in (self._by_warehouse, self._by_product)
+            for subscribers in index.values()
+            for subscription in subscribers
+        }
+        for subscription in subscriptions:
+            self.unsubscribe(subscription)
+
+
+stock_hub = StockHub(settings.STOCK_STREAM_MAX_SUBSCRIBERS, settings.STOCK_STREAM_MAX_PENDING)
+
+CallbackMetric(
+    "stock_stream_subscribers", "Подписчики потока остатков", "gauge", (),
+    lambda: {(): len(stock_hub)}
+)
+
+
+async def sse_events(subscription: StockSubscription, heartbeat: float = None):
+    """
+    Кадры text/event-stream для подписки: event: stock с изменением остатка,
+    комментарий-пульс раз в heartbeat секунд без изменений и event: dropped
+    перед отключением медленного клиента. Подписка снимается при любом завершении.
+    """
+    heartbeat = heartbeat or settings.STOCK_STREAM_HEARTBEAT_SECONDS
+    try:
+        yield ": subscribed\n\n"
+        while True:
+            changes = await subscription.next_changes(heartbeat)
+            if changes:
+                yield "".join(f"event: stock\ndata: {json.dumps(change)}\n\n" for change in changes)
+            if subscription.closed:
+                if subscription.dropped:
+                    yield "event: dropped\ndata: {}\n\n"
+                return
+            if not changes:
+                yield ": keepalive\n\n"
+    finally:
+        stock_hub.unsubscribe(subscription)
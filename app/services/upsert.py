@@ -0,0 +1,248 @@
+from datetime import datetime
+
+from sqlalchemy import and_, case, extract, func, literal, null
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.models.database import warehouse_states, movements, movement_keys, processed_events
+
+# INSERT ... ON CONFLICT DO UPDATE поддерживают оба диалекта, но строятся разными конструкторами
+_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def dialect_insert(dialect: str, table):
+    """Возвращает INSERT с поддержкой on_conflict_do_update для указанного диалекта"""
+    try:
+        return _INSERTS[dialect](table)
+    except KeyError:
+        raise ValueError(f"UPSERT не поддерживается для диалекта {dialect}")
+
+
+def seconds_between(dialect: str, later, earlier):
+    """SQL-выражение разницы между двумя временными метками в секундах"""
+    if dialect == "postgresql":
+        return extract("epoch", later - earlier)
+    # julianday дает дробные сутки; округляем до миллисекунд, чтобы убрать погрешность double
+    return func.round((func.julianday(later) - func.julianday(earlier)) * 86400.0, 3)
+
+
+def warehouse_state_upsert(dialect: str, warehouse_id: str, product_id: str, quantity: int):
+    """Один оператор, записывающий абсолютный остаток товара на складе"""
+    stmt = dialect_insert(dialect, warehouse_states).values(
+        id=f"{warehouse_id}:{product_id}",
+        warehouse_id=warehouse_id,
+        product_id=product_id,
+        quantity=quantity
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[warehouse_states.c.id],
+        set_={"quantity": stmt.excluded.quantity}
+    )
+
+
+def stock_quantities_upsert(dialect: str, rows):
+    """
+    Многострочная запись абсолютных остатков (восстановление из журнала).
+    rows — последовательность (warehouse_id, product_id, quantity).
+    """
+    stmt = dialect_insert(dialect, warehouse_states).values([
+        {"id": f"{warehouse_id}:{product_id}", "warehouse_id": warehouse_id, "product_id": product_id,
+         "quantity": quantity}
+        for warehouse_id, product_id, quantity in rows
+    ])
+    return stmt.on_conflict_do_update(
+        index_elements=[warehouse_states.c.id],
+        set_={"quantity": stmt.excluded.quantity}
+    )
+
+
+def stock_delta_statement(dialect: str, warehouse_id: str, product_id: str, delta: int):
+    """
+    Атомарно изменяет остаток на delta и возвращает новое количество (RETURNING quantity).
+
+    Приход создает строку или прибавляет к ней. Расход — условный UPDATE, который
+    не затрагивает строку, если остатка не хватает: пустой результат означает, что
+    событие отклонено. CHECK-ограничение в БД страхует от отрицательного остатка.
+    """
+    record_id = f"{warehouse_id}:{product_id}"
+    if delta < 0:
+        new_quantity = warehouse_states.c.quantity + delta
+        return (
+            warehouse_states.update()
+            .where(warehouse_states.c.id == record_id, new_quantity >= 0)
+            .values(quantity=new_quantity)
+            .returning(warehouse_states.c.quantity)
+        )
+
+    stmt = dialect_insert(dialect, warehouse_states).values(
+        id=record_id,
+        warehouse_id=warehouse_id,
+        product_id=product_id,
+        quantity=delta
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[warehouse_states.c.id],
+        set_={"quantity": func.coalesce(warehouse_states.c.quantity, 0) + stmt.excluded.quantity}
+    ).returning(warehouse_states.c.quantity)
+
+
+_COMPLETION_COLUMNS = (
+    movements.c.source_warehouse, movements.c.destination_warehouse, movements.c.product_id,
+    movements.c.time_difference_seconds, movements.c.quantity_difference,
+)
+
+
+def _movement_differences(dialect: str, departure_time, departure_quantity, arrival_time, arrival_quantity):
+    """
+    Разница времени и количества по двум половинам перемещения. Каждая половина
+    передает свои новые значения (excluded) и текущие значения другой половины из
+    строки, поэтому результат одинаков при любом порядке прихода событий: кто бы
+    ни пришел вторым, он видит под блокировкой строки обе половины.
+    """
+    complete = and_(departure_time.isnot(None), arrival_time.isnot(None))
+    return {
+        "time_difference_seconds": case(
+            (complete, seconds_between(dialect, arrival_time, departure_time)), else_=null()
+        ),
+        "quantity_difference": case(
+            (complete, func.coalesce(arrival_quantity, literal(0)) - func.coalesce(departure_quantity, literal(0))),
+            else_=null()
+        ),
+    }
+
+
+def movement_key_upsert(dialect: str, movement_id: str, timestamp: datetime):
+    """
+    Закрепляет перемещение за секцией movements и возвращает ее partition_time
+    (RETURNING): время первой половины или уже сохраненное. UPDATE на месте при
+    конфликте нужен ради RETURNING и блокировки строки ключа — половины одного
+    перемещения записываются по очереди, как раньше под блокировкой строки movements.
+    """
+    stmt = dialect_insert(dialect, movement_keys).values(movement_id=movement_id, partition_time=timestamp)
+    return stmt.on_conflict_do_update(
+        index_elements=[movement_keys.c.movement_id],
+        set_={"partition_time": movement_keys.c.partition_time}
+    ).returning(movement_keys.c.partition_time)
+
+
+def movement_departure_upsert(dialect: str, movement_id: str, warehouse_id: str, product_id: str,
+                              timestamp: datetime, quantity: int, partition_time: datetime):
+    """
+    Записывает отправку одним оператором без предварительного чтения. Если приемка
+    уже сохранена, разница времени и количества считается в самом UPDATE по текущей строке.
+    RETURNING отдает маршрут и разницы: по ним видно, что перемещение завершено.
+    partition_time — результат movement_key_upsert.
+    """
+    stmt = dialect_insert(dialect, movements).values(
+        movement_id=movement_id,
+        partition_time=partition_time,
+        source_warehouse=warehouse_id,
+        product_id=product_id,
+        departure_time=timestamp,
+        departure_quantity=quantity
+    )
+    excluded = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=[movements.c.movement_id, movements.c.partition_time],
+        set_={
+            "source_warehouse": excluded.source_warehouse,
+            "departure_time": excluded.departure_time,
+            "departure_quantity": excluded.departure_quantity,
+            **_movement_differences(
+                dialect, excluded.departure_time, excluded.departure_quantity,
+                movements.c.arrival_time, movements.c.arrival_quantity
+            ),
+        }
+    ).returning(*_COMPLETION_COLUMNS)
+
+
+def movement_arrival_upsert(dialect: str, movement_id: str, warehouse_id: str, product_id: str,
+                            timestamp: datetime, quantity: int, partition_time: datetime):
+    """Зеркальная к movement_departure_upsert запись приемки"""
+    stmt = dialect_insert(dialect, movements).values(
+        movement_id=movement_id,
+        partition_time=partition_time,
+        destination_warehouse=warehouse_id,
+        product_id=product_id,
+        arrival_time=timestamp,
+        arrival_quantity=quantity
+    )
+    excluded = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=[movements.c.movement_id, movements.c.partition_time],
+        set_={
+            "destination_warehouse": excluded.destination_warehouse,
+            "arrival_time": excluded.arrival_time,
+            "arrival_quantity": excluded.arrival_quantity,
+            **_movement_differences(
+                dialect, movements.c.departure_time, movements.c.departure_quantity,
+                excluded.arrival_time, excluded.arrival_quantity
+            ),
+        }
+    ).returning(*_COMPLETION_COLUMNS)
+
+
+def processed_event_insert(dialect: str, event_id: str, processed_at: datetime):
+    """
+    Отмечает событие примененным. RETURNING event_id пуст, если событие уже было
+    отмечено: так проверка дубля и запись отметки — один оператор.
+    """
+    stmt = dialect_insert(dialect, processed_events).values(event_id=event_id, processed_at=processed_at)
+    return stmt.on_conflict_do_nothing(index_elements=[processed_events.c.event_id]).returning(
+        processed_events.c.event_id
+    )
+
+
+def stock_deltas_upsert(dialect: str, deltas):
+    """
+    Многострочный UPSERT, прибавляющий накопленные положительные дельты к остаткам.
+    deltas — последовательность (warehouse_id, product_id, delta), delta > 0.
+    """
+    stmt = dialect_insert(dialect, warehouse_states).values([
+        {"id": f"{warehouse_id}:{product_id}", "warehouse_id": warehouse_id, "product_id": product_id, "quantity": delta}
+        for warehouse_id, product_id, delta in deltas
+    ])
+    return stmt.on_conflict_do_update(
+        index_elements=[warehouse_states.c.id],
+        set_={"quantity": func.coalesce(warehouse_states.c.quantity, 0) + stmt.excluded.quantity}
+    )
+
+
+def stock_deltas_update(deltas):
+    """
+    Один UPDATE с CASE по id для отрицательных дельт. Не через UPSERT: CHECK
+    проверяется и на предлагаемой к вставке строке, а отрицательная вставка его нарушает.
+    """
+    amounts = {f"{warehouse_id}:{product_id}": delta for warehouse_id, product_id, delta in deltas}
+    return (
+        warehouse_states.update()
+        .where(warehouse_states.c.id.in_(list(amounts)))
+        .values(quantity=warehouse_states.c.quantity + case(amounts, value=warehouse_states.c.id))
+    )
+
+
+def processed_events_insert(dialect: str, event_ids, processed_at: datetime):
+    """Многострочная отметка событий примененными; уже отмеченные пропускаются"""
+    stmt = dialect_insert(dialect, processed_events).values([
+        {"event_id": event_id, "processed_at": processed_at} for event_id in event_ids
+    ])
+    return stmt.on_conflict_do_nothing(index_elements=[processed_events.c.event_id])
+
+
+def transit_buckets_upsert(dialect: str, table, rows):
+    """
+    Прибавляет строки к корзинам скетча времени в пути (route_transit_buckets или
+    product_transit_buckets). rows — словари с ключом таблицы, bucket, movements и суммами.
+    """
+    stmt = dialect_insert(dialect, table).values(rows)
+    excluded = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=list(table.primary_key.columns),
+        set_={
+            "movements": table.c.movements + excluded.movements,
+            "transit_seconds_sum": table.c.transit_seconds_sum + excluded.transit_seconds_sum,
+            "quantity_difference_sum": table.c.quantity_difference_sum + excluded.quantity_difference_sum,
+        }
+    )
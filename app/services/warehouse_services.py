@@ -1,19 +1,76 @@
-from sqlalchemy import and_, select
+from sqlalchemy import and_, select, tuple_
+import asyncio
+import base64
+import json
 import logging
 import sqlite3
+from collections import defaultdict
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
-from app.models.database import WarehouseState, Movement, database, warehouse_states, movements
+from app.models.database import WarehouseState, Movement, database, warehouse_states, movements, movement_keys
 from app.models.schemas import WarehouseState as WarehouseStateSchema
-from app.models.schemas import MovementInfo
-from datetime import datetime
+from app.models.schemas import MovementInfo, MovementEvent, WarehouseStockPage, MovementPage
+from app.core.metrics import timed
+from app.services import analytics, idempotency, ledger, upsert
+from app.services.cache import warehouse_state_cache, movement_cache
+from app.services.change_notifications import change_notifier
+from app.services.stock_buffer import stock_buffer
+from app.services.stock_stream import stock_hub
+from app.services.replicas import replicas
+from datetime import datetime, timezone
 
 logger = logging.getLogger(__name__)
 
+# Ограничение числа параметров в одном IN (SQLite старых версий допускает не более 999)
+_IN_CHUNK_SIZE = 500
+
+
+def _stock_key(warehouse_id: str, product_id: str) -> tuple:
+    """Ключ остатка для read-your-writes в replicas"""
+    return ("stock", warehouse_id, product_id)
+
+
+def _movement_key(movement_id: str) -> tuple:
+    return ("movement", movement_id)
+
+
+def _movement_lookup(movement_id: str, table=movements):
+    """
+    Условие поиска перемещения по ID: partition_time берется из movement_keys, поэтому
+    в секционированной таблице читается одна секция, а не индекс каждой.
+    Синхронные запросы передают таблицу ORM-модели (Movement.__table__)
+    """
+    partition_time = select(movement_keys.c.partition_time).where(
+        movement_keys.c.movement_id == movement_id
+    ).scalar_subquery()
+    return and_(table.c.movement_id == movement_id, table.c.partition_time == partition_time)
+
 
 async def get_warehouse_state(warehouse_id: str, product_id: str) -> WarehouseStateSchema:
-    """Получает текущее состояние склада для указанного товара"""
-    logger.info(f"Запрос состояния склада: warehouse_id={warehouse_id}, product_id={product_id}")
+    """Получает текущее состояние склада для указанного товара (через кэш чтения)"""
+    key = (warehouse_id, product_id)
+    found, state = warehouse_state_cache.get(key)
+    if found:
+        return _with_pending_delta(state)
+
+    generation = warehouse_state_cache.generation(key)
+    state = await _load_warehouse_state(warehouse_id, product_id)
+    warehouse_state_cache.set(key, state, generation)
+    return _with_pending_delta(state)
+
+
+def _with_pending_delta(state: WarehouseStateSchema) -> WarehouseStateSchema:
+    """Добавляет к остатку из БД (или кэша) дельту, еще не записанную буфером stock_buffer"""
+    delta = stock_buffer.pending_delta(state.warehouse_id, state.product_id)
+    if not delta:
+        return state
+    return state.model_copy(update={"quantity": state.quantity + delta})
+
+
+@timed("get_warehouse_state")
+async def _load_warehouse_state(warehouse_id: str, product_id: str) -> WarehouseStateSchema:
+    logger.debug("Запрос состояния склада: warehouse_id=%s, product_id=%s", warehouse_id, product_id)
     
     query = select(warehouse_states).where(
         and_(
@@ -22,17 +79,21 @@ async def get_warehouse_state(warehouse_id: str, product_id: str) -> WarehouseSt
         )
     )
     
-    result = await database.fetch_one(query)
+    try:
+        result = await replicas.fetch_one(query, _stock_key(warehouse_id, product_id))
+    except Exception as e:
+        logger.error("Ошибка при получении состояния склада: %s", e)
+        raise HTTPException(status_code=500, detail="Ошибка при получении данных")
     
     if result:
-        logger.info(f"Найдено состояние склада: {result}")
+        logger.debug("Найдено состояние склада: %s", result)
         return WarehouseStateSchema(
             warehouse_id=result["warehouse_id"],
             product_id=result["product_id"],
             quantity=result["quantity"]
         )
     
-    logger.warning(f"Склад не найден: warehouse_id={warehouse_id}, product_id={product_id}")
+    logger.warning("Склад не найден: warehouse_id=%s, product_id=%s", warehouse_id, product_id)
     if warehouse_id is None:
         raise HTTPException(status_code=404, detail="Склад не найден")
         
@@ -44,8 +105,24 @@ async def get_warehouse_state(warehouse_id: str, product_id: str) -> WarehouseSt
 
 
 def get_warehouse_state_sync(db: Session, warehouse_id: str, product_id: str) -> WarehouseStateSchema:
-    """Синхронная версия получения состояния склада для указанного товара"""
-    logger.info(f"Запрос состояния склада (sync): warehouse_id={warehouse_id}, product_id={product_id}")
+    """Синхронная версия получения состояния склада для указанного товара (через кэш чтения)"""
+    key = (warehouse_id, product_id)
+    found, state = warehouse_state_cache.get(key)
+    if found:
+        return _with_pending_delta(state)
+
+    generation = warehouse_state_cache.generation(key)
+    state = replicas.read_sync(
+        db, lambda session: _load_warehouse_state_sync(session, warehouse_id, product_id),
+        _stock_key(warehouse_id, product_id)
+    )
+    warehouse_state_cache.set(key, state, generation)
+    return _with_pending_delta(state)
+
+
+@timed("get_warehouse_state_sync")
+def _load_warehouse_state_sync(db: Session, warehouse_id: str, product_id: str) -> WarehouseStateSchema:
+    logger.debug("Запрос состояния склада (sync): warehouse_id=%s, product_id=%s", warehouse_id, product_id)
     
     try:
         state = db.query(WarehouseState).filter(
@@ -54,14 +131,14 @@ def get_warehouse_state_sync(db: Session, warehouse_id: str, product_id: str) ->
         ).first()
         
         if state:
-            logger.info(f"Найдено состояние склада: {state}")
+            logger.debug("Найдено состояние склада: %s", state)
             return WarehouseStateSchema(
                 warehouse_id=state.warehouse_id,
                 product_id=state.product_id,
                 quantity=state.quantity
             )
         
-        logger.warning(f"Склад не найден: warehouse_id={warehouse_id}, product_id={product_id}")
+        logger.warning("Склад не найден: warehouse_id=%s, product_id=%s", warehouse_id, product_id)
         
         return WarehouseStateSchema(
             warehouse_id=warehouse_id,
@@ -69,179 +146,369 @@ def get_warehouse_state_sync(db: Session, warehouse_id: str, product_id: str) ->
             quantity=0
         )
     except Exception as e:
-        logger.error(f"Ошибка при получении состояния склада: {e}")
+        logger.error("Ошибка при получении состояния склада: %s", e)
         raise HTTPException(status_code=500, detail="Ошибка при получении данных")
 
 
-async def update_warehouse_state(warehouse_id: str, product_id: str, quantity: int):
-    """Обновляет состояние склада для указанного товара"""
-    record_id = f"{warehouse_id}:{product_id}"
-    
-    # Проверяем наличие записи
-    query = select(warehouse_states).where(
-        and_(
-            warehouse_states.c.warehouse_id == warehouse_id,
-            warehouse_states.c.product_id == product_id
+@timed()
+async def get_warehouse_state_as_of(warehouse_id: str, product_id: str, as_of: datetime) -> WarehouseStateSchema:
+    """
+    Остаток товара на складе на момент as_of по журналу stock_events: остаток после
+    последнего изменения, записанного в журнал не позже as_of. as_of — время обработки
+    (recorded_at), а не время события: события приходят не по порядку, и остаток после
+    изменения определен только в порядке записи. Если до as_of изменений нет — остаток перед
+    первым изменением после него; если изменений нет вовсе, остаток не менялся и берется текущий.
+    """
+    before, after = ledger.stock_as_of_queries(warehouse_id, product_id, _to_naive_utc(as_of))
+    key = _stock_key(warehouse_id, product_id)
+    quantity = await replicas.fetch_val(before, key)
+    if quantity is None:
+        quantity = await replicas.fetch_val(after, key)
+    if quantity is None:
+        return await _load_warehouse_state(warehouse_id, product_id)
+    return WarehouseStateSchema(warehouse_id=warehouse_id, product_id=product_id, quantity=quantity)
+
+
+@timed()
+def get_warehouse_state_as_of_sync(db: Session, warehouse_id: str, product_id: str,
+                                   as_of: datetime) -> WarehouseStateSchema:
+    """Синхронная версия получения остатка на момент as_of"""
+    before, after = ledger.stock_as_of_queries(warehouse_id, product_id, _to_naive_utc(as_of))
+
+    def load(session: Session) -> WarehouseStateSchema:
+        quantity = session.execute(before).scalar()
+        if quantity is None:
+            quantity = session.execute(after).scalar()
+        if quantity is None:
+            return _load_warehouse_state_sync(session, warehouse_id, product_id)
+        return WarehouseStateSchema(warehouse_id=warehouse_id, product_id=product_id, quantity=quantity)
+
+    return replicas.read_sync(db, load, _stock_key(warehouse_id, product_id))
+
+
+async def iter_warehouse_states(keys: List[Tuple[str, str]]) -> AsyncIterator[WarehouseStateSchema]:
+    """
+    Потоково отдает остатки для набора пар (warehouse_id, product_id) запросом
+    по первичному ключу с IN (по _IN_CHUNK_SIZE ключей за запрос). Сначала идут
+    найденные строки в порядке БД, затем пары без записи с quantity=0.
+    """
+    requested = {f"{warehouse_id}:{product_id}": (warehouse_id, product_id) for warehouse_id, product_id in keys}
+    record_ids = list(requested)
+    found = set()
+
+    for start in range(0, len(record_ids), _IN_CHUNK_SIZE):
+        query = select(warehouse_states).where(
+            warehouse_states.c.id.in_(record_ids[start:start + _IN_CHUNK_SIZE])
         )
-    )
-    
-    result = await database.fetch_one(query)
-    
-    if result:
-        query = warehouse_states.update().where(
-            warehouse_states.c.id == record_id
-        ).values(quantity=quantity)
-        await database.execute(query)
-    else:
-        query = warehouse_states.insert().values(
-            id=record_id,
-            warehouse_id=warehouse_id,
-            product_id=product_id,
-            quantity=quantity
+        async for row in replicas.iterate(query):
+            found.add(row["id"])
+            yield _with_pending_delta(WarehouseStateSchema(
+                warehouse_id=row["warehouse_id"],
+                product_id=row["product_id"],
+                quantity=row["quantity"]
+            ))
+
+    for record_id, (warehouse_id, product_id) in requested.items():
+        if record_id not in found:
+            yield _with_pending_delta(
+                WarehouseStateSchema(warehouse_id=warehouse_id, product_id=product_id, quantity=0)
+            )
+
+
+async def iter_movements(movement_ids: List[str]) -> AsyncIterator[MovementInfo]:
+    """Потоково отдает найденные перемещения из набора ID; отсутствующие пропускаются"""
+    movement_ids = list(dict.fromkeys(movement_ids))
+
+    # Через movement_keys: каждый ID ищется в одной секции movements
+    found = movement_keys.join(movements, and_(
+        movements.c.movement_id == movement_keys.c.movement_id,
+        movements.c.partition_time == movement_keys.c.partition_time,
+    ))
+    for start in range(0, len(movement_ids), _IN_CHUNK_SIZE):
+        query = select(movements).select_from(found).where(
+            movement_keys.c.movement_id.in_(movement_ids[start:start + _IN_CHUNK_SIZE])
         )
-        await database.execute(query)
+        async for row in replicas.iterate(query):
+            yield _movement_info_from_row(row)
+
+
+async def iter_movement_rows(product_id: Optional[str] = None, since: Optional[datetime] = None,
+                             until: Optional[datetime] = None) -> AsyncIterator:
+    """
+    Потоково отдает строки movements для выгрузки, не загружая их в память.
+    Период [since, until) задается по времени отправки и использует индекс
+    (product_id, departure_time, movement_id) или, без товара, индекс по departure_time.
+    """
+    query = select(movements)
+    if product_id is not None:
+        query = query.where(movements.c.product_id == product_id)
+    if since is not None:
+        query = query.where(movements.c.departure_time >= _to_naive_utc(since))
+    if until is not None:
+        query = query.where(movements.c.departure_time < _to_naive_utc(until))
+    async for row in replicas.iterate(query):
+        yield row
+
+
+async def iter_stock_rows(warehouse_id: str, product_id: Optional[str] = None) -> AsyncIterator[dict]:
+    """Потоково отдает остатки склада для выгрузки (с учетом буфера отложенной записи)"""
+    query = select(warehouse_states).where(warehouse_states.c.warehouse_id == warehouse_id)
+    if product_id is not None:
+        query = query.where(warehouse_states.c.product_id == product_id)
+    async for row in replicas.iterate(query):
+        yield {
+            "warehouse_id": row["warehouse_id"],
+            "product_id": row["product_id"],
+            "quantity": row["quantity"] + stock_buffer.pending_delta(row["warehouse_id"], row["product_id"]),
+        }
+
+
+def _encode_cursor(*values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _cursor_str(value) -> str:
+    if not isinstance(value, str):
+        raise ValueError(f"ожидалась строка: {value!r}")
+    return value
 
 
+def _cursor_time(value) -> Optional[datetime]:
+    return None if value is None else datetime.fromisoformat(_cursor_str(value))
+
+
+def _decode_cursor(cursor: str, *parsers) -> list:
+    """Разбирает курсор: по одной функции разбора на элемент; любая ошибка — 400, а не 500"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(parsers):
+            raise ValueError("неверная длина курсора")
+        return [parse(value) for parse, value in zip(parsers, values)]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+
+@timed()
+async def list_warehouse_stock(warehouse_id: str, limit: int, cursor: Optional[str] = None) -> WarehouseStockPage:
+    """Страница остатков склада, упорядоченная по product_id (keyset-пагинация)"""
+    query = select(warehouse_states).where(warehouse_states.c.warehouse_id == warehouse_id)
+    if cursor:
+        (after_product_id,) = _decode_cursor(cursor, _cursor_str)
+        query = query.where(warehouse_states.c.product_id > after_product_id)
+    query = query.order_by(warehouse_states.c.product_id).limit(limit + 1)
+
+    rows = await replicas.fetch_all(query)
+    items = [
+        _with_pending_delta(WarehouseStateSchema(
+            warehouse_id=row["warehouse_id"], product_id=row["product_id"], quantity=row["quantity"]
+        ))
+        for row in rows[:limit]
+    ]
+    next_cursor = _encode_cursor(items[-1].product_id) if len(rows) > limit else None
+    return WarehouseStockPage(items=items, next_cursor=next_cursor)
+
+
+@timed()
+async def list_product_movements(product_id: str, limit: int, cursor: Optional[str] = None) -> MovementPage:
+    """
+    Страница перемещений товара, упорядоченная по (departure_time, movement_id).
+
+    Перемещения без отправки (пришла только приемка) идут в конце по movement_id.
+    Обе части читаются отдельными диапазонными запросами по индексу
+    (product_id, departure_time, movement_id), без OR и OFFSET.
+    """
+    after_time, after_id = _decode_cursor(cursor, _cursor_time, _cursor_str) if cursor else (None, None)
+    rows = []
+
+    if after_id is None or after_time is not None:
+        query = select(movements).where(
+            movements.c.product_id == product_id,
+            movements.c.departure_time.isnot(None)
+        )
+        if after_id is not None:
+            query = query.where(
+                tuple_(movements.c.departure_time, movements.c.movement_id)
+                > tuple_(after_time, after_id)
+            )
+        query = query.order_by(movements.c.departure_time, movements.c.movement_id).limit(limit + 1)
+        rows = list(await replicas.fetch_all(query))
+        after_id = None
+
+    if len(rows) <= limit:
+        query = select(movements).where(
+            movements.c.product_id == product_id,
+            movements.c.departure_time.is_(None)
+        )
+        if after_id is not None:
+            query = query.where(movements.c.movement_id > after_id)
+        query = query.order_by(movements.c.movement_id).limit(limit + 1 - len(rows))
+        rows.extend(await replicas.fetch_all(query))
+
+    items = [_movement_info_from_row(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = _encode_cursor(
+            last.departure_time.isoformat() if last.departure_time else None, last.movement_id
+        )
+    return MovementPage(items=items, next_cursor=next_cursor)
+
+
+@timed()
+async def update_warehouse_state(warehouse_id: str, product_id: str, quantity: int):
+    """Обновляет состояние склада для указанного товара"""
+    query = upsert.warehouse_state_upsert(database.url.dialect, warehouse_id, product_id, quantity)
+    await database.execute(query)
+    warehouse_state_cache.invalidate((warehouse_id, product_id))
+    replicas.mark_written(_stock_key(warehouse_id, product_id))
+
+
+@timed()
 def update_warehouse_state_sync(db: Session, warehouse_id: str, product_id: str, quantity: int):
     """Синхронная версия обновления состояния склада для указанного товара"""
-    record_id = f"{warehouse_id}:{product_id}"
-    
-    state = db.query(WarehouseState).filter(
-        WarehouseState.warehouse_id == warehouse_id,
-        WarehouseState.product_id == product_id
-    ).first()
-    
-    if state:
-        state.quantity = quantity
-    else:
-        new_state = WarehouseState(
-            id=record_id,
-            warehouse_id=warehouse_id,
-            product_id=product_id,
-            quantity=quantity
-        )
-        db.add(new_state)
-    
+    query = upsert.warehouse_state_upsert(db.get_bind().dialect.name, warehouse_id, product_id, quantity)
+    db.execute(query)
     db.commit()
+    warehouse_state_cache.invalidate((warehouse_id, product_id))
+    replicas.mark_written(_stock_key(warehouse_id, product_id))
 
 
-async def update_movement_departure(movement_id: str, warehouse_id: str, product_id: str, timestamp: datetime,
-                                    quantity: int):
-    query = select(movements).where(movements.c.movement_id == movement_id)
-    movement = await database.fetch_one(query)
-
-    if movement:
-        values = {
-            "source_warehouse": warehouse_id,
-            "departure_time": timestamp,
-            "departure_quantity": quantity
-        }
+@timed()
+async def apply_stock_delta(warehouse_id: str, product_id: str, delta: int) -> Optional[int]:
+    """
+    Атомарно изменяет остаток товара на складе на delta одним оператором.
+    Возвращает новый остаток или None, если расход отклонен из-за нехватки товара.
+    """
+    query = upsert.stock_delta_statement(database.url.dialect, warehouse_id, product_id, delta)
+    quantity = await database.fetch_val(query)
+    warehouse_state_cache.invalidate((warehouse_id, product_id))
 
-        if movement["arrival_time"]:
-            try:
-                time_diff = (movement["arrival_time"] - timestamp).total_seconds()
-                quantity_diff = movement["arrival_quantity"] - quantity
-
-                values["time_difference_seconds"] = time_diff
-                values["quantity_difference"] = quantity_diff
-            except Exception as e:
-                logger.error(f"Ошибка при расчете разницы времени: {e}")
-                values["time_difference_seconds"] = 0
-                values["quantity_difference"] = 0
-
-        query = movements.update().where(
-            movements.c.movement_id == movement_id
-        ).values(**values)
-    else:
-        query = movements.insert().values(
-            movement_id=movement_id,
-            source_warehouse=warehouse_id,
-            product_id=product_id,
-            departure_time=timestamp,
-            departure_quantity=quantity
+    if quantity is None:
+        logger.warning(
+            "Недостаточно товара на складе: warehouse_id=%s, product_id=%s, списание=%s",
+            warehouse_id, product_id, -delta
         )
+    return quantity
 
-    await database.execute(query)
+
+@timed()
+async def update_movement_departure(movement_id: str, warehouse_id: str, product_id: str, timestamp: datetime,
+                                    quantity: int):
+    await _write_movement_half(
+        upsert.movement_departure_upsert, movement_id, warehouse_id, product_id, timestamp, quantity
+    )
 
 
+@timed()
 async def update_movement_arrival(movement_id: str, warehouse_id: str, product_id: str, timestamp: datetime,
                                   quantity: int):
-    query = select(movements).where(movements.c.movement_id == movement_id)
-    movement = await database.fetch_one(query)
-
-    if movement:
-        values = {
-            "destination_warehouse": warehouse_id,
-            "arrival_time": timestamp,
-            "arrival_quantity": quantity
-        }
+    await _write_movement_half(
+        upsert.movement_arrival_upsert, movement_id, warehouse_id, product_id, timestamp, quantity
+    )
 
-        if movement["departure_time"]:
-            try:
-                time_diff = (timestamp - movement["departure_time"]).total_seconds()
-                quantity_diff = quantity - movement["departure_quantity"]
-
-                values["time_difference_seconds"] = time_diff
-                values["quantity_difference"] = quantity_diff
-            except Exception as e:
-                logger.error(f"Ошибка при расчете разницы времени: {e}")
-                values["time_difference_seconds"] = 0
-                values["quantity_difference"] = 0
-
-        query = movements.update().where(
-            movements.c.movement_id == movement_id
-        ).values(**values)
-    else:
-        query = movements.insert().values(
-            movement_id=movement_id,
-            destination_warehouse=warehouse_id,
-            product_id=product_id,
-            arrival_time=timestamp,
-            arrival_quantity=quantity
+
+async def _write_movement_half(build_upsert, movement_id: str, warehouse_id: str, product_id: str,
+                               timestamp: datetime, quantity: int):
+    """
+    Записывает половину перемещения. В свертки аналитики оно попадает только при
+    переходе из незавершенного в завершенное: повторная половина с новым id события
+    (исправление) у уже завершенного перемещения не учитывается второй раз.
+    """
+    async with database.transaction():
+        partition_time = await _movement_partition_time(movement_id, timestamp)
+        # Строка ключа заблокирована, поэтому прочитанное состояние не изменится до записи половины
+        was_complete = await database.fetch_val(
+            select(movements.c.time_difference_seconds.isnot(None))
+            .where(movements.c.movement_id == movement_id, movements.c.partition_time == partition_time)
         )
+        query = build_upsert(
+            database.url.dialect, movement_id, warehouse_id, product_id, timestamp, quantity, partition_time
+        )
+        row = await database.fetch_one(query)
+        if not was_complete:
+            await analytics.record_completed_movement(row)
+        await change_notifier.movement_changed(movement_id)
+    movement_cache.invalidate(movement_id)
 
-    await database.execute(query)
+
+async def _movement_partition_time(movement_id: str, timestamp: datetime) -> datetime:
+    """Секция перемещения из movement_keys; строка ключа остается заблокированной до конца транзакции"""
+    return await database.fetch_val(upsert.movement_key_upsert(database.url.dialect, movement_id, timestamp))
 
 
 async def get_movement_info(movement_id: str) -> MovementInfo:
-    """Получает информацию о перемещении по его ID"""
-    logger.info(f"Запрос информации о перемещении: movement_id={movement_id}")
+    """Получает информацию о перемещении по его ID (через кэш чтения)"""
+    found, movement = movement_cache.get(movement_id)
+    if found:
+        return movement
+
+    generation = movement_cache.generation(movement_id)
+    movement = await _load_movement_info(movement_id)
+    movement_cache.set(movement_id, movement, generation)
+    return movement
+
+
+@timed("get_movement_info")
+async def _load_movement_info(movement_id: str) -> MovementInfo:
+    logger.debug("Запрос информации о перемещении: movement_id=%s", movement_id)
     
-    query = select(movements).where(movements.c.movement_id == movement_id)
-    result = await database.fetch_one(query)
+    query = select(movements).where(_movement_lookup(movement_id))
+    try:
+        result = await replicas.fetch_one(query, _movement_key(movement_id))
+    except Exception as e:
+        logger.error("Ошибка при получении информации о перемещении: %s", e)
+        raise HTTPException(status_code=500, detail="Ошибка при получении данных")
     
     if not result:
-        logger.warning(f"Перемещение не найдено: movement_id={movement_id}")
+        logger.warning("Перемещение не найдено: movement_id=%s", movement_id)
         return None
     
-    logger.info(f"Найдено перемещение: {result}")
+    logger.debug("Найдено перемещение: %s", result)
     
+    return _movement_info_from_row(result)
+
+
+def _movement_info_from_row(row) -> MovementInfo:
     return MovementInfo(
-        movement_id=result["movement_id"],
-        source_warehouse=result["source_warehouse"],
-        destination_warehouse=result["destination_warehouse"],
-        product_id=result["product_id"],
-        departure_time=result["departure_time"],
-        arrival_time=result["arrival_time"],
-        time_difference_seconds=float(result["time_difference_seconds"]) if result["time_difference_seconds"] else None,
-        departure_quantity=result["departure_quantity"],
-        arrival_quantity=result["arrival_quantity"],
-        quantity_difference=result["quantity_difference"]
+        movement_id=row["movement_id"],
+        source_warehouse=row["source_warehouse"],
+        destination_warehouse=row["destination_warehouse"],
+        product_id=row["product_id"],
+        departure_time=row["departure_time"],
+        arrival_time=row["arrival_time"],
+        time_difference_seconds=float(row["time_difference_seconds"]) if row["time_difference_seconds"] else None,
+        departure_quantity=row["departure_quantity"],
+        arrival_quantity=row["arrival_quantity"],
+        quantity_difference=row["quantity_difference"]
     )
 
 
 def get_movement_info_sync(db: Session, movement_id: str) -> MovementInfo:
-    """Синхронная версия получения информации о перемещении по его ID"""
+    """Синхронная версия получения информации о перемещении по его ID (через кэш чтения)"""
+    found, movement = movement_cache.get(movement_id)
+    if found:
+        return movement
+
+    generation = movement_cache.generation(movement_id)
+    movement = replicas.read_sync(
+        db, lambda session: _load_movement_info_sync(session, movement_id), _movement_key(movement_id)
+    )
+    movement_cache.set(movement_id, movement, generation)
+    return movement
+
+
+@timed("get_movement_info_sync")
+def _load_movement_info_sync(db: Session, movement_id: str) -> MovementInfo:
     try:
-        logger.info(f"Запрос информации о перемещении (sync): movement_id={movement_id}")
+        logger.debug("Запрос информации о перемещении (sync): movement_id=%s", movement_id)
         
-        movement = db.query(Movement).filter(Movement.movement_id == movement_id).first()
+        movement = db.query(Movement).filter(_movement_lookup(movement_id, Movement.__table__)).first()
         
         if not movement:
-            logger.warning(f"Перемещение не найдено: movement_id={movement_id}")
+            logger.warning("Перемещение не найдено: movement_id=%s", movement_id)
             return None
         
-        logger.info(f"Найдено перемещение: {movement}")
+        logger.debug("Найдено перемещение: %s", movement)
         
         return MovementInfo(
             movement_id=movement.movement_id,
@@ -256,5 +523,146 @@ def get_movement_info_sync(db: Session, movement_id: str) -> MovementInfo:
             quantity_difference=movement.quantity_difference
         )
     except Exception as e:
-        logger.error(f"Ошибка при получении информации о перемещении: {e}")
-        raise HTTPException(status_code=500, detail="Ошибка при получении данных")
\ No newline at end of file
+        logger.error("Ошибка при получении информации о перемещении: %s", e)
+        raise HTTPException(status_code=500, detail="Ошибка при получении данных")
+
+
+def _to_naive_utc(timestamp: datetime) -> datetime:
+    """Колонки времени в БД хранятся без часового пояса, в UTC"""
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _ledger_row(message: MovementEvent, timestamp: datetime, quantity_after: Optional[int] = None) -> dict:
+    data = message.data
+    delta = -data.quantity if data.event == "departure" else data.quantity
+    return ledger.ledger_row(
+        message.id, data.movement_id, data.warehouse_id, data.product_id, delta, timestamp, quantity_after
+    )
+
+
+class _StockRejected(Exception):
+    """Расход отклонен: транзакция события откатывается вместе с отметкой о нем"""
+
+
+async def process_message(message: MovementEvent) -> bool:
+    """
+    Применяет событие отправки или приемки товара к перемещениям и остаткам склада.
+    Возвращает False, если расход отклонен из-за нехватки товара; ошибка БД
+    пробрасывается, чтобы вызывающий мог отличить ее от отклонения и повторить событие.
+
+    Повторно доставленное событие (тот же message.id) пропускается и считается
+    успешно обработанным: сначала по памяти, затем по отметке в processed_events,
+    которая пишется в той же транзакции, что и изменения и строка журнала stock_events.
+    """
+    data = message.data
+    if idempotency.seen_recently(message.id):
+        return True
+    timestamp = _to_naive_utc(data.timestamp)
+
+    try:
+        if stock_buffer.enabled:
+            return await _process_buffered(message)
+        async with database.transaction():
+            if not await idempotency.mark_processed(message.id):
+                return True
+            if data.event == "departure":
+                quantity = await apply_stock_delta(data.warehouse_id, data.product_id, -data.quantity)
+                if quantity is None:
+                    raise _StockRejected()
+                await update_movement_departure(
+                    data.movement_id, data.warehouse_id, data.product_id, timestamp, data.quantity
+                )
+            else:
+                quantity = await apply_stock_delta(data.warehouse_id, data.product_id, data.quantity)
+                await update_movement_arrival(
+                    data.movement_id, data.warehouse_id, data.product_id, timestamp, data.quantity
+                )
+            await ledger.append([_ledger_row(message, timestamp, quantity)])
+            await change_notifier.stock_changed([(data.warehouse_id, data.product_id, quantity, timestamp)])
+        idempotency.remember(message.id)
+        # Повторная инвалидация после коммита: чтение между записью и коммитом
+        # могло закэшировать еще не обновленную строку
+        warehouse_state_cache.invalidate((data.warehouse_id, data.product_id))
+        movement_cache.invalidate(data.movement_id)
+        replicas.mark_written(_stock_key(data.warehouse_id, data.product_id))
+        replicas.mark_written(_movement_key(data.movement_id))
+        stock_hub.publish(data.warehouse_id, data.product_id, quantity, timestamp)
+        return True
+    except _StockRejected:
+        return False
+    except Exception as e:
+        logger.error("Ошибка при обработке события %s: %s", data.movement_id, e)
+        raise
+
+
+async def _process_buffered(message: MovementEvent) -> bool:
+    """
+    Режим отложенной записи: дельта остатка уходит в stock_buffer, а отметка о событии
+    и строка журнала пишутся вместе с ней при flush(). Upsert перемещения выполняется сразу: он
+    перезаписывает поля, поэтому повтор события после сбоя до flush() безопасен.
+    """
+    data = message.data
+    if stock_buffer.has_event(message.id) or await idempotency.is_processed(message.id):
+        return True
+    timestamp = _to_naive_utc(data.timestamp)
+    event = _ledger_row(message, timestamp)
+
+    quantity = await stock_buffer.apply(event, source=message)
+    if quantity is None:
+        logger.warning(
+            "Недостаточно товара на складе: warehouse_id=%s, product_id=%s, списание=%s",
+            data.warehouse_id, data.product_id, data.quantity
+        )
+        return False
+
+    try:
+        if data.event == "departure":
+            await update_movement_departure(
+                data.movement_id, data.warehouse_id, data.product_id, timestamp, data.quantity
+            )
+        else:
+            await update_movement_arrival(
+                data.movement_id, data.warehouse_id, data.product_id, timestamp, data.quantity
+            )
+        replicas.mark_written(_stock_key(data.warehouse_id, data.product_id))
+        replicas.mark_written(_movement_key(data.movement_id))
+        # Подписчики видят остаток с учетом буфера — тот же, что отдает чтение
+        stock_hub.publish(data.warehouse_id, data.product_id, quantity, timestamp)
+        stock_buffer.confirm(event)
+        return True
+    except Exception as e:
+        stock_buffer.revert(event)
+        logger.error("Ошибка при обработке события %s: %s", data.movement_id, e)
+        raise
+
+
+async def process_batch(messages: List[MovementEvent], concurrency: int = 16) -> List[Union[bool, Exception]]:
+    """
+    Конкурентно обрабатывает пачку событий.
+
+    События одного movement_id применяются строго в порядке поступления, разные
+    перемещения обрабатываются параллельно (не более concurrency одновременно).
+    Остатки меняются атомарными дельтами, поэтому общие склад/товар не требуют
+    блокировок. Возвращает результаты process_message в порядке входных сообщений;
+    ошибка обработки события возвращается на его месте, как в gather(return_exceptions=True).
+    """
+    results: List[Union[bool, Exception]] = [False] * len(messages)
+    groups: Dict[str, List[Tuple[int, MovementEvent]]] = defaultdict(list)
+    for index, message in enumerate(messages):
+        groups[message.data.movement_id].append((index, message))
+
+    pending = iter(groups.values())
+
+    # Фиксированный набор воркеров, чтобы не открывать соединение с БД на каждую группу
+    async def worker():
+        for items in pending:
+            for index, message in items:
+                try:
+                    results[index] = await process_message(message)
+                except Exception as e:
+                    results[index] = e
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(groups)))))
+    return results
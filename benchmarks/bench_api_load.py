@@ -0,0 +1,152 @@
+"""
+Нагрузочный тест чтения API: сравнивает синхронный (SessionLocal в пуле потоков)
+и асинхронный (пул databases) режимы обработчиков по p50, p99 и RPS на
+нескольких уровнях конкурентности.
+
+Для каждого режима поднимается отдельный процесс uvicorn с API_SYNC_READS=true/false.
+Кэш чтения по умолчанию отключен, чтобы каждый запрос доходил до БД. На SQLite
+databases открывает отдельное соединение aiosqlite на каждый запрос, поэтому
+показательное сравнение — на PostgreSQL (--database-url), где работает пул asyncpg.
+
+Запуск: python -m benchmarks.bench_api_load --levels 1,10,50,100 --requests 2000
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+LOADED_AT = datetime(2025, 1, 1)
+
+
+def bench_app():
+    """Фабрика приложения для uvicorn --factory: только подключение к БД, без тестовых данных и Kafka"""
+    from app.main import app
+    from app.models.database import database
+
+    app.router.on_startup.clear()
+    app.router.on_shutdown.clear()
+    app.router.on_startup.append(database.connect)
+    app.router.on_shutdown.append(database.disconnect)
+    return app
+
+
+def seed(database_url, warehouses, products):
+    os.environ["DATABASE_URL"] = database_url
+    from sqlalchemy import create_engine
+    from app.models.database import metadata, warehouse_states, movements, movement_keys
+
+    engine = create_engine(database_url)
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(warehouse_states.delete())
+        connection.execute(movements.delete())
+        connection.execute(movement_keys.delete())
+        connection.execute(warehouse_states.insert(), [
+            {"id": f"WH-{w}:PROD-{p}", "warehouse_id": f"WH-{w}", "product_id": f"PROD-{p}", "quantity": w + p}
+            for w in range(warehouses) for p in range(products)
+        ])
+        connection.execute(movements.insert(), [
+            {"movement_id": f"MOV-{n}", "partition_time": LOADED_AT, "product_id": f"PROD-{n % products}",
+             "departure_quantity": 10}
+            for n in range(warehouses * products)
+        ])
+        connection.execute(movement_keys.insert(), [
+            {"movement_id": f"MOV-{n}", "partition_time": LOADED_AT} for n in range(warehouses * products)
+        ])
+    engine.dispose()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(env, port):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.bench_api_load:bench_app", "--factory",
+         "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/docs", timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("uvicorn не запустился за 30 секунд")
+
+
+async def load(base_url, concurrency, requests, warehouses, products):
+    rnd = random.Random(concurrency)
+    latencies = []
+
+    async def client_worker(client, count):
+        for _ in range(count):
+            if rnd.random() < 0.5:
+                path = f"/warehouses/WH-{rnd.randrange(warehouses)}/products/PROD-{rnd.randrange(products)}"
+            else:
+                path = f"/movements/MOV-{rnd.randrange(warehouses * products)}"
+            started = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        per_worker = max(1, requests // concurrency)
+        await asyncio.gather(*(client_worker(client, per_worker) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    return quantiles[49] * 1000, quantiles[98] * 1000, len(latencies) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="1,10,50,100")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warehouses", type=int, default=50)
+    parser.add_argument("--products", type=int, default=100)
+    parser.add_argument("--with-cache", action="store_true", help="не отключать кэш чтения")
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    seed(database_url, args.warehouses, args.products)
+    levels = [int(level) for level in args.levels.split(",")]
+
+    print(f"{'режим':>6} {'конк.':>6} {'p50, мс':>9} {'p99, мс':>9} {'RPS':>9}")
+    for mode in ("sync", "async"):
+        env = dict(os.environ, DATABASE_URL=database_url, API_SYNC_READS=str(mode == "sync").lower())
+        if not args.with_cache:
+            env["CACHE_MAX_SIZE"] = "0"
+        port = free_port()
+        server = start_server(env, port)
+        try:
+            for concurrency in levels:
+                p50, p99, rps = asyncio.run(load(
+                    f"http://127.0.0.1:{port}", concurrency, args.requests, args.warehouses, args.products
+                ))
+                print(f"{mode:>6} {concurrency:>6} {p50:>9.2f} {p99:>9.2f} {rps:>9.1f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Бенчмарк запроса остатка на момент времени (as_of) на журнале stock_events.
+
+Заполняет журнал --rows строками для --keys пар склад/товар с растущим
+recorded_at и сравнивает задержку:
+  - as_of:  stock_as_of_queries — поиск последней строки не позже момента по
+            индексу (warehouse_id, product_id, recorded_at, id), O(log n);
+  - сумма:  SUM(delta) по всем изменениям пары до момента — время растет с
+            длиной истории пары.
+
+База — временный файл SQLite (или DATABASE_URL из аргумента --database-url).
+
+Запуск: python -m benchmarks.bench_as_of --rows 2000000 --keys 1000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.report import latency_summary
+
+START = datetime(2025, 1, 1)
+
+
+def populate(engine, rows, keys, seed, chunk_size=50000):
+    from app.models.database import metadata, stock_events
+
+    rng = random.Random(seed)
+    quantities = [1000] * keys
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(stock_events.delete())
+    for start in range(0, rows, chunk_size):
+        chunk = []
+        for number in range(start, min(rows, start + chunk_size)):
+            key = rng.randrange(keys)
+            delta = rng.randint(-10, 10)
+            quantities[key] += delta
+            timestamp = START + timedelta(seconds=number)
+            chunk.append({
+                "event_id": f"E-{number}", "movement_id": f"MOV-{number}",
+                "warehouse_id": f"WH-{key % 50}", "product_id": f"PROD-{key}",
+                "delta": delta, "quantity_after": quantities[key],
+                "occurred_at": timestamp, "recorded_at": timestamp,
+            })
+        with engine.begin() as connection:
+            connection.execute(stock_events.insert(), chunk)
+
+
+def measure(engine, build_query, lookups, rows, keys, seed):
+    rng = random.Random(seed)
+    latencies = []
+    with engine.connect() as connection:
+        started = time.perf_counter()
+        for _ in range(lookups):
+            key = rng.randrange(keys)
+            as_of = START + timedelta(seconds=rng.randrange(rows))
+            query_started = time.perf_counter()
+            connection.execute(build_query(f"WH-{key % 50}", f"PROD-{key}", as_of)).scalar()
+            latencies.append(time.perf_counter() - query_started)
+        elapsed = time.perf_counter() - started
+    return latency_summary(latencies, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database-url")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+    from sqlalchemy import create_engine, func, select
+    from app.models.database import stock_events
+    from app.services.ledger import stock_as_of_queries
+
+    def as_of_query(warehouse_id, product_id, as_of):
+        return stock_as_of_queries(warehouse_id, product_id, as_of)[0]
+
+    def sum_query(warehouse_id, product_id, as_of):
+        return select(func.sum(stock_events.c.delta)).where(
+            stock_events.c.warehouse_id == warehouse_id,
+            stock_events.c.product_id == product_id,
+            stock_events.c.recorded_at <= as_of
+        )
+
+    engine = create_engine(os.environ["DATABASE_URL"])
+    started = time.perf_counter()
+    populate(engine, args.rows, args.keys, args.seed)
+    print(f"Строк журнала: {args.rows}, пар склад/товар: {args.keys}, заполнение {time.perf_counter() - started:.1f} с")
+
+    for name, build_query in (("as_of", as_of_query), ("сумма", sum_query)):
+        summary = measure(engine, build_query, args.lookups, args.rows, args.keys, args.seed)
+        print(f"{name:>8}: p50 {summary['p50']:7.3f} мс, p99 {summary['p99']:7.3f} мс, "
+              f"{summary['rps']:9.0f} запросов/с")
+
+
+if __name__ == "__main__":
+    main()
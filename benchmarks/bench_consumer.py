@@ -0,0 +1,98 @@
+"""
+Бенчмарк Kafka-потребителя: сравнивает пропускную способность (событий/с)
+последовательного цикла, пакетного режима и пакетного режима с отложенной
+записью остатков (STOCK_WRITE_BEHIND).
+
+Брокер заменяется списком записей в памяти, база — временный файл SQLite
+(или DATABASE_URL из аргумента --database-url). SQLite сериализует запись и
+упирается в fsync на каждый коммит, поэтому выигрыш от параллельной обработки
+пачки виден на PostgreSQL, где перекрываются сетевые round-trip'ы.
+
+Запуск: python -m benchmarks.bench_consumer --movements 1000 --batch-size 500
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks.events import generate_events, initial_stock
+from benchmarks.fake_kafka import InMemoryKafkaConsumer
+
+
+def run_mode(events, warehouses, products, batch_mode, batch_size, concurrency, write_behind=False):
+    from app.models.database import database, warehouse_states, movements, movement_keys, processed_events, stock_events
+    from app.services.idempotency import processed_event_cache
+    from app.services.kafka_consumer import KafkaConsumerService
+    from app.services.stock_buffer import stock_buffer
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    def run(coro):
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    async def reset():
+        await database.execute(warehouse_states.delete())
+        await database.execute(movements.delete())
+        await database.execute(movement_keys.delete())
+        await database.execute(processed_events.delete())
+        await database.execute(stock_events.delete())
+        processed_event_cache.clear()
+        await database.execute_many(warehouse_states.insert(), initial_stock(warehouses, products))
+
+    run(database.connect())
+    run(reset())
+
+    stock_buffer.enabled = write_behind
+    service = KafkaConsumerService(
+        "in-memory", "warehouse_events", loop=loop,
+        batch_mode=batch_mode, batch_size=batch_size, batch_concurrency=concurrency
+    )
+    service._create_consumer = lambda: InMemoryKafkaConsumer(service, events)
+
+    started = time.perf_counter()
+    service._consume()
+    elapsed = time.perf_counter() - started
+
+    run(database.disconnect())
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movements", type=int, default=1000)
+    parser.add_argument("--warehouses", type=int, default=20)
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+    import logging
+    logging.disable(logging.WARNING)
+    from app.models.database import engine, metadata
+    metadata.create_all(engine)
+
+    events = generate_events(args.movements, args.warehouses, args.products)
+    print(f"Событий: {len(events)}, БД: {os.environ['DATABASE_URL']}")
+    baseline = None
+    for name, batch_mode, write_behind in (
+        ("последовательный", False, False), ("пакетный", True, False), ("пакетный+буфер", True, True)
+    ):
+        elapsed = run_mode(events, args.warehouses, args.products, batch_mode, args.batch_size, args.concurrency,
+                           write_behind)
+        rate = len(events) / elapsed
+        baseline = baseline or rate
+        print(f"{name:>18}: {elapsed:8.2f} с, {rate:10.1f} событий/с, x{rate / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Масштабирование потребителя по числу процессов.
+
+Поток событий раскладывается по партициям так же, как это делает продюсер с
+ключом movement_id, партиции делятся между воркерами (как при назначении в
+группе), и каждый воркер — отдельный процесс со своим KafkaConsumerService и
+in-memory брокером. Для каждого числа воркеров выводится общая пропускная
+способность (событий/с) и ускорение относительно одного процесса.
+
+На SQLite запись сериализуется блокировкой файла, поэтому рост ограничен;
+для оценки на реальной нагрузке передайте --database-url PostgreSQL.
+
+Запуск: python -m benchmarks.bench_consumer_scaling --workers 1,2,4 --movements 2000
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks.events import generate_events, initial_stock
+from benchmarks.fake_kafka import InMemoryKafkaConsumer, partition_for
+
+
+def worker(events, batch_mode, batch_size, results):
+    import logging
+    logging.disable(logging.WARNING)
+    from app.models.database import database
+    from app.services.kafka_consumer import KafkaConsumerService
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(database.connect(), loop).result()
+
+    service = KafkaConsumerService("in-memory", "warehouse_events", loop=loop, batch_mode=batch_mode,
+                                   batch_size=batch_size)
+    service._create_consumer = lambda: InMemoryKafkaConsumer(service, events)
+    started = time.time()
+    service._consume()
+    results.put((started, time.time()))
+
+    asyncio.run_coroutine_threadsafe(database.disconnect(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+def reset(database_url, warehouses, products):
+    from sqlalchemy import create_engine
+    from app.models.database import metadata, warehouse_states, movements, movement_keys, processed_events, stock_events
+
+    engine = create_engine(database_url)
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(warehouse_states.delete())
+        connection.execute(movements.delete())
+        connection.execute(movement_keys.delete())
+        connection.execute(processed_events.delete())
+        connection.execute(stock_events.delete())
+        connection.execute(warehouse_states.insert(), initial_stock(warehouses, products))
+    engine.dispose()
+
+
+def run(events, workers, partitions, batch_mode, batch_size):
+    assignment = [[] for _ in range(workers)]
+    for event in events:
+        partition = partition_for(event["data"]["movement_id"], partitions)
+        assignment[partition % workers].append(event)
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(assigned, batch_mode, batch_size, results))
+        for assigned in assignment
+    ]
+    for process in processes:
+        process.start()
+    spans = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return max(end for _, end in spans) - min(start for start, _ in spans)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--partitions", type=int, default=12)
+    parser.add_argument("--movements", type=int, default=2000)
+    parser.add_argument("--warehouses", type=int, default=20)
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--batch-mode", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    os.environ["DATABASE_URL"] = database_url
+    events = generate_events(args.movements, args.warehouses, args.products)
+    print(f"Событий: {len(events)}, партиций: {args.partitions}, ядер: {os.cpu_count()}, БД: {database_url}")
+
+    baseline = None
+    for workers in (int(value) for value in args.workers.split(",")):
+        reset(database_url, args.warehouses, args.products)
+        elapsed = run(events, workers, args.partitions, args.batch_mode, args.batch_size)
+        rate = len(events) / elapsed
+        baseline = baseline or rate
+        print(f"{workers:>3} воркер(ов): {elapsed:8.2f} с, {rate:10.1f} событий/с, x{rate / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
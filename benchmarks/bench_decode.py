@@ -0,0 +1,53 @@
+"""
+Микробенчмарк разбора записей Kafka: сообщений в секунду на одно ядро.
+
+Сравнивает:
+  - json.loads + KafkaMessage(**dict) — прежний путь (value_deserializer + конструктор);
+  - orjson.loads + KafkaMessage.model_validate — быстрый JSON-парсер, но все еще через dict;
+  - KafkaMessage.model_validate_json — байты сразу в модель, полный конверт;
+  - MovementEvent.model_validate_json — байты сразу в модель, только id и data (горячий путь).
+
+Запуск: python -m benchmarks.bench_decode --messages 100000
+"""
+import argparse
+import json
+import time
+
+from benchmarks.events import generate_events
+
+
+def measure(decode, payloads):
+    started = time.perf_counter()
+    for payload in payloads:
+        decode(payload)
+    return len(payloads) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100000)
+    args = parser.parse_args()
+
+    from app.models.schemas import KafkaMessage, MovementEvent
+
+    payloads = [json.dumps(event).encode() for event in generate_events(args.messages // 2, 20, 50)]
+    variants = [
+        ("json.loads + KafkaMessage(**)", lambda raw: KafkaMessage(**json.loads(raw))),
+        ("KafkaMessage.model_validate_json", KafkaMessage.model_validate_json),
+        ("MovementEvent.model_validate_json", MovementEvent.model_validate_json),
+    ]
+    try:
+        import orjson
+        variants.insert(1, ("orjson.loads + model_validate", lambda raw: KafkaMessage.model_validate(orjson.loads(raw))))
+    except ImportError:
+        pass
+
+    baseline = None
+    for name, decode in variants:
+        rate = measure(decode, payloads)
+        baseline = baseline or rate
+        print(f"{name:>36}: {rate:12.0f} сообщений/с, x{rate / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
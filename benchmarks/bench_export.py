@@ -0,0 +1,106 @@
+"""
+Бенчмарк потоковой выгрузки перемещений (GET /movements/export).
+
+Заполняет таблицу movements --rows строками, затем читает всю выгрузку через
+encode_rows(iter_movement_rows()) так же, как StreamingResponse, и печатает
+скорость, прирост RSS процесса за время выгрузки (максимум по замерам) и
+максимальную задержку цикла событий (параллельная задача просыпается каждые 10 мс).
+
+База — временный файл SQLite (или DATABASE_URL из аргумента --database-url).
+
+Запуск: python -m benchmarks.bench_export --rows 1000000 --format csv
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+START = datetime(2025, 1, 1)
+
+
+def populate(engine, rows, chunk_size=50000):
+    from app.models.database import metadata, movements
+
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(movements.delete())
+    for start in range(0, rows, chunk_size):
+        chunk = [
+            {
+                "movement_id": f"MOV-{number:09d}", "partition_time": START + timedelta(seconds=number),
+                "source_warehouse": f"WH-{number % 50}",
+                "destination_warehouse": f"WH-{(number + 1) % 50}", "product_id": f"PROD-{number % 1000}",
+                "departure_time": START + timedelta(seconds=number),
+                "arrival_time": START + timedelta(seconds=number + 3600), "time_difference_seconds": 3600.0,
+                "departure_quantity": 10, "arrival_quantity": 10, "quantity_difference": 0,
+            }
+            for number in range(start, min(rows, start + chunk_size))
+        ]
+        with engine.begin() as connection:
+            connection.execute(movements.insert(), chunk)
+
+
+def rss_mb() -> float:
+    """Текущий RSS процесса (Linux, /proc/self/statm)"""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+async def export(export_format):
+    from app.models.database import database
+    from app.services.export import MOVEMENT_COLUMNS, encode_rows
+    from app.services.warehouse_services import iter_movement_rows
+
+    max_lag = 0.0
+    peak_rss = rss_mb()
+    done = False
+
+    async def monitor(interval=0.01):
+        nonlocal max_lag, peak_rss
+        loop = asyncio.get_running_loop()
+        while not done:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            max_lag = max(max_lag, loop.time() - expected)
+            peak_rss = max(peak_rss, rss_mb())
+
+    await database.connect()
+    rss_before = rss_mb()
+    monitor_task = asyncio.create_task(monitor())
+    size = 0
+    started = time.perf_counter()
+    async for chunk in encode_rows(iter_movement_rows(), MOVEMENT_COLUMNS, export_format):
+        size += len(chunk)
+    elapsed = time.perf_counter() - started
+    done = True
+    await monitor_task
+    await database.disconnect()
+    return size, elapsed, max_lag, peak_rss - rss_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    parser.add_argument("--database-url")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+    from sqlalchemy import create_engine
+
+    engine = create_engine(os.environ["DATABASE_URL"])
+    populate(engine, args.rows)
+    engine.dispose()
+
+    size, elapsed, max_lag, rss_growth = asyncio.run(export(args.format))
+    print(f"Строк: {args.rows}, формат: {args.format}, объем: {size / 2 ** 20:.0f} МБ")
+    print(f"Скорость: {args.rows / elapsed:.0f} строк/с, {size / 2 ** 20 / elapsed:.1f} МБ/с")
+    print(f"Прирост RSS: {rss_growth:.1f} МБ, "
+          f"максимальная задержка цикла событий: {max_lag * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
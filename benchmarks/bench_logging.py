@@ -0,0 +1,80 @@
+"""
+Бенчмарк стоимости логирования на один запрос чтения.
+
+Воспроизводит строки лога запроса остатка: «запрос», «найдено» со строкой БД и
+предупреждение о промахе, и сравнивает режимы:
+  - fstring: прежний вариант — f-строки на INFO, синхронный StreamHandler;
+  - lazy:    ленивые шаблоны, служебные строки на DEBUG, синхронный StreamHandler;
+  - structured: configure_logging — очередь, JSON в отдельном потоке, ограничитель.
+
+Вывод идет в /dev/null, поэтому измеряется форматирование и вызовы, а не терминал.
+
+Запуск: python -m benchmarks.bench_logging --requests 50000
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+ROW = {"id": "WH-1:PROD-1", "warehouse_id": "WH-1", "product_id": "PROD-1", "quantity": 100}
+
+
+def fstring_request(logger, warehouse_id, product_id):
+    logger.info(f"Запрос состояния склада: warehouse_id={warehouse_id}, product_id={product_id}")
+    logger.info(f"Найдено состояние склада: {ROW}")
+    logger.warning(f"Склад не найден: warehouse_id={warehouse_id}, product_id={product_id}")
+
+
+def lazy_request(logger, warehouse_id, product_id):
+    logger.debug("Запрос состояния склада: warehouse_id=%s, product_id=%s", warehouse_id, product_id)
+    logger.debug("Найдено состояние склада: %s", ROW)
+    logger.warning("Склад не найден: warehouse_id=%s, product_id=%s", warehouse_id, product_id)
+
+
+def plain_handler(devnull):
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    handler = logging.StreamHandler(devnull)
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+
+def measure(request, logger, requests):
+    started = time.perf_counter()
+    for number in range(requests):
+        request(logger, f"WH-{number % 50}", f"PROD-{number % 100}")
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50000)
+    parser.add_argument("--rate-limit", type=int, default=100)
+    args = parser.parse_args()
+
+    from app.core.logging_config import configure_logging, stop_logging
+
+    logger = logging.getLogger("bench")
+    devnull = open(os.devnull, "w")
+
+    plain_handler(devnull)
+    baseline = measure(fstring_request, logger, args.requests)
+    lazy = measure(lazy_request, logger, args.requests)
+
+    stderr, sys.stderr = sys.stderr, devnull
+    try:
+        configure_logging("INFO", "json", async_mode=True, rate_limit=args.rate_limit)
+        structured = measure(lazy_request, logger, args.requests)
+        stop_logging()
+    finally:
+        sys.stderr = stderr
+
+    for name, value in (("fstring", baseline), ("lazy", lazy), ("structured", structured)):
+        print(f"{name:>10}: {value:8.2f} мкс/запрос, экономия {baseline - value:8.2f} мкс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Бенчмарк накладных расходов метрик: стоимость Counter.inc, Histogram.observe,
+декоратора timed и MetricsMiddleware на запрос к пустому ASGI-приложению.
+
+Запуск: python -m benchmarks.bench_metrics --iterations 200000
+"""
+import argparse
+import asyncio
+import time
+import timeit
+
+
+def per_call_ns(statement, setup_globals, iterations):
+    return timeit.timeit(statement, globals=setup_globals, number=iterations) / iterations * 1e9
+
+
+async def empty_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def drive(app, iterations):
+    scope = {"type": "http", "method": "GET", "path": "/"}
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        pass
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await app(scope, receive, send)
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    from app.core.metrics import Counter, Histogram, MetricsMiddleware, timed
+
+    counter = Counter("bench_counter", "bench")
+    histogram = Histogram("bench_histogram", "bench", ("function",)).labels("f")
+
+    def plain():
+        return None
+
+    @timed("bench")
+    def wrapped():
+        return None
+
+    env = {"counter": counter, "histogram": histogram, "plain": plain, "wrapped": wrapped}
+    n = args.iterations
+    print(f"{'Counter.inc':>28}: {per_call_ns('counter.inc()', env, n):8.1f} нс")
+    print(f"{'Histogram.observe':>28}: {per_call_ns('histogram.observe(0.003)', env, n):8.1f} нс")
+    overhead = per_call_ns("wrapped()", env, n) - per_call_ns("plain()", env, n)
+    print(f"{'timed (накладные)':>28}: {overhead:8.1f} нс")
+
+    bare = asyncio.run(drive(empty_app, n))
+    instrumented = asyncio.run(drive(MetricsMiddleware(empty_app), n))
+    print(f"{'MetricsMiddleware (накладные)':>28}: {instrumented - bare:8.1f} нс/запрос")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Бенчмарк записи и поиска перемещений по мере роста таблицы movements.
+
+Таблица наполняется ступенями до размеров из --sizes (строки распределены по
+--months месяцам partition_time; в PostgreSQL для них заранее создаются
+секции). После каждой ступени измеряется задержка:
+  - запись:   половины новых перемещений через update_movement_departure /
+              update_movement_arrival (ключ в movement_keys + UPSERT строки);
+  - ключ:     поиск по movement_id через movement_keys — одна секция;
+  - без ключа: поиск только по movement_id — индекс каждой секции.
+
+База — временный файл SQLite (или DATABASE_URL из аргумента --database-url).
+На SQLite секций нет, и оба поиска почти равны; разница видна в PostgreSQL.
+
+Запуск: python -m benchmarks.bench_movement_partitions --sizes 100000,500000,1000000 [--database-url postgresql://...]
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.report import latency_summary
+
+
+def populate(engine, start_month, span, first, last, chunk_size=50000):
+    """Добавляет строки с номерами [first, last) и их ключи; partition_time равномерно в пределах span"""
+    from app.models.database import movement_keys, movements
+
+    for start in range(first, last, chunk_size):
+        numbers = range(start, min(last, start + chunk_size))
+        rows = []
+        for number in numbers:
+            partition_time = start_month + span * (number % 997) / 997
+            rows.append({
+                "movement_id": f"MOV-{number:09d}", "partition_time": partition_time,
+                "source_warehouse": f"WH-{number % 50}", "product_id": f"PROD-{number % 1000}",
+                "departure_time": partition_time, "departure_quantity": 10,
+            })
+        with engine.begin() as connection:
+            connection.execute(movements.insert(), rows)
+            connection.execute(movement_keys.insert(), [
+                {"movement_id": row["movement_id"], "partition_time": row["partition_time"]} for row in rows
+            ])
+
+
+async def measure_writes(events, start_month, span, rng):
+    from app.services.warehouse_services import update_movement_arrival, update_movement_departure
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(events):
+        movement_id = f"NEW-{rng.getrandbits(64):016x}"
+        departed = start_month + span * rng.random()
+        for write, timestamp in ((update_movement_departure, departed),
+                                 (update_movement_arrival, departed + timedelta(hours=2))):
+            write_started = time.perf_counter()
+            await write(movement_id, "WH-1", "PROD-1", timestamp, 10)
+            latencies.append(time.perf_counter() - write_started)
+    return latency_summary(latencies, time.perf_counter() - started)
+
+
+async def measure_lookups(fetch, lookups, rows, rng):
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(lookups):
+        movement_id = f"MOV-{rng.randrange(rows):09d}"
+        lookup_started = time.perf_counter()
+        assert await fetch(movement_id) is not None
+        latencies.append(time.perf_counter() - lookup_started)
+    return latency_summary(latencies, time.perf_counter() - started)
+
+
+async def run(args, engine):
+    from sqlalchemy import select
+    from app.models.database import database, movement_keys, movements, metadata
+    from app.services.movement_partitions import add_months, create_partitions, month_start
+    from app.services.warehouse_services import _load_movement_info
+
+    # Будущие месяцы: в PostgreSQL прошлые диапазоны уже покрыты movements_legacy
+    start_month = add_months(month_start(datetime.utcnow()), 1)
+    span = add_months(start_month, args.months) - start_month
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(movements.delete())
+        connection.execute(movement_keys.delete())
+
+    await database.connect()
+    try:
+        created = await create_partitions(args.months, now=start_month)
+        print(f"Диалект: {database.url.dialect}, месяцев: {args.months}, создано секций: {len(created)}")
+
+        async def by_movement_id(movement_id):
+            return await database.fetch_one(select(movements).where(movements.c.movement_id == movement_id))
+
+        rng = random.Random(args.seed)
+        loaded = 0
+        for size in args.sizes:
+            started = time.perf_counter()
+            populate(engine, start_month, span, loaded, size)
+            loaded = size
+            print(f"\nСтрок: {size}, заполнение {time.perf_counter() - started:.1f} с")
+            results = (
+                ("запись", await measure_writes(args.events, start_month, span, rng)),
+                ("ключ", await measure_lookups(_load_movement_info, args.lookups, size, rng)),
+                ("без ключа", await measure_lookups(by_movement_id, args.lookups, size, rng)),
+            )
+            for name, summary in results:
+                print(f"{name:>10}: p50 {summary['p50']:7.3f} мс, p99 {summary['p99']:7.3f} мс, "
+                      f"{summary['rps']:9.0f} операций/с")
+    finally:
+        await database.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100000,500000,1000000", help="размеры таблицы через запятую, по возрастанию")
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--events", type=int, default=1000, help="перемещений, записываемых на каждой ступени")
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database-url")
+    args = parser.parse_args()
+    args.sizes = sorted(int(size) for size in args.sizes.split(","))
+
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from sqlalchemy import create_engine
+
+    engine = create_engine(os.environ["DATABASE_URL"])
+    asyncio.run(run(args, engine))
+
+
+if __name__ == "__main__":
+    main()
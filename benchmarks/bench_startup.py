@@ -0,0 +1,91 @@
+"""
+Бенчмарк холодного старта приложения.
+
+Измеряет два показателя, каждый в отдельных процессах Python:
+  - время импорта app.main;
+  - время от запуска uvicorn до первого ответа 200 на GET /health.
+
+По умолчанию встроенный потребитель включен и указывает на недоступный брокер
+(--kafka 127.0.0.1:1): старт не должен зависеть от Kafka. База — временный
+файл SQLite (или DATABASE_URL из аргумента --database-url).
+
+Запуск: python -m benchmarks.bench_startup --runs 5 [--no-consumer] [--database-url postgresql://...]
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+IMPORT_SCRIPT = "import time; started = time.perf_counter(); import app.main; print(time.perf_counter() - started)"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def import_time(env) -> float:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], env=env, check=True, capture_output=True, text=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def time_to_first_200(env, timeout: float) -> float:
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.005)
+        return float("inf")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--kafka", default="127.0.0.1:1", help="адрес брокера для встроенного потребителя")
+    parser.add_argument("--no-consumer", action="store_true", help="KAFKA_EMBEDDED_CONSUMER=false")
+    parser.add_argument("--timeout", type=float, default=60.0, help="сколько ждать первого 200, с")
+    parser.add_argument("--database-url")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.database_url:
+        env["DATABASE_URL"] = args.database_url
+    else:
+        env["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench_startup.db"
+    env["KAFKA_BOOTSTRAP_SERVERS"] = args.kafka
+    env["KAFKA_EMBEDDED_CONSUMER"] = "false" if args.no_consumer else "true"
+    env["STOCK_SNAPSHOT_INTERVAL_SECONDS"] = "0"
+
+    imports = [import_time(env) for _ in range(args.runs)]
+    starts = [time_to_first_200(env, args.timeout) for _ in range(args.runs)]
+
+    print(f"Запусков: {args.runs}, потребитель: {'выключен' if args.no_consumer else args.kafka}")
+    print(f"Импорт app.main: медиана {statistics.median(imports) * 1000:.0f} мс, "
+          f"максимум {max(imports) * 1000:.0f} мс")
+    print(f"Запуск до первого 200: медиана {statistics.median(starts) * 1000:.0f} мс, "
+          f"максимум {max(starts) * 1000:.0f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Микро-бенчмарк записи события: прежний путь SELECT + UPDATE/INSERT против
+одного INSERT ... ON CONFLICT DO UPDATE.
+
+Для каждого события пишутся остаток склада и половина перемещения (отправка,
+затем приемка), выводится средняя задержка на событие и экономия.
+
+Запуск: python -m benchmarks.bench_upsert --events 2000 [--database-url postgresql://...]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+async def legacy_write(database, warehouse_states, movements, number, start):
+    """Прежняя логика: чтение строки и отдельная запись для каждой таблицы"""
+    from sqlalchemy import select
+
+    warehouse_id, product_id = f"WH-{number % 10}", f"PROD-{number % 100}"
+    record_id = f"{warehouse_id}:{product_id}"
+    state = await database.fetch_one(select(warehouse_states).where(warehouse_states.c.id == record_id))
+    if state:
+        await database.execute(warehouse_states.update().where(warehouse_states.c.id == record_id).values(quantity=number))
+    else:
+        await database.execute(warehouse_states.insert().values(
+            id=record_id, warehouse_id=warehouse_id, product_id=product_id, quantity=number
+        ))
+
+    movement_id = f"MOV-{number // 2}"
+    movement = await database.fetch_one(select(movements).where(movements.c.movement_id == movement_id))
+    if number % 2 == 0:
+        values = {"source_warehouse": warehouse_id, "departure_time": start, "departure_quantity": 10}
+    else:
+        values = {"destination_warehouse": warehouse_id, "arrival_time": start + timedelta(hours=1), "arrival_quantity": 9}
+    if movement:
+        if movement["departure_time"] and "arrival_time" in values:
+            values["time_difference_seconds"] = (values["arrival_time"] - movement["departure_time"]).total_seconds()
+            values["quantity_difference"] = values["arrival_quantity"] - movement["departure_quantity"]
+        await database.execute(movements.update().where(movements.c.movement_id == movement_id).values(**values))
+    else:
+        await database.execute(movements.insert().values(
+            movement_id=movement_id, partition_time=start, product_id=product_id, **values
+        ))
+
+
+async def upsert_write(number, start):
+    from app.services.warehouse_services import (
+        update_warehouse_state, update_movement_departure, update_movement_arrival
+    )
+
+    warehouse_id, product_id = f"WH-{number % 10}", f"PROD-{number % 100}"
+    await update_warehouse_state(warehouse_id, product_id, number)
+    movement_id = f"MOV-{number // 2}"
+    if number % 2 == 0:
+        await update_movement_departure(movement_id, warehouse_id, product_id, start, 10)
+    else:
+        await update_movement_arrival(movement_id, warehouse_id, product_id, start + timedelta(hours=1), 9)
+
+
+async def run(events):
+    from app.models.database import database, warehouse_states, movements, movement_keys
+
+    start = datetime(2025, 2, 18, 12, 0)
+    await database.connect()
+    results = {}
+    for name in ("SELECT + запись", "UPSERT"):
+        await database.execute(warehouse_states.delete())
+        await database.execute(movements.delete())
+        await database.execute(movement_keys.delete())
+        started = time.perf_counter()
+        for number in range(events):
+            if name == "UPSERT":
+                await upsert_write(number, start)
+            else:
+                await legacy_write(database, warehouse_states, movements, number, start)
+        results[name] = (time.perf_counter() - started) / events
+    await database.disconnect()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    from app.models.database import engine, metadata
+    metadata.create_all(engine)
+
+    results = asyncio.run(run(args.events))
+    legacy, upsert = results["SELECT + запись"], results["UPSERT"]
+    print(f"Событий: {args.events}, БД: {os.environ['DATABASE_URL']}")
+    for name, latency in results.items():
+        print(f"{name:>16}: {latency * 1000:8.3f} мс/событие")
+    print(f"{'экономия':>16}: {(legacy - upsert) * 1000:8.3f} мс/событие ({(1 - upsert / legacy) * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
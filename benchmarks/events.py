@@ -0,0 +1,92 @@
+"""
+Генератор потока событий отправки/приемки в формате KafkaMessage.
+
+Поток детерминирован по seed, поэтому его можно воспроизвести или сохранить в
+JSONL и прогнать повторно. Популярность складов и товаров распределена по Ципфу
+(skew=0 — равномерно, чем больше skew, тем сильнее «горячие» ключи).
+"""
+import itertools
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+
+def _zipf_cum_weights(size: int, skew: float) -> List[float]:
+    return list(itertools.accumulate(1.0 / (rank ** skew) for rank in range(1, size + 1)))
+
+
+def make_event(movement_id, warehouse_id, event, quantity, product_id, timestamp) -> Dict:
+    return {
+        "id": f"{movement_id}:{event}",
+        "source": warehouse_id,
+        "specversion": "1.0",
+        "type": "ru.retail.warehouses.movement",
+        "datacontenttype": "application/json",
+        "dataschema": "ru.retail.warehouses.movement.v1.0",
+        "time": int(timestamp.timestamp() * 1000),
+        "subject": f"{warehouse_id}:{event.upper()}",
+        "destination": "ru.retail.warehouses",
+        "data": {
+            "movement_id": movement_id,
+            "warehouse_id": warehouse_id,
+            "timestamp": timestamp.isoformat(),
+            "event": event,
+            "product_id": product_id,
+            "quantity": quantity,
+        },
+    }
+
+
+def generate_events(movements_count: int, warehouses: int, products: int, skew: float = 0.0,
+                    out_of_order: float = 0.0, lost_quantity: float = 0.05, seed: int = 42) -> List[Dict]:
+    """
+    Для каждого перемещения — отправка и приемка. Доля out_of_order приемок приходит
+    раньше отправки, доля lost_quantity приемок теряет часть товара в пути.
+    """
+    rnd = random.Random(seed)
+    warehouse_weights = _zipf_cum_weights(warehouses, skew)
+    product_weights = _zipf_cum_weights(products, skew)
+    start = datetime(2025, 2, 18, tzinfo=timezone.utc)
+    events = []
+
+    for number in range(movements_count):
+        movement_id = f"MOV-{number}"
+        product = rnd.choices(range(products), cum_weights=product_weights)[0]
+        source = rnd.choices(range(warehouses), cum_weights=warehouse_weights)[0]
+        destination = source
+        while warehouses > 1 and destination == source:
+            destination = rnd.choices(range(warehouses), cum_weights=warehouse_weights)[0]
+        quantity = rnd.randint(1, 20)
+        arrived = quantity - rnd.randint(1, quantity) if rnd.random() < lost_quantity else quantity
+        departure_time = start + timedelta(seconds=number)
+        arrival_time = departure_time + timedelta(minutes=rnd.randint(10, 600))
+
+        pair = [
+            make_event(movement_id, f"WH-{source}", "departure", quantity, f"PROD-{product}", departure_time),
+            make_event(movement_id, f"WH-{destination}", "arrival", arrived, f"PROD-{product}", arrival_time),
+        ]
+        if rnd.random() < out_of_order:
+            pair.reverse()
+        events.extend(pair)
+
+    return events
+
+
+def initial_stock(warehouses: int, products: int, quantity: int = 10 ** 6) -> List[Dict]:
+    """Начальные остатки с запасом, чтобы отправки не отклонялись"""
+    return [
+        {"id": f"WH-{w}:PROD-{p}", "warehouse_id": f"WH-{w}", "product_id": f"PROD-{p}", "quantity": quantity}
+        for w in range(warehouses) for p in range(products)
+    ]
+
+
+def save_events(path: str, events: List[Dict]):
+    with open(path, "w", encoding="utf-8") as file:
+        for event in events:
+            file.write(json.dumps(event) + "\n")
+
+
+def load_events(path: str) -> List[Dict]:
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
@@ -0,0 +1,39 @@
+"""In-memory замена KafkaConsumer для бенчмарков и офлайн-прогонов"""
+import json
+from collections import namedtuple
+
+from kafka.partitioner.default import murmur2
+
+Record = namedtuple("Record", ["offset", "value"])
+
+
+class InMemoryKafkaConsumer:
+    """
+    Отдает заранее подготовленные значения как байты JSON, как настоящий брокер,
+    через poll/commit. Когда записи заканчиваются, останавливает сервис.
+    """
+
+    def __init__(self, service, values):
+        self.service = service
+        self.records = [Record(offset, json.dumps(value).encode()) for offset, value in enumerate(values)]
+        self.position = 0
+        self.committed = 0
+
+    def poll(self, timeout_ms=0, max_records=500):
+        if self.position >= len(self.records):
+            self.service.should_stop = True
+            return {}
+        chunk = self.records[self.position:self.position + max_records]
+        self.position += len(chunk)
+        return {"partition-0": chunk}
+
+    def commit(self):
+        self.committed = self.position
+
+    def close(self, autocommit=True):
+        pass
+
+
+def partition_for(key: str, partitions: int) -> int:
+    """Партиция, которую выберет стандартный партиционер Kafka для ключа сообщения"""
+    return (murmur2(key.encode()) & 0x7fffffff) % partitions
@@ -0,0 +1,169 @@
+"""
+Воспроизводимый нагрузочный прогон: поток событий через Kafka-потребитель и
+конкурентные клиенты к API поверх той же базы.
+
+1. Генерирует (или читает из --events-file) поток событий KafkaMessage с заданным
+   числом складов/товаров и перекосом популярности (--skew).
+2. Прогоняет его через KafkaConsumerService с in-memory брокером в
+   последовательном и пакетном режимах, измеряя событий/с.
+3. Поднимает uvicorn и нагружает GET-ручки остатков и перемещений на нескольких
+   уровнях конкурентности: p50/p95/p99 и RPS. Ключи запросов берутся из того же
+   потока, поэтому «горячие» склады и товары горячие и при чтении.
+4. Пишет results.json и SVG-графики задержек и RPS от нагрузки в --report-dir.
+
+Работает офлайн на временной SQLite; --database-url позволяет прогнать то же на PostgreSQL.
+
+Запуск: python -m benchmarks.load_suite --movements 2000 --skew 1.1 --levels 1,10,50
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.bench_api_load import free_port, start_server
+from benchmarks.bench_consumer import run_mode
+from benchmarks.events import generate_events, load_events, save_events
+from benchmarks.report import latency_summary, render_svg
+
+
+def request_paths(events):
+    """Пути GET-запросов с тем же распределением ключей, что и в потоке событий"""
+    paths = []
+    for event in events:
+        data = event["data"]
+        paths.append(f"/warehouses/{data['warehouse_id']}/products/{data['product_id']}")
+        paths.append(f"/movements/{data['movement_id']}")
+    return paths
+
+
+async def drive(base_url, concurrency, requests, paths, seed):
+    rnd = random.Random(seed)
+    latencies = []
+    errors = 0
+
+    async def client_worker(client, count):
+        nonlocal errors
+        for _ in range(count):
+            started = time.perf_counter()
+            response = await client.get(rnd.choice(paths))
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        per_worker = max(1, requests // concurrency)
+        await asyncio.gather(*(client_worker(client, per_worker) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    summary = latency_summary(latencies, elapsed)
+    summary["errors"] = errors
+    return summary
+
+
+def consumer_phase(events, args):
+    results = {}
+    for name, batch_mode in (("sequential", False), ("batch", True)):
+        elapsed = run_mode(events, args.warehouses, args.products, batch_mode, args.batch_size, args.concurrency)
+        results[name] = {"seconds": elapsed, "events_per_second": len(events) / elapsed}
+        print(f"потребитель {name:>10}: {elapsed:8.2f} с, {len(events) / elapsed:10.1f} событий/с")
+    return results
+
+
+def api_phase(events, args, database_url):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    if not args.with_cache:
+        env["CACHE_MAX_SIZE"] = "0"
+    paths = request_paths(events)
+    port = free_port()
+    server = start_server(env, port)
+    results = {}
+    print(f"{'конк.':>6} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'RPS':>9} {'ошибки':>7}")
+    try:
+        for concurrency in args.levels:
+            summary = asyncio.run(drive(f"http://127.0.0.1:{port}", concurrency, args.requests, paths, args.seed))
+            results[concurrency] = summary
+            print(f"{concurrency:>6} {summary['p50']:>9.2f} {summary['p95']:>9.2f} {summary['p99']:>9.2f} "
+                  f"{summary['rps']:>9.1f} {summary['errors']:>7}")
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+
+def write_report(report_dir, results):
+    os.makedirs(report_dir, exist_ok=True)
+    with open(os.path.join(report_dir, "results.json"), "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2, ensure_ascii=False)
+
+    api = results["api"]
+    latency = {
+        name: [(concurrency, summary[name]) for concurrency, summary in api.items()]
+        for name in ("p50", "p95", "p99")
+    }
+    throughput = {"RPS": [(concurrency, summary["rps"]) for concurrency, summary in api.items()]}
+    for filename, title, series, y_label in (
+        ("latency.svg", "Задержка GET от конкурентности", latency, "мс"),
+        ("throughput.svg", "Пропускная способность GET", throughput, "запросов/с"),
+    ):
+        with open(os.path.join(report_dir, filename), "w", encoding="utf-8") as file:
+            file.write(render_svg(title, "конкурентные клиенты", series, y_label))
+    print(f"Отчет: {report_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movements", type=int, default=2000)
+    parser.add_argument("--warehouses", type=int, default=20)
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--skew", type=float, default=1.0, help="показатель Ципфа; 0 — равномерно")
+    parser.add_argument("--out-of-order", type=float, default=0.1, help="доля приемок раньше отправок")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--events-file", default=None, help="прогнать сохраненный поток вместо генерации")
+    parser.add_argument("--save-events", default=None, help="сохранить сгенерированный поток в JSONL")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--levels", default="1,10,50")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--with-cache", action="store_true", help="не отключать кэш чтения")
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--report-dir", default="benchmark-report")
+    args = parser.parse_args()
+    args.levels = [int(level) for level in args.levels.split(",")]
+
+    database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    os.environ["DATABASE_URL"] = database_url
+
+    import logging
+    logging.disable(logging.WARNING)
+    from app.models.database import engine, metadata
+    metadata.create_all(engine)
+
+    if args.events_file:
+        events = load_events(args.events_file)
+        # Начальные остатки заводятся по диапазонам WH-0..N, PROD-0..M из самого потока
+        args.warehouses = 1 + max(int(event["data"]["warehouse_id"].split("-")[1]) for event in events)
+        args.products = 1 + max(int(event["data"]["product_id"].split("-")[1]) for event in events)
+    else:
+        events = generate_events(args.movements, args.warehouses, args.products, args.skew, args.out_of_order,
+                                 seed=args.seed)
+        if args.save_events:
+            save_events(args.save_events, events)
+    print(f"Событий: {len(events)}, БД: {database_url}")
+
+    results = {
+        "parameters": {key: value for key, value in vars(args).items() if key != "database_url"},
+        "consumer": consumer_phase(events, args),
+        "api": api_phase(events, args, database_url),
+    }
+    write_report(args.report_dir, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Перцентили задержек и простой SVG-график без внешних зависимостей"""
+import statistics
+from typing import Dict, List, Sequence, Tuple
+
+
+def latency_summary(latencies: Sequence[float], elapsed: float) -> Dict[str, float]:
+    """p50/p95/p99 в миллисекундах и пропускная способность"""
+    if len(latencies) < 2:
+        value = latencies[0] * 1000 if latencies else 0.0
+        return {"p50": value, "p95": value, "p99": value, "rps": len(latencies) / elapsed if elapsed else 0.0}
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "p50": quantiles[49] * 1000,
+        "p95": quantiles[94] * 1000,
+        "p99": quantiles[98] * 1000,
+        "rps": len(latencies) / elapsed,
+    }
+
+
+def render_svg(title: str, x_label: str, series: Dict[str, List[Tuple[float, float]]], y_label: str,
+               width: int = 640, height: int = 360) -> str:
+    """Линейный график: series — имя линии -> список точек (x, y)"""
+    colors = ["#1f77b4", "#d62728", "#2ca02c", "#ff7f0e", "#9467bd", "#8c564b"]
+    left, right, top, bottom = 60, 20, 40, 50
+    points = [point for line in series.values() for point in line]
+    max_x = max((x for x, _ in points), default=1) or 1
+    max_y = max((y for _, y in points), default=1) or 1
+
+    def scale(x, y):
+        return (left + x / max_x * (width - left - right),
+                height - bottom - y / max_y * (height - top - bottom))
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="sans-serif" font-size="12">',
+        f'<text x="{width / 2}" y="20" text-anchor="middle" font-size="14">{title}</text>',
+        f'<line x1="{left}" y1="{height - bottom}" x2="{width - right}" y2="{height - bottom}" stroke="black"/>',
+        f'<line x1="{left}" y1="{top}" x2="{left}" y2="{height - bottom}" stroke="black"/>',
+        f'<text x="{width / 2}" y="{height - 10}" text-anchor="middle">{x_label}</text>',
+        f'<text x="15" y="{height / 2}" transform="rotate(-90 15 {height / 2})" text-anchor="middle">{y_label}</text>',
+    ]
+    for tick in range(5):
+        y_value = max_y * tick / 4
+        _, y = scale(0, y_value)
+        parts.append(f'<text x="{left - 5}" y="{y + 4}" text-anchor="end">{y_value:.4g}</text>')
+    for x_value in sorted({x for x, _ in points}):
+        x, _ = scale(x_value, 0)
+        parts.append(f'<text x="{x}" y="{height - bottom + 15}" text-anchor="middle">{x_value:g}</text>')
+
+    for index, (name, line) in enumerate(series.items()):
+        color = colors[index % len(colors)]
+        path = " ".join(f"{x:.1f},{y:.1f}" for x, y in (scale(*point) for point in sorted(line)))
+        parts.append(f'<polyline fill="none" stroke="{color}" stroke-width="2" points="{path}"/>')
+        parts.append(f'<text x="{width - right - 120}" y="{top + 15 * index}" fill="{color}">{name}</text>')
+
+    parts.append("</svg>")
+    return "\n".join(parts)
@@ -0,0 +1,43 @@
+"""Non-negative quantity check on warehouse_states
+
+Revision ID: 5b3e8c2d9f41
+Revises: 1771908923cc
+Create Date: 2026-10-18 10:14:05.118204
+
+"""
+import logging
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b3e8c2d9f41'
+down_revision: Union[str, None] = '1771908923cc'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Остатки, ушедшие в минус до появления ограничения, обнуляем; прежние значения
+    # остаются в логе миграции для сверки
+    negative = op.get_bind().execute(sa.text(
+        'SELECT warehouse_id, product_id, quantity FROM warehouse_states WHERE quantity < 0 '
+        'ORDER BY warehouse_id, product_id'
+    )).fetchall()
+    for warehouse_id, product_id, quantity in negative:
+        logger.warning('Отрицательный остаток обнулен: warehouse_id=%s, product_id=%s, quantity=%s',
+                       warehouse_id, product_id, quantity)
+    op.execute("UPDATE warehouse_states SET quantity = 0 WHERE quantity < 0")
+    with op.batch_alter_table('warehouse_states') as batch_op:
+        batch_op.create_check_constraint('ck_warehouse_states_quantity_non_negative', 'quantity >= 0')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('warehouse_states') as batch_op:
+        batch_op.drop_constraint('ck_warehouse_states_quantity_non_negative', type_='check')
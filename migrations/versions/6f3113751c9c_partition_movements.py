@@ -0,0 +1,125 @@
+"""Partition movements by month and add movement_keys lookup table
+
+Revision ID: 6f3113751c9c
+Revises: c9f2e5a4d710
+Create Date: 2026-10-18 18:04:41.260917
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6f3113751c9c'
+down_revision: Union[str, None] = 'c9f2e5a4d710'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MOVEMENT_COLUMNS = (
+    'movement_id, source_warehouse, destination_warehouse, product_id, departure_time, arrival_time, '
+    'time_difference_seconds, departure_quantity, arrival_quantity, quantity_difference'
+)
+
+
+def _movement_columns():
+    return [
+        sa.Column('source_warehouse', sa.String(), nullable=True),
+        sa.Column('destination_warehouse', sa.String(), nullable=True),
+        sa.Column('product_id', sa.String(), nullable=True),
+        sa.Column('departure_time', sa.DateTime(), nullable=True),
+        sa.Column('arrival_time', sa.DateTime(), nullable=True),
+        sa.Column('time_difference_seconds', sa.Float(), nullable=True),
+        sa.Column('departure_quantity', sa.Integer(), nullable=True),
+        sa.Column('arrival_quantity', sa.Integer(), nullable=True),
+        sa.Column('quantity_difference', sa.Integer(), nullable=True),
+    ]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Существующие строки не переписываются: их partition_time — время миграции
+    # (в PostgreSQL ADD COLUMN с постоянным DEFAULT не перезаписывает таблицу)
+    migrated_at = datetime.utcnow().replace(microsecond=0)
+    next_month = datetime(migrated_at.year + migrated_at.month // 12, migrated_at.month % 12 + 1, 1)
+
+    op.create_table('movement_keys',
+    sa.Column('movement_id', sa.String(), nullable=False),
+    sa.Column('partition_time', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('movement_id')
+    )
+
+    if op.get_bind().dialect.name != 'postgresql':
+        op.add_column('movements', sa.Column(
+            'partition_time', sa.DateTime(), nullable=False, server_default=sa.text(f"'{migrated_at}'")
+        ))
+        with op.batch_alter_table('movements', recreate='always') as batch_op:
+            batch_op.alter_column('partition_time', server_default=None)
+            batch_op.create_primary_key('pk_movements', ['movement_id', 'partition_time'])
+        op.execute('INSERT INTO movement_keys (movement_id, partition_time) SELECT movement_id, partition_time FROM movements')
+        return
+
+    # Прежняя таблица без копирования становится секцией movements_legacy [MINVALUE, next_month)
+    op.rename_table('movements', 'movements_legacy')
+    op.execute('ALTER INDEX ix_movements_product_departure RENAME TO movements_legacy_product_departure')
+    op.execute('ALTER INDEX ix_movements_departure_time RENAME TO movements_legacy_departure_time')
+    op.execute(f"ALTER TABLE movements_legacy ADD COLUMN partition_time TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT '{migrated_at}'")
+    op.execute('ALTER TABLE movements_legacy ALTER COLUMN partition_time DROP DEFAULT')
+    op.execute('INSERT INTO movement_keys (movement_id, partition_time) SELECT movement_id, partition_time FROM movements_legacy')
+    op.execute('ALTER TABLE movements_legacy DROP CONSTRAINT movements_pkey')
+    op.execute('ALTER TABLE movements_legacy ADD CONSTRAINT movements_legacy_pkey PRIMARY KEY (movement_id, partition_time)')
+
+    op.create_table('movements',
+    sa.Column('movement_id', sa.String(), nullable=False),
+    sa.Column('partition_time', sa.DateTime(), nullable=False),
+    *_movement_columns(),
+    sa.PrimaryKeyConstraint('movement_id', 'partition_time'),
+    postgresql_partition_by='RANGE (partition_time)'
+    )
+    op.create_index('ix_movements_product_departure', 'movements', ['product_id', 'departure_time', 'movement_id'], unique=False)
+    op.create_index('ix_movements_departure_time', 'movements', ['departure_time'], unique=False)
+    # ATTACH PARTITION проверяет границу секции полным просмотром таблицы под ACCESS EXCLUSIVE.
+    # Проверенный заранее CHECK доказывает границу, и этот просмотр пропускается; VALIDATE
+    # просматривает таблицу под SHARE UPDATE EXCLUSIVE. Индексы movements_legacy совпадают
+    # с индексами movements и присоединяются без перестроения
+    op.execute(
+        'ALTER TABLE movements_legacy ADD CONSTRAINT movements_legacy_partition_bound '
+        f"CHECK (partition_time < '{next_month}') NOT VALID"
+    )
+    op.execute('ALTER TABLE movements_legacy VALIDATE CONSTRAINT movements_legacy_partition_bound')
+    op.execute(f"ALTER TABLE movements ATTACH PARTITION movements_legacy FOR VALUES FROM (MINVALUE) TO ('{next_month}')")
+    # После присоединения граница задана самой секцией
+    op.execute('ALTER TABLE movements_legacy DROP CONSTRAINT movements_legacy_partition_bound')
+    op.execute('CREATE TABLE movements_default PARTITION OF movements DEFAULT')
+    # Месячные секции начиная с next_month создает python -m app.movement_partitions maintain
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        with op.batch_alter_table('movements', recreate='always') as batch_op:
+            batch_op.create_primary_key('pk_movements', ['movement_id'])
+            batch_op.drop_column('partition_time')
+        op.drop_table('movement_keys')
+        return
+
+    op.rename_table('movements', 'movements_partitioned')
+    op.execute('ALTER TABLE movements_partitioned RENAME CONSTRAINT movements_pkey TO movements_partitioned_pkey')
+    op.execute('ALTER INDEX ix_movements_product_departure RENAME TO movements_partitioned_product_departure')
+    op.execute('ALTER INDEX ix_movements_departure_time RENAME TO movements_partitioned_departure_time')
+    op.create_table('movements',
+    sa.Column('movement_id', sa.String(), nullable=False),
+    *_movement_columns(),
+    sa.PrimaryKeyConstraint('movement_id')
+    )
+    # Отсоединенные (архивные) секции в перенос не попадают
+    op.execute(
+        f'INSERT INTO movements ({MOVEMENT_COLUMNS}) SELECT DISTINCT ON (movement_id) {MOVEMENT_COLUMNS} '
+        'FROM movements_partitioned ORDER BY movement_id, partition_time DESC'
+    )
+    op.execute('DROP TABLE movements_partitioned')
+    op.create_index('ix_movements_product_departure', 'movements', ['product_id', 'departure_time', 'movement_id'], unique=False)
+    op.create_index('ix_movements_departure_time', 'movements', ['departure_time'], unique=False)
+    op.drop_table('movement_keys')
@@ -0,0 +1,28 @@
+"""Index on movement departure time for exports
+
+Revision ID: a3e6f08d5b21
+Revises: d41c7a2e9b83
+Create Date: 2026-10-18 16:21:05.447390
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3e6f08d5b21'
+down_revision: Union[str, None] = 'd41c7a2e9b83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_movements_departure_time', 'movements', ['departure_time'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_movements_departure_time', table_name='movements')
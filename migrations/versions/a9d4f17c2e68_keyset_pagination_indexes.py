@@ -0,0 +1,35 @@
+"""Composite indexes for keyset pagination
+
+Revision ID: a9d4f17c2e68
+Revises: 5b3e8c2d9f41
+Create Date: 2026-10-18 11:02:47.530912
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9d4f17c2e68'
+down_revision: Union[str, None] = '5b3e8c2d9f41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ux_warehouse_states_warehouse_product', 'warehouse_states', ['warehouse_id', 'product_id'], unique=True)
+    op.create_index('ix_movements_product_departure', 'movements', ['product_id', 'departure_time', 'movement_id'], unique=False)
+    # Одноколоночные индексы стали префиксами составных и только замедляют запись
+    op.drop_index('ix_warehouse_states_warehouse_id', table_name='warehouse_states')
+    op.drop_index('ix_movements_product_id', table_name='movements')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index('ix_movements_product_id', 'movements', ['product_id'], unique=False)
+    op.create_index('ix_warehouse_states_warehouse_id', 'warehouse_states', ['warehouse_id'], unique=False)
+    op.drop_index('ix_movements_product_departure', table_name='movements')
+    op.drop_index('ux_warehouse_states_warehouse_product', table_name='warehouse_states')
@@ -0,0 +1,58 @@
+"""Stock events ledger and stock snapshots
+
+Revision ID: b58e0d3f7c12
+Revises: f2d9b61c8a37
+Create Date: 2026-10-18 15:03:41.870254
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b58e0d3f7c12'
+down_revision: Union[str, None] = 'f2d9b61c8a37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('stock_events',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), autoincrement=True, nullable=False),
+    sa.Column('event_id', sa.String(), nullable=False),
+    sa.Column('movement_id', sa.String(), nullable=False),
+    sa.Column('warehouse_id', sa.String(), nullable=False),
+    sa.Column('product_id', sa.String(), nullable=False),
+    sa.Column('delta', sa.Integer(), nullable=False),
+    sa.Column('occurred_at', sa.DateTime(), nullable=False),
+    sa.Column('recorded_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_stock_events_recorded_at'), 'stock_events', ['recorded_at'], unique=False)
+    op.create_index('ix_stock_events_warehouse_product', 'stock_events', ['warehouse_id', 'product_id', 'id'], unique=False)
+    op.create_table('stock_snapshots',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('last_event_id', sa.BigInteger(), nullable=False),
+    sa.Column('taken_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('stock_snapshot_rows',
+    sa.Column('snapshot_id', sa.Integer(), nullable=False),
+    sa.Column('warehouse_id', sa.String(), nullable=False),
+    sa.Column('product_id', sa.String(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['snapshot_id'], ['stock_snapshots.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('snapshot_id', 'warehouse_id', 'product_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('stock_snapshot_rows')
+    op.drop_table('stock_snapshots')
+    op.drop_index('ix_stock_events_warehouse_product', table_name='stock_events')
+    op.drop_index(op.f('ix_stock_events_recorded_at'), table_name='stock_events')
+    op.drop_table('stock_events')
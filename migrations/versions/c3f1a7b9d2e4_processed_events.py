@@ -0,0 +1,34 @@
+"""Processed events table for idempotent consumption
+
+Revision ID: c3f1a7b9d2e4
+Revises: a9d4f17c2e68
+Create Date: 2026-10-18 12:41:09.218734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3f1a7b9d2e4'
+down_revision: Union[str, None] = 'a9d4f17c2e68'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('processed_events',
+    sa.Column('event_id', sa.String(), nullable=False),
+    sa.Column('processed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('event_id')
+    )
+    op.create_index(op.f('ix_processed_events_processed_at'), 'processed_events', ['processed_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_processed_events_processed_at'), table_name='processed_events')
+    op.drop_table('processed_events')
@@ -0,0 +1,45 @@
+"""Transit-time rollups per route and per product
+
+Revision ID: c9f2e5a4d710
+Revises: a3e6f08d5b21
+Create Date: 2026-10-18 16:58:12.730846
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9f2e5a4d710'
+down_revision: Union[str, None] = 'a3e6f08d5b21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('route_transit_buckets',
+    sa.Column('source_warehouse', sa.String(), nullable=False),
+    sa.Column('destination_warehouse', sa.String(), nullable=False),
+    sa.Column('bucket', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('movements', sa.Integer(), nullable=False),
+    sa.Column('transit_seconds_sum', sa.Float(), nullable=False),
+    sa.Column('quantity_difference_sum', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('source_warehouse', 'destination_warehouse', 'bucket')
+    )
+    op.create_table('product_transit_buckets',
+    sa.Column('product_id', sa.String(), nullable=False),
+    sa.Column('bucket', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('movements', sa.Integer(), nullable=False),
+    sa.Column('transit_seconds_sum', sa.Float(), nullable=False),
+    sa.Column('quantity_difference_sum', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('product_id', 'bucket')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('product_transit_buckets')
+    op.drop_table('route_transit_buckets')
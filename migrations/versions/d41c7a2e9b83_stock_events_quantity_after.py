@@ -0,0 +1,33 @@
+"""Running quantity and time index on stock events
+
+Revision ID: d41c7a2e9b83
+Revises: b58e0d3f7c12
+Create Date: 2026-10-18 15:47:22.613085
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41c7a2e9b83'
+down_revision: Union[str, None] = 'b58e0d3f7c12'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('stock_events', sa.Column('quantity_after', sa.Integer(), nullable=True))
+    op.create_index('ix_stock_events_key_recorded', 'stock_events', ['warehouse_id', 'product_id', 'recorded_at', 'id'], unique=False)
+    # Восстановление склада идет по первичному ключу от позиции снимка; старый индекс только замедлял запись
+    op.drop_index('ix_stock_events_warehouse_product', table_name='stock_events')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index('ix_stock_events_warehouse_product', 'stock_events', ['warehouse_id', 'product_id', 'id'], unique=False)
+    op.drop_index('ix_stock_events_key_recorded', table_name='stock_events')
+    op.drop_column('stock_events', 'quantity_after')
@@ -0,0 +1,41 @@
+"""Dead letter table for undecodable and failed Kafka records
+
+Revision ID: e7b2c4a91f05
+Revises: c3f1a7b9d2e4
+Create Date: 2026-10-18 13:27:44.106392
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7b2c4a91f05'
+down_revision: Union[str, None] = 'c3f1a7b9d2e4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('dead_letter_events',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('event_id', sa.String(), nullable=True),
+    sa.Column('reason', sa.String(), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('payload', sa.LargeBinary(), nullable=False),
+    sa.Column('kafka_topic', sa.String(), nullable=True),
+    sa.Column('kafka_partition', sa.Integer(), nullable=True),
+    sa.Column('kafka_offset', sa.BigInteger(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_dead_letter_events_event_id'), 'dead_letter_events', ['event_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_dead_letter_events_event_id'), table_name='dead_letter_events')
+    op.drop_table('dead_letter_events')
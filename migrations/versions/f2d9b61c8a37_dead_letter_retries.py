@@ -0,0 +1,34 @@
+"""Retry state for dead letter events
+
+Revision ID: f2d9b61c8a37
+Revises: e7b2c4a91f05
+Create Date: 2026-10-18 14:12:09.538217
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2d9b61c8a37'
+down_revision: Union[str, None] = 'e7b2c4a91f05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('dead_letter_events', sa.Column('status', sa.String(), server_default='parked', nullable=False))
+    op.add_column('dead_letter_events', sa.Column('attempts', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('dead_letter_events', sa.Column('next_attempt_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_dead_letter_events_status_next_attempt', 'dead_letter_events', ['status', 'next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_dead_letter_events_status_next_attempt', table_name='dead_letter_events')
+    op.drop_column('dead_letter_events', 'next_attempt_at')
+    op.drop_column('dead_letter_events', 'attempts')
+    op.drop_column('dead_letter_events', 'status')
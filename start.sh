@@ -3,5 +3,11 @@ echo "Waiting for PostgreSQL to start..."
 sleep 5
 echo "Running migrations..."
 alembic upgrade head
+echo "Maintaining movements partitions..."
+python -m app.movement_partitions maintain
+if [ "$SEED_DEMO_DATA" = "true" ]; then
+    echo "Seeding demo data..."
+    python -m app.seed
+fi
 echo "Starting application..."
 exec uvicorn app.main:app --host 0.0.0.0 --port 8000 
\ No newline at end of file
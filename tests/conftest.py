@@ -0,0 +1,48 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.models.database import (
+    database, engine, metadata, warehouse_states, movements, movement_keys, processed_events, dead_letter_events,
+    stock_events, stock_snapshots, stock_snapshot_rows, route_transit_buckets, product_transit_buckets
+)
+from app.services.cache import warehouse_state_cache, movement_cache
+from app.services.idempotency import processed_event_cache
+
+
+@pytest.fixture
+def run():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    def run_sync(coro):
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    metadata.create_all(engine)
+    run_sync(database.connect())
+    run_sync(database.execute(warehouse_states.delete()))
+    run_sync(database.execute(movements.delete()))
+    run_sync(database.execute(movement_keys.delete()))
+    run_sync(database.execute(processed_events.delete()))
+    run_sync(database.execute(dead_letter_events.delete()))
+    run_sync(database.execute(stock_events.delete()))
+    run_sync(database.execute(stock_snapshot_rows.delete()))
+    run_sync(database.execute(stock_snapshots.delete()))
+    run_sync(database.execute(route_transit_buckets.delete()))
+    run_sync(database.execute(product_transit_buckets.delete()))
+    run_sync(database.execute(
+        warehouse_states.insert().values(id="WH-1:PROD-1", warehouse_id="WH-1", product_id="PROD-1", quantity=100)
+    ))
+    warehouse_state_cache.clear()
+    movement_cache.clear()
+    processed_event_cache.clear()
+    run_sync.loop = loop
+
+    yield run_sync
+
+    run_sync(database.disconnect())
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
@@ -0,0 +1,97 @@
+import math
+import random
+from datetime import timedelta
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.models.database import database, route_transit_buckets
+from app.models.schemas import KafkaMessage
+from app.services import sketch
+from app.services.analytics import rebuild_transit_rollups, route_stats
+from app.services.stock_buffer import StockWriteBuffer
+from app.services.warehouse_services import process_message
+from tests.test_kafka_consumer import DEPARTURE_TIME, make_event
+
+client = TestClient(app)
+
+
+def test_sketch_quantiles_within_relative_accuracy():
+    """Квантили по корзинам отличаются от точных не больше заданной относительной погрешности"""
+    values = sorted(random.Random(7).lognormvariate(8, 1) for _ in range(10000))
+    buckets = {}
+    for value in values:
+        bucket = sketch.bucket_of(value)
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+
+    for q in (0.5, 0.95, 0.99):
+        exact = values[math.ceil(q * len(values)) - 1]
+        assert abs(sketch.quantile(buckets.items(), q) - exact) <= exact * sketch.RELATIVE_ACCURACY
+
+
+def apply_movement(run, movement_id, destination, hours, sent, received, arrival_first=False):
+    events = [
+        make_event(movement_id, "WH-1", "departure", sent),
+        make_event(movement_id, destination, "arrival", received, timestamp=DEPARTURE_TIME + timedelta(hours=hours)),
+    ]
+    if arrival_first:
+        events.reverse()
+    for event in events:
+        assert run(process_message(KafkaMessage(**event)))
+
+
+def test_routes_and_products_report_transit_stats(run):
+    """Перемещение учитывается один раз при любом порядке половин и при повторе события"""
+    apply_movement(run, "MOV-1", "WH-2", 1, 10, 10)
+    apply_movement(run, "MOV-2", "WH-2", 3, 10, 8, arrival_first=True)
+    apply_movement(run, "MOV-3", "WH-3", 2, 5, 5)
+    assert run(process_message(KafkaMessage(**make_event("MOV-1", "WH-1", "departure", 10))))
+
+    routes = client.get("/analytics/routes", params={"source": "WH-1"}).json()
+    assert [(route["destination_warehouse"], route["movements"], route["quantity_difference_sum"])
+            for route in routes] == [("WH-2", 2, -2), ("WH-3", 1, 0)]
+    assert routes[0]["transit_seconds_mean"] == 7200.0
+    assert abs(routes[0]["transit_seconds_p95"] - 10800) <= 10800 * sketch.RELATIVE_ACCURACY
+
+    products = client.get("/analytics/products").json()
+    assert [(product["product_id"], product["movements"]) for product in products] == [("PROD-1", 3)]
+    assert abs(products[0]["transit_seconds_p50"] - 7200) <= 7200 * sketch.RELATIVE_ACCURACY
+
+
+def test_corrected_half_of_completed_movement_is_not_counted_again(run):
+    """Половина с новым id события у завершенного перемещения не добавляет его в свертки повторно"""
+    apply_movement(run, "MOV-1", "WH-2", 1, 10, 10)
+    correction = {**make_event("MOV-1", "WH-2", "arrival", 9, timestamp=DEPARTURE_TIME + timedelta(hours=1)),
+                  "id": "MOV-1:arrival:correction"}
+    assert run(process_message(KafkaMessage(**correction)))
+
+    routes = client.get("/analytics/routes", params={"source": "WH-1"}).json()
+    assert [(route["movements"], route["quantity_difference_sum"]) for route in routes] == [(1, 0)]
+    products = client.get("/analytics/products").json()
+    assert [product["movements"] for product in products] == [1]
+
+
+def test_replay_after_lost_stock_buffer_is_not_counted_again(run, monkeypatch):
+    """Отложенная запись: повтор событий после сбоя до flush() не добавляет перемещение в свертки второй раз"""
+    def start_writer():
+        monkeypatch.setattr("app.services.warehouse_services.stock_buffer",
+                            StockWriteBuffer(enabled=True, interval=3600, max_events=10000))
+
+    start_writer()
+    apply_movement(run, "MOV-1", "WH-2", 1, 10, 10)
+    # Процесс упал до flush(): буфер потерян, события доставляются повторно
+    start_writer()
+    apply_movement(run, "MOV-1", "WH-2", 1, 10, 10)
+
+    routes = client.get("/analytics/routes", params={"source": "WH-1"}).json()
+    assert [route["movements"] for route in routes] == [1]
+
+
+def test_rebuild_matches_incremental_rollups(run):
+    apply_movement(run, "MOV-1", "WH-2", 1, 10, 9)
+    apply_movement(run, "MOV-2", "WH-2", 5, 10, 10)
+    incremental = run(route_stats())
+    run(database.execute(route_transit_buckets.delete()))
+
+    assert run(rebuild_transit_rollups()) == 2
+    assert run(route_stats()) == incremental
@@ -1,7 +1,7 @@
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
-from app.models.database import database, warehouse_states, movements
+from app.models.database import database, warehouse_states, movements, movement_keys
 from datetime import datetime, timedelta, timezone
 import asyncio
 
@@ -15,6 +15,7 @@ def setup_database():
 
         await database.execute(warehouse_states.delete())
         await database.execute(movements.delete())
+        await database.execute(movement_keys.delete())
 
         await database.execute(
             warehouse_states.insert().values(
@@ -31,6 +32,7 @@ def setup_database():
         await database.execute(
             movements.insert().values(
                 movement_id="MOV-1",
+                partition_time=departure_time,
                 source_warehouse="WH-1",
                 destination_warehouse="WH-2",
                 product_id="PROD-1",
@@ -42,6 +44,7 @@ def setup_database():
                 quantity_difference=0
             )
         )
+        await database.execute(movement_keys.insert().values(movement_id="MOV-1", partition_time=departure_time))
 
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Минимальная нагрузка: проверяется, что точка входа бенчмарка доходит до конца
+SMOKE_ARGS = {
+    "bench_consumer": ["--movements", "20", "--warehouses", "2", "--products", "2", "--batch-size", "10"],
+    "bench_consumer_scaling": [
+        "--workers", "1,2", "--partitions", "2", "--movements", "20",
+        "--warehouses", "2", "--products", "2", "--batch-size", "10",
+    ],
+    "bench_upsert": ["--events", "10"],
+    "bench_decode": ["--messages", "100"],
+    "bench_metrics": ["--iterations", "100"],
+    "bench_logging": ["--requests", "100"],
+    "bench_export": ["--rows", "100"],
+    "bench_as_of": ["--rows", "200", "--keys", "5", "--lookups", "10"],
+    "bench_movement_partitions": ["--sizes", "50,100", "--months", "2", "--events", "5", "--lookups", "5"],
+    "bench_startup": ["--runs", "1", "--no-consumer"],
+    "bench_api_load": ["--levels", "1", "--requests", "10", "--warehouses", "2", "--products", "2"],
+    "load_suite": [
+        "--movements", "20", "--warehouses", "2", "--products", "2",
+        "--levels", "1", "--requests", "10", "--batch-size", "10",
+    ],
+}
+
+
+@pytest.mark.parametrize("name", sorted(SMOKE_ARGS))
+def test_benchmark_entry_point(name, tmp_path):
+    """Бенчмарк запускается как python -m benchmarks.<name> и завершается без ошибки"""
+    args = list(SMOKE_ARGS[name])
+    if name == "load_suite":
+        args += ["--report-dir", str(tmp_path)]
+    # Бенчмарки создают свою временную базу SQLite, а не тестовую из окружения
+    env = {key: value for key, value in os.environ.items() if key != "DATABASE_URL"}
+
+    result = subprocess.run(
+        [sys.executable, "-m", f"benchmarks.{name}", *args],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=300,
+    )
+
+    assert result.returncode == 0, result.stderr[-2000:]
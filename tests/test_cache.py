@@ -0,0 +1,65 @@
+import time
+
+from app.models.database import SessionLocal, database, warehouse_states
+from app.services.cache import TTLCache, warehouse_state_cache
+from app.models.schemas import KafkaMessage
+from app.services.warehouse_services import (
+    apply_stock_delta, get_movement_info_sync, get_warehouse_state_sync, process_message
+)
+from tests.test_kafka_consumer import make_event
+
+
+def test_lru_eviction_and_counters():
+    """При переполнении вытесняется давно не читанный ключ"""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == (True, 1)
+    cache.set("c", 3)
+
+    assert cache.get("b") == (False, None)
+    assert cache.get("c") == (True, 3)
+    assert cache.stats() == {"hits": 2, "misses": 1, "evictions": 1, "size": 2}
+
+
+def test_ttl_expiry():
+    cache = TTLCache(maxsize=10, ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") == (False, None)
+
+
+def test_stale_fill_is_dropped_after_invalidate():
+    """Значение, прочитанное до инвалидации, не попадает в кэш"""
+    cache = TTLCache(maxsize=10, ttl=60)
+    generation = cache.generation("a")
+    cache.invalidate("a")
+    cache.set("a", "old", generation)
+    assert cache.get("a") == (False, None)
+
+
+def test_stock_delta_invalidates_cached_state(run):
+    """После применения события чтение возвращает новый остаток, а не закэшированный"""
+    db = SessionLocal()
+    try:
+        assert get_warehouse_state_sync(db, "WH-1", "PROD-1").quantity == 100
+        run(database.execute(
+            warehouse_states.update().where(warehouse_states.c.id == "WH-1:PROD-1").values(quantity=50)
+        ))
+        assert get_warehouse_state_sync(db, "WH-1", "PROD-1").quantity == 100
+
+        run(apply_stock_delta("WH-1", "PROD-1", -10))
+        assert get_warehouse_state_sync(db, "WH-1", "PROD-1").quantity == 40
+    finally:
+        db.close()
+    assert warehouse_state_cache.stats()["hits"] == 1
+
+
+def test_sync_movement_lookup_uses_partition_key(run):
+    """Синхронное чтение перемещения находит секцию через movement_keys"""
+    run(process_message(KafkaMessage(**make_event("MOV-1", "WH-1", "departure", 30))))
+    db = SessionLocal()
+    try:
+        assert get_movement_info_sync(db, "MOV-1").movement_id == "MOV-1"
+    finally:
+        db.close()
@@ -0,0 +1,67 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+
+from app.models.database import database
+from app.models.schemas import KafkaMessage
+from app.services.cache import movement_cache, warehouse_state_cache
+from app.services.change_notifications import ChangeNotifier, change_notifier
+from app.services.stock_stream import stock_hub
+from app.services.warehouse_services import process_message
+from tests.test_kafka_consumer import make_event
+
+
+def test_notification_invalidates_caches_and_feeds_stream(run):
+    """Уведомление другого процесса вытесняет кэш и доходит до подписчиков потока остатков"""
+    warehouse_state_cache.set(("WH-1", "PROD-1"), "stale")
+    movement_cache.set("MOV-1", "stale")
+    subscription = stock_hub.subscribe(warehouse_ids=["WH-1"])
+    try:
+        change_notifier.handle(json.dumps({
+            "stock": [["WH-1", "PROD-1", 70, "2025-02-18T12:00:00"]], "movements": ["MOV-1"]
+        }))
+
+        assert warehouse_state_cache.get(("WH-1", "PROD-1")) == (False, None)
+        assert movement_cache.get("MOV-1") == (False, None)
+        changes = run(subscription.next_changes(timeout=0.1))
+        assert [(change["quantity"], change["updated_at"]) for change in changes] == [(70, "2025-02-18T12:00:00")]
+    finally:
+        stock_hub.unsubscribe(subscription)
+
+    warehouse_state_cache.set(("WH-2", "PROD-1"), "stale")
+    change_notifier.handle(json.dumps({"reset": True}))
+    assert warehouse_state_cache.get(("WH-2", "PROD-1")) == (False, None)
+
+
+@pytest.mark.skipif(database.url.dialect != "postgresql", reason="LISTEN/NOTIFY есть только в PostgreSQL")
+def test_listener_receives_changes_after_commit(run, monkeypatch):
+    """Изменение, примененное писателем с включенными уведомлениями, доходит до слушателя после коммита"""
+    writer = ChangeNotifier("warehouse_changes")
+    writer.enable()
+    monkeypatch.setattr("app.services.warehouse_services.change_notifier", writer)
+    received = []
+    monkeypatch.setattr(change_notifier, "handle", received.append)
+
+    async def scenario():
+        listener = asyncio.create_task(change_notifier.listen(check_interval=0.05))
+        await asyncio.sleep(0.2)
+        await process_message(KafkaMessage(**make_event("MOV-1", "WH-1", "departure", 30)))
+        await asyncio.sleep(0.2)
+        listener.cancel()
+
+    run(scenario())
+
+    messages = [json.loads(payload) for payload in received]
+    assert {"movements": ["MOV-1"]} in messages
+    assert [change[:3] for message in messages for change in message.get("stock", ())] == [["WH-1", "PROD-1", 70]]
+
+
+def test_notifications_are_not_sent_unless_enabled(run, monkeypatch):
+    sent = []
+    monkeypatch.setattr(database, "execute", lambda query: sent.append(query))
+
+    run(ChangeNotifier("warehouse_changes").stock_changed([("WH-1", "PROD-1", 1, datetime(2025, 2, 18))]))
+
+    assert sent == []
@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.models.database import database, dead_letter_events, warehouse_states
+from app.models.schemas import KafkaMessage
+from app.services import idempotency
+from app.services.dead_letter import retry_due
+from app.services.kafka_consumer import KafkaConsumerService
+from app.services.warehouse_services import process_message
+from tests.test_kafka_consumer import FakeKafkaConsumer, Record, encode, make_event
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def slow_backoff(monkeypatch):
+    """Записи созревают только через make_due(), независимо от скорости прогона"""
+    monkeypatch.setattr("app.services.dead_letter.settings.DEAD_LETTER_RETRY_BASE_MS", 60000)
+
+
+def consume(run, records, batch_mode=True):
+    service = KafkaConsumerService("localhost:9092", "warehouse_events", loop=run.loop, batch_mode=batch_mode)
+    fake = FakeKafkaConsumer(service, [records])
+    service._create_consumer = lambda: fake
+    service._consume()
+
+
+def make_due(run):
+    run(database.execute(dead_letter_events.update().values(next_attempt_at=datetime.utcnow() - timedelta(seconds=1))))
+
+
+def dead_letters(run):
+    rows = run(database.fetch_all(dead_letter_events.select().order_by(dead_letter_events.c.id)))
+    return [(row["event_id"], row["status"], row["attempts"]) for row in rows]
+
+
+def database_unavailable(monkeypatch, once_for=None):
+    """Отметка о событии падает с ошибкой БД: всегда или один раз для события once_for"""
+    original = idempotency.mark_processed
+    failed = []
+
+    async def mark_processed(event_id):
+        if once_for is None or (event_id == once_for and not failed):
+            failed.append(event_id)
+            raise ConnectionError("БД недоступна")
+        return await original(event_id)
+
+    monkeypatch.setattr(idempotency, "mark_processed", mark_processed)
+
+
+def test_failed_event_is_retried_off_the_hot_path(run, monkeypatch):
+    """Событие с ошибкой БД не задерживает пачку и применяется повтором"""
+    database_unavailable(monkeypatch, once_for="MOV-1:departure")
+    consume(run, [
+        Record(0, encode(make_event("MOV-1", "WH-1", "departure", 30))),
+        Record(1, encode(make_event("MOV-2", "WH-1", "departure", 10))),
+    ])
+    assert dead_letters(run) == [("MOV-1:departure", "pending", 1)]
+    assert run(retry_due(10)) == 0
+
+    make_due(run)
+
+    assert run(retry_due(10)) == 1
+    assert dead_letters(run) == [("MOV-1:departure", "replayed", 1)]
+    stock = run(database.fetch_val(warehouse_states.select().with_only_columns(warehouse_states.c.quantity)))
+    assert stock == 60
+
+
+@pytest.mark.parametrize("batch_mode", [True, False])
+def test_rejected_departure_is_parked_with_reason(run, batch_mode):
+    """Отклоненный расход не повторяется: повтор дал бы тот же результат"""
+    consume(run, [Record(0, encode(make_event("MOV-1", "WH-1", "departure", 150)))], batch_mode)
+
+    rows = run(database.fetch_all(dead_letter_events.select()))
+    assert [(row["reason"], row["status"], row["next_attempt_at"]) for row in rows] == [("rejected", "parked", None)]
+    assert rows[0]["error"] == "Недостаточно товара на складе: warehouse_id=WH-1, product_id=PROD-1, списание=150"
+
+
+def test_event_parked_after_max_attempts(run, monkeypatch):
+    monkeypatch.setattr("app.services.dead_letter.settings.DEAD_LETTER_MAX_ATTEMPTS", 3)
+    database_unavailable(monkeypatch)
+    consume(run, [Record(0, encode(make_event("MOV-1", "WH-1", "departure", 30)))])
+
+    for attempts in (2, 3):
+        make_due(run)
+        run(retry_due(10))
+        assert dead_letters(run)[0][1:] == ("parked" if attempts == 3 else "pending", attempts)
+
+    make_due(run)
+    assert run(retry_due(10)) == 0
+
+
+def test_list_and_replay_dead_letters(run):
+    consume(run, [Record(0, b'{"broken": true}'), Record(1, encode(make_event("MOV-1", "WH-1", "departure", 150)))])
+
+    page = client.get("/dead-letters", params={"status": "parked"}).json()
+    assert [(item["reason"], item["payload"][:12]) for item in page["items"]] == [
+        ("malformed", '{"broken": t'), ("rejected", '{"id": "MOV-')
+    ]
+    assert page["next_after_id"] is None
+
+    response = client.post("/dead-letters:replay", json={"status": "parked", "reason": "rejected"})
+    assert response.json() == {"requeued": 1}
+    assert [row[1] for row in dead_letters(run)] == ["parked", "pending"]
+
+    # Товар поступил: ручной повтор применяет расход
+    run(process_message(KafkaMessage(**make_event("MOV-2", "WH-1", "arrival", 100))))
+    run(retry_due(10))
+    assert [row[1] for row in dead_letters(run)] == ["parked", "replayed"]
+    stock = run(database.fetch_val(warehouse_states.select().with_only_columns(warehouse_states.c.quantity)))
+    assert stock == 50
+
+
+@pytest.mark.parametrize("batch_mode", [True, False])
+def test_offsets_not_committed_when_parking_fails(run, monkeypatch, batch_mode):
+    """Если dead letter недоступен, смещения не фиксируются ни commit, ни автокоммитом при закрытии"""
+    async def unavailable(entries):
+        raise ConnectionError("БД недоступна")
+
+    monkeypatch.setattr("app.services.kafka_consumer.park", unavailable)
+    service = KafkaConsumerService("localhost:9092", "warehouse_events", loop=run.loop, batch_mode=batch_mode)
+    fake = FakeKafkaConsumer(service, [
+        [Record(0, encode(make_event("MOV-1", "WH-1", "departure", 150)))],
+        [Record(1, encode(make_event("MOV-2", "WH-1", "departure", 10)))],
+    ])
+    service._create_consumer = lambda: fake
+
+    service._consume()
+
+    assert fake.polled == 1 and fake.commits == []
+    assert fake.closed_with_autocommit is False
+    assert dead_letters(run) == []
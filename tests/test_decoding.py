@@ -0,0 +1,28 @@
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from app.services.decoding import decode_envelope, decode_event
+from tests.test_kafka_consumer import make_event
+
+
+def test_decode_event_from_raw_bytes():
+    event = decode_event(json.dumps(make_event("MOV-1", "WH-1", "departure", 10)).encode())
+
+    assert event.id == "MOV-1:departure"
+    assert event.data.quantity == 10
+    assert event.data.timestamp.tzinfo is not None
+
+
+def test_envelope_fields_are_validated_only_on_demand():
+    raw = json.dumps({"id": "E-1", "time": "not a number", "data": make_event("MOV-1", "WH-1", "arrival", 5)["data"]})
+
+    assert decode_event(raw).data.event == "arrival"
+    with pytest.raises(ValidationError):
+        decode_envelope(raw)
+
+
+def test_malformed_payload_raises_validation_error():
+    with pytest.raises(ValidationError):
+        decode_event(b"\xff not json")
@@ -0,0 +1,33 @@
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.models.database import database
+
+client = TestClient(app)
+
+
+def test_health_reports_pools_without_db():
+    response = client.get("/health")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "ok"
+    assert all(0 <= pool["saturation"] <= 1 for pool in body["pools"])
+
+
+def test_ready_measures_db_latency(run):
+    response = client.get("/ready")
+
+    assert response.status_code == 200
+    assert response.json()["ready"] and response.json()["db_latency_ms"] >= 0
+
+
+def test_ready_fails_when_db_is_unavailable(run, monkeypatch):
+    async def unavailable(*args, **kwargs):
+        raise ConnectionRefusedError("connection refused")
+
+    monkeypatch.setattr(database, "fetch_val", unavailable)
+    response = client.get("/ready")
+
+    assert response.status_code == 503
+    assert response.json()["error"] == "connection refused"
@@ -0,0 +1,210 @@
+import json
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from app.models.database import database, warehouse_states, movements, processed_events, dead_letter_events
+from app.models.schemas import KafkaMessage
+from app.services.idempotency import processed_event_cache, prune_processed_events
+from app.services.kafka_consumer import KafkaConsumerService
+from app.services.warehouse_services import process_batch, process_message
+
+Record = namedtuple("Record", ["offset", "value"])
+
+DEPARTURE_TIME = datetime(2025, 2, 18, 12, 0, tzinfo=timezone.utc)
+
+
+def make_event(movement_id, warehouse_id, event, quantity, product_id="PROD-1", timestamp=DEPARTURE_TIME):
+    return {
+        "id": f"{movement_id}:{event}",
+        "source": warehouse_id,
+        "specversion": "1.0",
+        "type": "ru.retail.warehouses.movement",
+        "datacontenttype": "application/json",
+        "dataschema": "ru.retail.warehouses.movement.v1.0",
+        "time": 1737439421623,
+        "subject": f"{warehouse_id}:{event.upper()}",
+        "destination": "ru.retail.warehouses",
+        "data": {
+            "movement_id": movement_id,
+            "warehouse_id": warehouse_id,
+            "timestamp": timestamp.isoformat(),
+            "event": event,
+            "product_id": product_id,
+            "quantity": quantity,
+        },
+    }
+
+
+def encode(event):
+    return json.dumps(event).encode()
+
+
+class FakeKafkaConsumer:
+    """Отдает заранее подготовленные пачки и запоминает, после какого числа пачек был commit"""
+
+    def __init__(self, service, batches):
+        self.service = service
+        self.batches = list(batches)
+        self.polled = 0
+        self.commits = []
+
+    def poll(self, timeout_ms=0, max_records=None):
+        if not self.batches:
+            self.service.should_stop = True
+            return {}
+        self.polled += 1
+        return {"partition-0": self.batches.pop(0)}
+
+    def commit(self):
+        self.commits.append(self.polled)
+
+    def close(self, autocommit=True):
+        self.closed_with_autocommit = autocommit
+
+
+def test_process_batch_keeps_movement_order(run):
+    """Отправка и приемка одного перемещения применяются по порядку, разные перемещения — независимо"""
+    arrival_time = DEPARTURE_TIME + timedelta(hours=1)
+    events = [
+        make_event("MOV-1", "WH-1", "departure", 30),
+        make_event("MOV-2", "WH-1", "departure", 20),
+        make_event("MOV-1", "WH-2", "arrival", 28, timestamp=arrival_time),
+        make_event("MOV-2", "WH-3", "arrival", 20, timestamp=arrival_time),
+    ]
+
+    results = run(process_batch([KafkaMessage(**event) for event in events], concurrency=4))
+
+    assert results == [True, True, True, True]
+    stock = run(database.fetch_one(warehouse_states.select().where(warehouse_states.c.id == "WH-1:PROD-1")))
+    assert stock["quantity"] == 50
+    movement = run(database.fetch_one(movements.select().where(movements.c.movement_id == "MOV-1")))
+    assert movement["time_difference_seconds"] == 3600.0
+    assert movement["quantity_difference"] == -2
+
+
+def test_process_batch_rejects_negative_stock(run):
+    """Отправка больше остатка отклоняется и не меняет склад"""
+    results = run(process_batch([KafkaMessage(**make_event("MOV-1", "WH-1", "departure", 150))]))
+
+    assert results == [False]
+    stock = run(database.fetch_one(warehouse_states.select().where(warehouse_states.c.id == "WH-1:PROD-1")))
+    assert stock["quantity"] == 100
+
+
+def test_batch_consumer_commits_after_each_batch(run):
+    """Смещения фиксируются после записи каждой пачки, некорректные записи уходят в dead letter"""
+    service = KafkaConsumerService("localhost:9092", "warehouse_events", loop=run.loop, batch_mode=True)
+    fake = FakeKafkaConsumer(service, [
+        [Record(0, encode(make_event("MOV-1", "WH-1", "departure", 10))), Record(1, b'{"broken": true}')],
+        [Record(2, encode(make_event("MOV-2", "WH-1", "departure", 5)))],
+    ])
+    service._create_consumer = lambda: fake
+
+    service._consume()
+
+    assert fake.commits == [1, 2]
+    stock = run(database.fetch_one(warehouse_states.select().where(warehouse_states.c.id == "WH-1:PROD-1")))
+    assert stock["quantity"] == 85
+    parked = run(database.fetch_all(dead_letter_events.select()))
+    assert [(row["reason"], row["kafka_offset"], row["payload"]) for row in parked] == [
+        ("malformed", 1, b'{"broken": true}')
+    ]
+
+
+def test_sequential_consumer_processes_whole_poll(run):
+    """Последовательный режим читает через poll и дорабатывает полученные записи даже после stop()"""
+    service = KafkaConsumerService("localhost:9092", "warehouse_events", loop=run.loop, batch_mode=False)
+    fake = FakeKafkaConsumer(service, [[
+        Record(0, encode(make_event("MOV-1", "WH-1", "departure", 10))),
+        Record(1, encode(make_event("MOV-2", "WH-1", "departure", 5))),
+    ]])
+    original_poll = fake.poll
+
+    def poll_and_stop(*args, **kwargs):
+        records = original_poll(*args, **kwargs)
+        service.stop()
+        return records
+
+    fake.poll = poll_and_stop
+    service._create_consumer = lambda: fake
+
+    service._consume()
+
+    assert fake.polled == 1
+    stock = run(database.fetch_one(warehouse_states.select().where(warehouse_states.c.id == "WH-1:PROD-1")))
+    assert stock["quantity"] == 85
+
+
+def test_consumer_stops_while_idle(run):
+    """stop() завершает цикл без входящих сообщений, не дожидаясь новой записи"""
+    service = KafkaConsumerService("localhost:9092", "warehouse_events", loop=run.loop, poll_timeout_ms=10)
+
+    class IdleConsumer(FakeKafkaConsumer):
+        def poll(self, timeout_ms=0, max_records=None):
+            return {}
+
+    service._create_consumer = lambda: IdleConsumer(service, [])
+    thread = threading.Thread(target=service._consume)
+    thread.start()
+    service.stop()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+
+def test_supervised_consumer_reconnects_after_failure(run):
+    """После сбоя подключения цикл перезапускается с задержкой и дорабатывает записи"""
+    service = KafkaConsumerService("localhost:9092", "warehouse_events", loop=run.loop, batch_mode=True)
+    fake = FakeKafkaConsumer(service, [[Record(0, encode(make_event("MOV-1", "WH-1", "departure", 10)))]])
+    attempts = []
+
+    def create_consumer():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("брокер недоступен")
+        return fake
+
+    service._create_consumer = create_consumer
+    run(service.supervise(base_delay=0.01, max_delay=0.01))
+
+    assert len(attempts) == 2
+    assert fetch_stock(run) == 90
+
+
+def fetch_stock(run):
+    return run(database.fetch_val(warehouse_states.select().with_only_columns(warehouse_states.c.quantity)
+                                  .where(warehouse_states.c.id == "WH-1:PROD-1")))
+
+
+def test_duplicate_event_is_applied_once(run):
+    """Повтор события пропускается и по памяти, и по отметке в БД после перезапуска"""
+    message = KafkaMessage(**make_event("MOV-1", "WH-1", "departure", 10))
+
+    assert run(process_message(message))
+    assert run(process_message(message))
+    processed_event_cache.clear()
+    assert run(process_message(message))
+
+    assert fetch_stock(run) == 90
+    assert len(run(database.fetch_all(processed_events.select()))) == 1
+
+
+def test_rejected_event_is_not_marked_processed(run):
+    """Отклоненная отправка не отмечается и применяется при повторе, когда товара хватает"""
+    message = KafkaMessage(**make_event("MOV-1", "WH-1", "departure", 150))
+
+    assert not run(process_message(message))
+    run(database.execute(warehouse_states.update().values(quantity=200)))
+
+    assert run(process_message(message))
+    assert fetch_stock(run) == 50
+
+
+def test_prune_processed_events_by_age(run):
+    run(database.execute(processed_events.insert(), {"event_id": "old", "processed_at": datetime(2020, 1, 1)}))
+    run(process_message(KafkaMessage(**make_event("MOV-1", "WH-1", "departure", 10))))
+
+    run(prune_processed_events(retention_seconds=3600))
+
+    rows = run(database.fetch_all(processed_events.select()))
+    assert [row["event_id"] for row in rows] == ["MOV-1:departure"]
@@ -0,0 +1,140 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.models.database import database, stock_events, warehouse_states
+from app.models.schemas import KafkaMessage
+from app.services.ledger import (
+    NoSnapshot, append, ledger_row, rebuild_warehouse_states, stock_from_ledger, take_snapshot
+)
+from app.services.warehouse_services import get_warehouse_state, get_warehouse_state_as_of, process_message
+from tests.test_kafka_consumer import make_event
+
+client = TestClient(app)
+
+
+def apply(run, *events):
+    for event in events:
+        run(process_message(KafkaMessage(**make_event(*event))))
+
+
+def test_applied_events_are_appended_to_ledger(run):
+    """Каждое примененное событие — строка журнала; отклоненный расход в журнал не попадает"""
+    apply(run, ("MOV-1", "WH-1", "departure", 30), ("MOV-1", "WH-2", "arrival", 30), ("MOV-2", "WH-1", "departure", 500))
+
+    rows = run(database.fetch_all(stock_events.select().order_by(stock_events.c.id)))
+    assert [(row["event_id"], row["warehouse_id"], row["delta"]) for row in rows] == [
+        ("MOV-1:departure", "WH-1", -30), ("MOV-1:arrival", "WH-2", 30)
+    ]
+
+
+def test_rebuild_replays_from_last_snapshot(run):
+    """Остатки восстанавливаются из снимка (включая данные до журнала) и событий после него"""
+    apply(run, ("MOV-1", "WH-1", "departure", 30))
+    first = run(take_snapshot())
+    apply(run, ("MOV-1", "WH-2", "arrival", 30), ("MOV-2", "WH-1", "departure", 20))
+    second = run(take_snapshot())
+    apply(run, ("MOV-3", "WH-1", "departure", 5))
+
+    assert second > first
+    assert run(take_snapshot()) > second
+    assert run(take_snapshot()) is None
+    apply(run, ("MOV-2", "WH-2", "arrival", 20))
+    assert run(stock_from_ledger()) == {("WH-1", "PROD-1"): 45, ("WH-2", "PROD-1"): 50}
+
+    # Сбой записал неверные остатки
+    run(database.execute(warehouse_states.update().values(quantity=999)))
+    assert run(rebuild_warehouse_states("WH-2")) == 1
+    assert run(get_warehouse_state("WH-2", "PROD-1")).quantity == 50
+    assert run(get_warehouse_state("WH-1", "PROD-1")).quantity == 999
+
+    assert run(rebuild_warehouse_states()) == 2
+    assert run(get_warehouse_state("WH-1", "PROD-1")).quantity == 45
+
+
+def test_rebuild_without_snapshot_is_refused(run):
+    """Без снимка остатки до журнала неизвестны: восстановление не трогает warehouse_states"""
+    apply(run, ("MOV-1", "WH-1", "departure", 30))
+
+    with pytest.raises(NoSnapshot):
+        run(rebuild_warehouse_states())
+    assert run(get_warehouse_state("WH-1", "PROD-1")).quantity == 70
+
+
+def test_rebuild_zeroes_keys_missing_from_ledger(run):
+    """Остаток, которого нет ни в снимке, ни в журнале, обнуляется в той же транзакции"""
+    run(take_snapshot())
+    apply(run, ("MOV-1", "WH-2", "arrival", 30))
+    run(database.execute(warehouse_states.insert().values(
+        id="WH-2:PROD-9", warehouse_id="WH-2", product_id="PROD-9", quantity=15
+    )))
+    run(database.execute(warehouse_states.insert().values(
+        id="WH-3:PROD-9", warehouse_id="WH-3", product_id="PROD-9", quantity=7
+    )))
+
+    assert run(rebuild_warehouse_states("WH-2")) == 1
+    assert run(get_warehouse_state("WH-2", "PROD-9")).quantity == 0
+    assert run(get_warehouse_state("WH-2", "PROD-1")).quantity == 30
+    assert run(get_warehouse_state("WH-3", "PROD-9")).quantity == 7
+
+    run(rebuild_warehouse_states())
+    assert run(get_warehouse_state("WH-3", "PROD-9")).quantity == 0
+    assert run(get_warehouse_state("WH-1", "PROD-1")).quantity == 100
+
+
+@pytest.mark.skipif(database.url.dialect != "postgresql", reason="id событий выдаются до фиксации только в PostgreSQL")
+def test_snapshot_includes_lower_event_id_committed_later(run):
+    """Событие с меньшим id, зафиксированное после большего, не остается за позицией снимка"""
+    run(take_snapshot())
+
+    def row(event_id, delta):
+        return ledger_row(event_id, "MOV-1", "WH-1", "PROD-1", delta, datetime.utcnow())
+
+    async def scenario():
+        inserted, release = asyncio.Event(), asyncio.Event()
+
+        async def slow_writer():
+            async with database.transaction():
+                await append([row("LOW", -30)])
+                inserted.set()
+                await release.wait()
+
+        writer = asyncio.create_task(slow_writer())
+        await inserted.wait()
+        await append([row("HIGH", -20)])
+        snapshot = asyncio.create_task(take_snapshot())
+        await asyncio.sleep(0.2)
+        assert not snapshot.done()
+        release.set()
+        await writer
+        return await snapshot
+
+    assert run(scenario()) is not None
+    assert run(take_snapshot()) is None
+    assert run(stock_from_ledger()) == {("WH-1", "PROD-1"): 50}
+
+
+def test_stock_as_of_timestamp(run):
+    """Остаток на момент времени: после последнего изменения до него, до первого — по первому изменению"""
+    apply(run, ("MOV-1", "WH-1", "departure", 30), ("MOV-2", "WH-1", "departure", 20), ("MOV-3", "WH-1", "arrival", 5))
+    for hour, event_id in ((10, "MOV-1:departure"), (12, "MOV-2:departure"), (14, "MOV-3:arrival")):
+        run(database.execute(stock_events.update().where(stock_events.c.event_id == event_id)
+                             .values(recorded_at=datetime(2025, 2, 18, hour))))
+
+    def stock_at(timestamp):
+        response = client.get("/warehouses/WH-1/products/PROD-1", params={"as_of": timestamp})
+        assert response.status_code == 200
+        return response.json()["quantity"]
+
+    assert stock_at("2025-02-18T09:00:00") == 100
+    assert stock_at("2025-02-18T10:00:00") == 70
+    assert stock_at("2025-02-18T13:59:59") == 50
+    # Время с часовым поясом приводится к UTC
+    assert stock_at("2025-02-18T17:30:00+03:00") == 55
+    assert stock_at("2025-02-18T13:00:00") == run(
+        get_warehouse_state_as_of("WH-1", "PROD-1", datetime(2025, 2, 18, 13))
+    ).quantity
+    assert run(get_warehouse_state_as_of("WH-9", "PROD-1", datetime(2025, 2, 18, 13))).quantity == 0
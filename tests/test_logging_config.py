@@ -0,0 +1,47 @@
+import json
+import logging
+import queue
+
+from app.core.logging_config import DeferredQueueHandler, JsonFormatter, RateLimitFilter
+
+
+def make_record(msg, args=(), level=logging.INFO, lineno=10, created=1000.0):
+    record = logging.LogRecord("test", level, __file__, lineno, msg, args, None)
+    record.created = created
+    return record
+
+
+def test_rate_limit_is_per_call_site_and_per_second():
+    log_filter = RateLimitFilter(rate_limit=2)
+
+    passed = [log_filter.filter(make_record("Запрос %s", ("A",))) for _ in range(5)]
+    other_site = log_filter.filter(make_record("Другое %s", ("B",), lineno=20))
+    next_second = log_filter.filter(make_record("Запрос %s", ("A",), created=1001.0))
+
+    assert passed == [True, True, False, False, False]
+    assert other_site and next_second
+
+
+def test_errors_bypass_rate_limit_and_sampling():
+    log_filter = RateLimitFilter(rate_limit=1, sample_rate=0.0)
+
+    assert not log_filter.filter(make_record("Запрос %s", ("A",)))
+    assert all(log_filter.filter(make_record("Ошибка %s", ("A",), level=logging.ERROR)) for _ in range(3))
+
+
+def test_queue_handler_defers_formatting():
+    handler = DeferredQueueHandler(queue.Queue())
+    handler.handle(make_record("Найдено состояние склада: %s, %s", ("WH-1", 100)))
+    record = handler.queue.get_nowait()
+
+    assert record.msg == "Найдено состояние склада: %s, %s"
+    assert record.args == ("WH-1", 100)
+
+
+def test_json_formatter_keeps_template_and_args():
+    entry = json.loads(JsonFormatter().format(make_record("Склад не найден: %s, %s", ("WH-1", 5))))
+
+    assert entry["message"] == "Склад не найден: WH-1, 5"
+    assert entry["template"] == "Склад не найден: %s, %s"
+    assert entry["args"] == ["WH-1", 5]
+    assert entry["level"] == "INFO"
@@ -0,0 +1,32 @@
+from fastapi.testclient import TestClient
+
+from app.core.metrics import Histogram, Registry
+from app.main import app
+
+client = TestClient(app)
+
+
+def test_histogram_renders_cumulative_buckets(monkeypatch):
+    registry = Registry()
+    monkeypatch.setattr("app.core.metrics.REGISTRY", registry)
+    histogram = Histogram("test_duration_seconds", "Тест", ("function",), buckets=(0.1, 1.0))
+    child = histogram.labels("f")
+    for value in (0.05, 0.5, 0.7, 3.0):
+        child.observe(value)
+
+    lines = registry.render().splitlines()
+
+    assert 'test_duration_seconds_bucket{function="f",le="0.1"} 1' in lines
+    assert 'test_duration_seconds_bucket{function="f",le="1.0"} 3' in lines
+    assert 'test_duration_seconds_bucket{function="f",le="+Inf"} 4' in lines
+    assert 'test_duration_seconds_count{function="f"} 4' in lines
+
+
+def test_metrics_endpoint_reports_route_template(run):
+    client.get("/warehouses/WH-1/products/PROD-1")
+
+    body = client.get("/metrics").text
+
+    assert 'http_request_duration_seconds_count{method="GET",route="/warehouses/{warehouse_id}/products/{product_id}",status="200"}' in body
+    assert 'db_query_duration_seconds_count{function="get_warehouse_state"}' in body
+    assert 'read_cache_misses_total{cache="warehouse_states"}' in body
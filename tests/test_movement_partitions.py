@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app.models.database import database, movement_keys, movements
+from app.models.schemas import KafkaMessage
+from app.services.movement_partitions import add_months, expire_partitions, parse_partition
+from app.services.warehouse_services import get_movement_info, process_message
+from tests.test_kafka_consumer import DEPARTURE_TIME, make_event
+
+
+def test_partition_bounds_and_months():
+    assert add_months(datetime(2025, 11, 1), 2) == datetime(2026, 1, 1)
+    assert add_months(datetime(2025, 1, 1), -1) == datetime(2024, 12, 1)
+
+    month = parse_partition("movements_2025_01", "FOR VALUES FROM ('2025-01-01 00:00:00') TO ('2025-02-01 00:00:00')")
+    assert month.lower == datetime(2025, 1, 1) and month.upper == datetime(2025, 2, 1)
+    legacy = parse_partition("movements_legacy", "FOR VALUES FROM (MINVALUE) TO ('2025-01-01 00:00:00')")
+    assert legacy.lower is None and legacy.upper == datetime(2025, 1, 1)
+    assert parse_partition("movements_default", "DEFAULT") is None
+
+
+def test_movement_stays_in_partition_of_first_half(run):
+    """Приемка пришла раньше отправки: строка и ключ остаются на времени приемки, половины сходятся в одну строку"""
+    arrival_time = DEPARTURE_TIME + timedelta(hours=3)
+    for event in (make_event("MOV-1", "WH-2", "arrival", 30, timestamp=arrival_time),
+                  make_event("MOV-1", "WH-1", "departure", 30)):
+        assert run(process_message(KafkaMessage(**event)))
+
+    rows = run(database.fetch_all(select(movements.c.partition_time)))
+    key = run(database.fetch_val(select(movement_keys.c.partition_time)))
+
+    assert [row["partition_time"] for row in rows] == [key] == [arrival_time.replace(tzinfo=None)]
+    movement = run(get_movement_info("MOV-1"))
+    assert movement.time_difference_seconds == 3 * 3600
+
+
+def test_expire_deletes_movements_outside_retention(run):
+    """Без секций (SQLite) срок хранения удаляет строки и ключи старше границы"""
+    for movement_id, months_ago in (("MOV-OLD", 4), ("MOV-NEW", 1)):
+        timestamp = add_months(datetime(2025, 6, 1), -months_ago) + timedelta(days=3)
+        assert run(process_message(KafkaMessage(**make_event(movement_id, "WH-1", "departure", 1, timestamp=timestamp))))
+
+    assert run(expire_partitions(0, "movements_archive", now=datetime(2025, 6, 15))) == []
+    assert len(run(database.fetch_all(select(movements)))) == 2
+
+    run(expire_partitions(3, "movements_archive", now=datetime(2025, 6, 15)))
+
+    assert [row["movement_id"] for row in run(database.fetch_all(select(movements)))] == ["MOV-NEW"]
+    assert [row["movement_id"] for row in run(database.fetch_all(select(movement_keys)))] == ["MOV-NEW"]
+    assert run(get_movement_info("MOV-OLD")) is None
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+
+from app.models.database import database, metadata, stock_events, warehouse_states
+from app.models.schemas import KafkaMessage
+from app.services import warehouse_services
+from app.services.replicas import ReplicaSet
+from app.services.warehouse_services import _load_warehouse_state, get_movement_info, process_message
+from tests.test_kafka_consumer import make_event
+
+
+@pytest.fixture
+def replica_set(run, tmp_path, monkeypatch):
+    """Две реплики — отдельные файлы SQLite с остатком WH-1:PROD-1, отличным от основной БД (100)"""
+    urls = []
+    for number, quantity in ((1, 41), (2, 42)):
+        url = f"sqlite:///{tmp_path}/replica{number}.db"
+        replica_engine = create_engine(url)
+        metadata.create_all(replica_engine)
+        with replica_engine.begin() as connection:
+            connection.execute(warehouse_states.insert().values(
+                id="WH-1:PROD-1", warehouse_id="WH-1", product_id="PROD-1", quantity=quantity
+            ))
+        urls.append(url)
+
+    replica_set = ReplicaSet(urls, max_lag=5, check_interval=1, read_your_writes=10)
+    monkeypatch.setattr(warehouse_services, "replicas", replica_set)
+    yield replica_set
+    run(replica_set.disconnect())
+
+
+def stock(run):
+    return run(_load_warehouse_state("WH-1", "PROD-1")).quantity
+
+
+def record_ledger(run, target, recorded_at):
+    run(target.execute(stock_events.insert().values(
+        event_id="E", movement_id="MOV", warehouse_id="WH-1", product_id="PROD-1", delta=1,
+        occurred_at=recorded_at, recorded_at=recorded_at
+    )))
+
+
+def test_reads_round_robin_and_fail_over_to_primary(run, replica_set, monkeypatch):
+    assert stock(run) == 100  # до первой проверки реплики не используются
+    run(replica_set.check())
+
+    assert sorted(stock(run) for _ in range(4)) == [41, 41, 42, 42]
+
+    async def unavailable(query):
+        raise ConnectionError("replica is down")
+
+    monkeypatch.setattr(replica_set.replicas[0].database, "fetch_one", unavailable)
+    assert {stock(run) for _ in range(4)} == {42, 100}
+    assert not replica_set.replicas[0].healthy
+    assert stock(run) == 42
+
+
+def test_lagging_replica_is_skipped(run, replica_set):
+    now = datetime.utcnow()
+    record_ledger(run, database, now)
+    run(replica_set.check())
+    assert stock(run) == 100
+
+    record_ledger(run, replica_set.replicas[1].database, now - timedelta(seconds=2))
+    run(replica_set.check())
+    assert replica_set.replicas[1].lag_seconds == 2.0
+    assert stock(run) == 42
+
+
+def test_just_written_movement_is_read_from_primary(run, replica_set):
+    run(replica_set.check())
+    assert run(process_message(KafkaMessage(**make_event("MOV-1", "WH-1", "departure", 30))))
+
+    movement = run(get_movement_info("MOV-1"))
+
+    assert movement is not None and movement.departure_quantity == 30
+    assert stock(run) == 70
@@ -0,0 +1,169 @@
+import base64
+import json
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api.routers import _json_array_response
+from app.main import app
+from app.models.database import database, movement_keys, movements, warehouse_states
+from app.models.schemas import MovementInfo
+
+client = TestClient(app)
+
+
+def insert_movements(run, rows):
+    """Строки movements вместе с их ключами в movement_keys, как их записывает обработка событий"""
+    rows = [{"partition_time": row.get("departure_time") or datetime(2025, 1, 1), **row} for row in rows]
+    run(database.execute_many(movements.insert(), rows))
+    run(database.execute_many(movement_keys.insert(), [
+        {"movement_id": row["movement_id"], "partition_time": row["partition_time"]} for row in rows
+    ]))
+
+
+def test_batch_get_stock_fills_missing_pairs(run):
+    """Найденные пары приходят из БД, отсутствующие — с нулевым остатком"""
+    response = client.post("/warehouses/stock:batchGet", json={"items": [
+        {"warehouse_id": "WH-1", "product_id": "PROD-1"},
+        {"warehouse_id": "WH-2", "product_id": "PROD-1"},
+        {"warehouse_id": "WH-1", "product_id": "PROD-1"},
+    ]})
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {"warehouse_id": "WH-1", "product_id": "PROD-1", "quantity": 100},
+        {"warehouse_id": "WH-2", "product_id": "PROD-1", "quantity": 0},
+    ]
+
+
+def test_batch_get_movements_skips_unknown(run):
+    insert_movements(run, [{"movement_id": "MOV-1", "product_id": "PROD-1", "departure_quantity": 5}])
+
+    response = client.post("/movements:batchGet", json={"movement_ids": ["MOV-1", "MOV-404"]})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert [movement["movement_id"] for movement in data] == ["MOV-1"]
+    assert data[0]["departure_quantity"] == 5
+
+
+def test_batch_get_rejects_empty_request(run):
+    assert client.post("/movements:batchGet", json={"movement_ids": []}).status_code == 422
+
+
+def test_list_warehouse_products_pages_by_cursor(run):
+    run(database.execute_many(warehouse_states.insert(), [
+        {"id": f"WH-1:PROD-{n}", "warehouse_id": "WH-1", "product_id": f"PROD-{n}", "quantity": n} for n in range(2, 6)
+    ]))
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/warehouses/WH-1/products", params=params).json()
+        seen.extend(item["product_id"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == ["PROD-1", "PROD-2", "PROD-3", "PROD-4", "PROD-5"]
+
+
+def test_list_product_movements_includes_undeparted_last(run):
+    """Перемещения без отправки идут после отправленных, страницы не теряют и не дублируют строки"""
+    insert_movements(run, [
+        {"movement_id": "MOV-C", "product_id": "PROD-1", "departure_time": datetime(2025, 1, 1, 10)},
+        {"movement_id": "MOV-A", "product_id": "PROD-1", "departure_time": datetime(2025, 1, 1, 12)},
+        {"movement_id": "MOV-B", "product_id": "PROD-1", "departure_time": datetime(2025, 1, 1, 12)},
+        {"movement_id": "MOV-E", "product_id": "PROD-1", "arrival_time": datetime(2025, 1, 1, 13)},
+        {"movement_id": "MOV-D", "product_id": "PROD-1", "arrival_time": datetime(2025, 1, 1, 14)},
+        {"movement_id": "MOV-X", "product_id": "PROD-2", "departure_time": datetime(2025, 1, 1, 9)},
+    ])
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/products/PROD-1/movements", params=params).json()
+        seen.extend(item["movement_id"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == ["MOV-C", "MOV-A", "MOV-B", "MOV-D", "MOV-E"]
+
+
+def test_list_rejects_malformed_cursor(run):
+    assert client.get("/products/PROD-1/movements", params={"cursor": "garbage"}).status_code == 400
+
+
+@pytest.mark.parametrize("values", [[123, "x"], ["notadate", "x"], [{"a": 1}], ["2025-01-01T00:00:00", None]])
+def test_list_rejects_cursor_with_wrong_element_types(run, values):
+    """Курсор правильной длины, но с чужими типами элементов — тоже 400"""
+    cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    assert client.get("/products/PROD-1/movements", params={"cursor": cursor}).status_code == 400
+    assert client.get("/warehouses/WH-1/products", params={"cursor": cursor}).status_code == 400
+
+
+def test_export_movements_ndjson_filters_by_product_and_period(run):
+    insert_movements(run, [
+        {"movement_id": "MOV-1", "product_id": "PROD-1", "departure_time": datetime(2025, 1, 1, 10), "departure_quantity": 5},
+        {"movement_id": "MOV-2", "product_id": "PROD-1", "departure_time": datetime(2025, 1, 2, 10)},
+        {"movement_id": "MOV-3", "product_id": "PROD-2", "departure_time": datetime(2025, 1, 1, 11)},
+    ])
+
+    response = client.get("/movements/export", params={
+        "product_id": "PROD-1", "since": "2025-01-01T00:00:00", "until": "2025-01-02T00:00:00"
+    })
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [(row["movement_id"], row["departure_time"], row["departure_quantity"]) for row in rows] == [
+        ("MOV-1", "2025-01-01T10:00:00", 5)
+    ]
+
+
+def test_export_warehouse_stock_csv(run):
+    run(database.execute(warehouse_states.insert(), {"id": "WH-1:PROD-2", "warehouse_id": "WH-1", "product_id": "PROD-2", "quantity": 7}))
+
+    response = client.get("/warehouses/WH-1/export", params={"format": "csv"})
+
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == 'attachment; filename="WH-1.csv"'
+    assert sorted(response.text.splitlines()) == sorted([
+        "warehouse_id,product_id,quantity", "WH-1,PROD-1,100", "WH-1,PROD-2,7"
+    ])
+
+
+def failing_movements(rows_before_failure):
+    async def iter_movements(movement_ids):
+        for movement_id in movement_ids[:rows_before_failure]:
+            yield MovementInfo(movement_id=movement_id, product_id="PROD-1")
+        raise ConnectionError("БД недоступна")
+    return iter_movements
+
+
+def test_batch_get_fails_with_500_before_first_row(run, monkeypatch):
+    monkeypatch.setattr("app.api.routers.iter_movements", failing_movements(0))
+
+    response = client.post("/movements:batchGet", json={"movement_ids": ["MOV-1", "MOV-2"]})
+
+    assert response.status_code == 500
+
+
+def test_batch_get_aborts_stream_after_first_row(run, caplog):
+    """Ошибка после начала ответа логируется и обрывает поток, а не закрывает массив"""
+    response = run(_json_array_response(failing_movements(1)(["MOV-1", "MOV-2"])))
+    sent = []
+
+    async def read_body():
+        async for chunk in response.body_iterator:
+            sent.append(chunk)
+
+    with pytest.raises(ConnectionError):
+        run(read_body())
+
+    assert response.status_code == 200
+    assert "".join(sent).startswith('[{"movement_id":"MOV-1"') and not "".join(sent).endswith("]")
+    assert "Ответ прерван после 1 элементов: БД недоступна" in caplog.text
@@ -0,0 +1,11 @@
+from app.models.database import database, movements, warehouse_states
+from app.seed import MOVEMENT_ID, WAREHOUSE_ID, seed_demo_data
+
+
+def test_seed_is_idempotent(run):
+    assert run(seed_demo_data())
+    assert not run(seed_demo_data())
+
+    stock = run(database.fetch_all(warehouse_states.select().where(warehouse_states.c.warehouse_id == WAREHOUSE_ID)))
+    assert [row["quantity"] for row in stock] == [100]
+    assert run(database.fetch_one(movements.select().where(movements.c.movement_id == MOVEMENT_ID)))
@@ -0,0 +1,173 @@
+from datetime import datetime
+
+import pytest
+
+from app.models.database import database, warehouse_states, processed_events, stock_events, dead_letter_events
+from app.models.schemas import KafkaMessage
+from app.services.dead_letter import flush_stock_buffer
+from app.services.kafka_consumer import KafkaConsumerService, _RebalanceListener
+from app.services.ledger import ledger_row
+from app.services.stock_buffer import StockWriteBuffer
+from app.services.warehouse_services import get_warehouse_state, process_batch, process_message
+from tests.test_kafka_consumer import FakeKafkaConsumer, Record, encode, make_event
+
+
+@pytest.fixture
+def buffer(monkeypatch):
+    buffer = StockWriteBuffer(enabled=True, interval=3600, max_events=10000)
+    monkeypatch.setattr("app.services.warehouse_services.stock_buffer", buffer)
+    monkeypatch.setattr("app.services.kafka_consumer.stock_buffer", buffer)
+    monkeypatch.setattr("app.services.dead_letter.stock_buffer", buffer)
+    return buffer
+
+
+def stored_quantity(run):
+    return run(database.fetch_val(warehouse_states.select().with_only_columns(warehouse_states.c.quantity)
+                                  .where(warehouse_states.c.id == "WH-1:PROD-1")))
+
+
+def test_deltas_coalesce_until_flush(run, buffer):
+    """События копятся в буфере, чтение видит их сразу, БД — после одного flush"""
+    for number, quantity in enumerate((10, 20, 30)):
+        assert run(process_message(KafkaMessage(**make_event(f"MOV-{number}", "WH-1", "departure", quantity))))
+
+    assert stored_quantity(run) == 100
+    assert run(get_warehouse_state("WH-1", "PROD-1")).quantity == 40
+
+    run(buffer.flush())
+
+    assert stored_quantity(run) == 40
+    assert run(get_warehouse_state("WH-1", "PROD-1")).quantity == 40
+    assert len(run(database.fetch_all(processed_events.select()))) == 3
+    ledger = run(database.fetch_all(stock_events.select().order_by(stock_events.c.id)))
+    assert [(row["delta"], row["quantity_after"]) for row in ledger] == [(-10, 90), (-20, 70), (-30, 40)]
+
+
+def test_departure_checked_against_buffered_stock(run, buffer):
+    assert run(process_message(KafkaMessage(**make_event("MOV-1", "WH-1", "departure", 80))))
+    assert not run(process_message(KafkaMessage(**make_event("MOV-2", "WH-1", "departure", 30))))
+
+    run(buffer.flush())
+
+    assert stored_quantity(run) == 20
+
+
+def test_offsets_committed_only_after_flush(run, buffer):
+    """Смещения фиксируются лишь при сбросе буфера — здесь при остановке потребителя"""
+    service = KafkaConsumerService("localhost:9092", "warehouse_events", loop=run.loop, batch_mode=False)
+    fake = FakeKafkaConsumer(service, [
+        [Record(0, encode(make_event("MOV-1", "WH-1", "departure", 10)))],
+        [Record(1, encode(make_event("MOV-2", "WH-1", "departure", 5)))],
+    ])
+    fake.poll_quantities = []
+    original_poll = fake.poll
+
+    def poll(*args, **kwargs):
+        fake.poll_quantities.append(stored_quantity(run))
+        return original_poll(*args, **kwargs)
+
+    fake.poll = poll
+    service._create_consumer = lambda: fake
+
+    service._consume()
+
+    assert fake.poll_quantities == [100, 100, 100]
+    assert fake.commits == [2]
+    assert stored_quantity(run) == 85
+
+
+def test_database_error_in_buffered_mode_fails_event_not_batch(run, buffer, monkeypatch):
+    """Ошибка БД при проверке повтора — отказ одного события, а не исключение из process_batch"""
+    async def unavailable(event_id):
+        raise ConnectionError("БД недоступна")
+
+    monkeypatch.setattr("app.services.idempotency.is_processed", unavailable)
+    messages = [KafkaMessage(**make_event("MOV-1", "WH-1", "departure", 10))]
+
+    [result] = run(process_batch(messages))
+    assert isinstance(result, ConnectionError)
+    assert len(buffer) == 0
+
+
+def test_flush_skips_events_still_being_processed(run, buffer):
+    """Дельта события без confirm() не записывается, и revert() после flush безопасен"""
+    finished, in_progress = (
+        ledger_row(f"MOV-{number}:departure", f"MOV-{number}", "WH-1", "PROD-1", -quantity, datetime(2025, 2, 18))
+        for number, quantity in ((1, 10), (2, 20))
+    )
+    for event in (finished, in_progress):
+        assert run(buffer.apply(event)) is not None
+    buffer.confirm(finished)
+
+    run(buffer.flush())
+
+    assert stored_quantity(run) == 90
+    assert buffer.has_event(in_progress["event_id"]) and buffer.pending_delta("WH-1", "PROD-1") == -20
+    buffer.revert(in_progress)
+    run(buffer.flush())
+    assert stored_quantity(run) == 90 and len(buffer) == 0
+
+
+def test_rejected_delta_is_dead_lettered_and_rest_is_written(run, buffer):
+    """Остаток изменился мимо буфера: расход, нарушающий CHECK, уходит в dead letter, остальное пишется"""
+    for number, quantity in enumerate((10, 20, 30)):
+        assert run(process_message(KafkaMessage(**make_event(f"MOV-{number}", "WH-1", "departure", quantity))))
+    run(database.execute(warehouse_states.update().values(quantity=35)))
+
+    assert run(flush_stock_buffer()) == {"MOV-2:departure"}
+
+    assert stored_quantity(run) == 5 and len(buffer) == 0
+    ledger = run(database.fetch_all(stock_events.select().order_by(stock_events.c.id)))
+    assert [(row["event_id"], row["quantity_after"]) for row in ledger] == [("MOV-0:departure", 25), ("MOV-1:departure", 5)]
+    rows = run(database.fetch_all(dead_letter_events.select()))
+    assert [(row["event_id"], row["reason"], row["status"]) for row in rows] == [("MOV-2:departure", "rejected", "parked")]
+    assert KafkaMessage.model_validate_json(rows[0]["payload"]).data.quantity == 30
+
+
+def test_failed_flush_stops_polling_without_commit(run, buffer, monkeypatch):
+    """Ошибка записи буфера останавливает цикл poll; смещения не фиксируются, события остаются в буфере"""
+    async def unavailable():
+        raise ConnectionError("БД недоступна")
+
+    monkeypatch.setattr(buffer, "flush", unavailable)
+    buffer.max_events = 1
+    service = KafkaConsumerService("localhost:9092", "warehouse_events", loop=run.loop, batch_mode=False)
+    fake = FakeKafkaConsumer(service, [
+        [Record(0, encode(make_event("MOV-1", "WH-1", "departure", 10)))],
+        [Record(1, encode(make_event("MOV-2", "WH-1", "departure", 5)))],
+    ])
+    service._create_consumer = lambda: fake
+
+    service._consume()
+
+    assert fake.polled == 1 and fake.commits == []
+    assert len(buffer) == 1 and stored_quantity(run) == 100
+
+
+def test_failed_flush_on_revoke_stops_consumer_without_commit(run, buffer, monkeypatch):
+    """Ошибка записи буфера при отзыве партиций не проглатывается: цикл останавливается без фиксации"""
+    async def unavailable():
+        raise ConnectionError("БД недоступна")
+
+    monkeypatch.setattr(buffer, "flush", unavailable)
+    service = KafkaConsumerService("localhost:9092", "warehouse_events", loop=run.loop, batch_mode=False)
+    fake = FakeKafkaConsumer(service, [
+        [Record(0, encode(make_event("MOV-1", "WH-1", "departure", 10)))],
+        [Record(1, encode(make_event("MOV-2", "WH-1", "departure", 5)))],
+    ])
+    original_poll = fake.poll
+
+    def poll_with_rebalance(*args, **kwargs):
+        if fake.polled == 1:
+            # kafka-python вызывает колбэк внутри poll и игнорирует его исключения
+            _RebalanceListener(service).on_partitions_revoked([])
+        return original_poll(*args, **kwargs)
+
+    fake.poll = poll_with_rebalance
+    service._create_consumer = lambda: fake
+
+    service._consume()
+
+    assert service.failed and not service.should_stop
+    assert fake.polled == 2 and fake.commits == [] and fake.closed_with_autocommit is False
+    assert len(buffer) == 1 and stored_quantity(run) == 100
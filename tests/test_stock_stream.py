@@ -0,0 +1,50 @@
+import asyncio
+
+from app.models.schemas import KafkaMessage
+from app.services.stock_stream import StockHub, sse_events, stock_hub
+from app.services.warehouse_services import process_message
+from tests.test_kafka_consumer import make_event
+
+
+def test_hub_coalesces_updates_and_filters_subscribers():
+    """Изменения одной позиции склеиваются в последнее, чужие склады и товары не приходят"""
+    hub = StockHub(max_subscribers=10, max_pending=10)
+    by_warehouse = hub.subscribe(warehouse_ids=["WH-1"])
+    by_product = hub.subscribe(product_ids=["PROD-2"])
+
+    for quantity in (5, 4, 3):
+        hub.publish("WH-1", "PROD-1", quantity)
+    hub.publish("WH-2", "PROD-2", 7)
+    hub.publish("WH-2", "PROD-1", 1)
+
+    changes = asyncio.run(by_warehouse.next_changes(timeout=0.1))
+    assert [(change["product_id"], change["quantity"]) for change in changes] == [("PROD-1", 3)]
+    changes = asyncio.run(by_product.next_changes(timeout=0.1))
+    assert [(change["warehouse_id"], change["quantity"]) for change in changes] == [("WH-2", 7)]
+    assert asyncio.run(by_product.next_changes(timeout=0.01)) == []
+
+
+def test_hub_drops_slow_subscriber():
+    """Отставший подписчик отключается с событием dropped, остальные продолжают получать изменения"""
+    hub = StockHub(max_subscribers=10, max_pending=2)
+    slow = hub.subscribe(warehouse_ids=["WH-1"])
+    for product in ("PROD-1", "PROD-2", "PROD-3"):
+        hub.publish("WH-1", product, 1)
+
+    assert slow.dropped and len(hub) == 0
+
+    async def frames():
+        return [frame async for frame in sse_events(slow, heartbeat=0.01)]
+
+    assert asyncio.run(frames()) == [": subscribed\n\n", "event: dropped\ndata: {}\n\n"]
+
+
+def test_applied_event_is_published(run):
+    subscription = stock_hub.subscribe(warehouse_ids=["WH-1"])
+    try:
+        assert run(process_message(KafkaMessage(**make_event("MOV-1", "WH-1", "departure", 30))))
+        changes = run(subscription.next_changes(timeout=1))
+    finally:
+        stock_hub.unsubscribe(subscription)
+
+    assert [(change["product_id"], change["quantity"]) for change in changes] == [("PROD-1", 70)]
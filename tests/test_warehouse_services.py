@@ -0,0 +1,108 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+from app.models.database import database, warehouse_states, movements
+from app.services.warehouse_services import (
+    apply_stock_delta,
+    update_warehouse_state,
+    update_movement_departure,
+    update_movement_arrival,
+)
+
+
+def fetch_movement(run, movement_id):
+    return run(database.fetch_one(movements.select().where(movements.c.movement_id == movement_id)))
+
+
+def test_update_warehouse_state_upserts(run):
+    """Одна и та же операция создает новую запись и перезаписывает существующую"""
+    run(update_warehouse_state("WH-1", "PROD-1", 42))
+    run(update_warehouse_state("WH-2", "PROD-1", 7))
+
+    rows = run(database.fetch_all(warehouse_states.select().order_by(warehouse_states.c.id)))
+    assert [(row["id"], row["quantity"]) for row in rows] == [("WH-1:PROD-1", 42), ("WH-2:PROD-1", 7)]
+
+
+def test_movement_diffs_computed_in_statement(run):
+    """Разница считается при второй половине перемещения независимо от порядка прихода событий"""
+    departure = datetime(2025, 2, 18, 12, 12, 56)
+    arrival = datetime(2025, 2, 18, 14, 34, 56, 500000)
+
+    run(update_movement_departure("MOV-1", "WH-1", "PROD-1", departure, 100))
+    assert fetch_movement(run, "MOV-1")["time_difference_seconds"] is None
+    run(update_movement_arrival("MOV-1", "WH-2", "PROD-1", arrival, 97))
+
+    run(update_movement_arrival("MOV-2", "WH-2", "PROD-1", arrival, 100))
+    run(update_movement_departure("MOV-2", "WH-1", "PROD-1", departure, 100))
+
+    first, second = fetch_movement(run, "MOV-1"), fetch_movement(run, "MOV-2")
+    assert first["time_difference_seconds"] == 8520.5
+    assert first["quantity_difference"] == -3
+    assert second["source_warehouse"] == "WH-1"
+    assert second["destination_warehouse"] == "WH-2"
+    assert second["time_difference_seconds"] == 8520.5
+    assert second["quantity_difference"] == 0
+
+
+def test_movement_halves_commute_under_random_interleaving(run):
+    """
+    Половины перемещений (с повторами) приходят в случайном порядке и выполняются
+    конкурентно: итог совпадает с рассчитанным независимо от очередности.
+    """
+    departure_base = datetime(2025, 2, 18, 12, 0)
+    for seed in range(5):
+        rng = random.Random(seed)
+        expected, calls = {}, []
+        for number in range(20):
+            movement_id = f"MOV-{seed}-{number}"
+            departure = departure_base + timedelta(seconds=rng.randint(0, 3600))
+            arrival = departure + timedelta(seconds=rng.randint(1, 7200), milliseconds=rng.choice((0, 250, 500)))
+            sent, received = rng.randint(1, 100), rng.randint(1, 100)
+            halves = [
+                lambda m=movement_id, t=departure, q=sent: update_movement_departure(m, "WH-1", "PROD-1", t, q),
+                lambda m=movement_id, t=arrival, q=received: update_movement_arrival(m, "WH-2", "PROD-1", t, q),
+            ]
+            # Повторная доставка одной из половин
+            calls.extend(halves + [rng.choice(halves)])
+            expected[movement_id] = ((arrival - departure).total_seconds(), received - sent)
+        rng.shuffle(calls)
+
+        pending = iter(calls)
+
+        # Несколько конкурентных исполнителей, каждый со своим соединением
+        async def worker():
+            for call in pending:
+                await call()
+
+        async def apply_all():
+            await asyncio.gather(*(worker() for _ in range(8)))
+
+        run(apply_all())
+
+        for movement_id, (seconds, quantity_difference) in expected.items():
+            row = fetch_movement(run, movement_id)
+            assert (row["source_warehouse"], row["destination_warehouse"]) == ("WH-1", "WH-2")
+            assert row["time_difference_seconds"] == seconds
+            assert row["quantity_difference"] == quantity_difference
+
+
+def test_apply_stock_delta_concurrent_departures(run):
+    """Параллельные списания не уводят остаток ниже нуля и не теряют обновления"""
+    async def depart_all():
+        return await asyncio.gather(*(apply_stock_delta("WH-1", "PROD-1", -15) for _ in range(10)))
+
+    results = run(depart_all())
+
+    applied = [quantity for quantity in results if quantity is not None]
+    assert len(applied) == 6
+    assert sorted(applied) == [10, 25, 40, 55, 70, 85]
+    stock = run(database.fetch_one(warehouse_states.select().where(warehouse_states.c.id == "WH-1:PROD-1")))
+    assert stock["quantity"] == 10
+
+
+def test_apply_stock_delta_rejects_unknown_stock(run):
+    """Расход с отсутствующего склада отклоняется, приход создает запись"""
+    assert run(apply_stock_delta("WH-9", "PROD-1", -1)) is None
+    assert run(apply_stock_delta("WH-9", "PROD-1", 5)) == 5
+    assert run(apply_stock_delta("WH-9", "PROD-1", -5)) == 0